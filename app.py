@@ -19,6 +19,9 @@ import glob
 from flask_caching import Cache
 
 from data_loader import load_database
+from database_index import get_database_index, get_database_record
+from qc_metrics import QC_COLUMNS
+from table_export import parse_filter_query, filter_table
 
 dev_mode = False
 if not os.path.isdir('/app'):
@@ -28,8 +31,9 @@ logging.basicConfig(level=logging.WARNING)
 
 server = Flask(__name__)
 
-from routes import api_blueprint
+from routes import api_blueprint, MAX_REQUEST_BYTES
 server.register_blueprint(api_blueprint)
+server.config["MAX_CONTENT_LENGTH"] = MAX_REQUEST_BYTES
 
 app = dash.Dash(
     __name__, 
@@ -41,6 +45,10 @@ app = dash.Dash(
 
 app.title = 'Wang Lab - IDBac KB'
 
+# Compiling the scoring kernels (or loading them from the numba cache) before the first request
+from spectrum_similarity import warm_up_kernels
+warm_up_kernels()
+
 cache = Cache(app.server, config={
     'CACHE_TYPE': 'filesystem',
     'CACHE_DIR': 'temp/flask-cache',
@@ -151,24 +159,8 @@ def update_table_server_side(search, page_current, page_size, sort_by, filter_qu
         page_current = 0
 
     # --- Manual Filtering ---
-    # Simply a 'contains'
-    if filter_query and filter_query.strip():
-        filtering_expressions = filter_query.split(' && ')
-        for expression in filtering_expressions:
-            if ' icontains ' in expression:
-                col, val = expression.split(' icontains ')
-                col = col.strip('{ }')
-                val = val.strip(' "')
-                if col in df.columns:
-                    # contains (case-insensitive), instead of exact match
-                    df = df[df[col].astype(str).str.contains(val, case=False, na=False)]
-            elif ' scontains ' in expression:
-                col, val = expression.split(' scontains ')
-                col = col.strip('{ }')
-                val = val.strip(' "')
-                if col in df.columns:
-                    # contains (case-sensitive), instead of exact match
-                    df = df[df[col].astype(str).str.contains(val, case=True, na=False)]
+    # 'contains' on text columns, comparisons on the numeric (QC) columns
+    df = filter_table(df, parse_filter_query(filter_query))
     # ------------------------------------------
 
     # 3. Apply Sorting
@@ -202,6 +194,9 @@ def update_table_server_side(search, page_current, page_size, sort_by, filter_qu
     hidden_columns = [col for col in df.columns if col not in shown_columns]
 
     columns = [{"name": i, "id": i, "hideable": True} for i in shown_columns + hidden_columns]
+    for column in columns:
+        if column["id"] in QC_COLUMNS:
+            column["type"] = "numeric"
 
     # 7. Return the data for the current page, column definitions, hidden columns, and page count
     return [
@@ -278,10 +273,10 @@ def update_additional_data(table_data, table_selected):
     # Getting the database id
     database_id = selected_row["database_id"]
 
-    # Get the row in the dataframe
-    df = pd.DataFrame(load_database(None)[0])
-    selected_row = df[df["database_id"] == database_id]
-    data = selected_row.to_dict('records')[0]
+    # Get the row in the database
+    data = get_database_record(database_id)
+    if data is None:
+        return f"No database entry found for {database_id}"
 
     # Getting the taxonomies
     ordered_taxonomy_keys = [
@@ -0,0 +1,60 @@
+""" Times the mirror plot pipeline on two synthetic 1 Da binned spectra with ~20k peaks.
+
+Usage (from the repository root):
+    python benchmarks/mirror_plot_benchmark.py
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # Registers the pages
+from pages.mirror_plot import create_mirror_plot
+from spectrum_similarity import cosine_similarity, peaks_to_array, prepare_spectrum
+
+NUM_BINS = 20_000
+MASS_RANGE = [2_000, 2_000 + NUM_BINS]
+REPEATS = 5
+
+def _synthetic_spectrum(rng):
+    mz = np.arange(MASS_RANGE[0], MASS_RANGE[1], 1.0)
+    keep = rng.random(len(mz)) < 0.9
+    return {"peaks": [{"mz": float(m), "i": float(i)} for m, i in zip(mz[keep], rng.random(keep.sum()))]}
+
+def _time(function, repeats=REPEATS):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+def main():
+    rng = np.random.default_rng(0)
+    spectrum_a = _synthetic_spectrum(rng)
+    spectrum_b = _synthetic_spectrum(rng)
+    print(f"Peaks: {len(spectrum_a['peaks'])} / {len(spectrum_b['peaks'])}")
+
+    # Kernels were warmed up when importing app
+    first_time, _ = _time(lambda: create_mirror_plot(spectrum_a, spectrum_b, MASS_RANGE), repeats=1)
+    print(f"first mirror plot:  {first_time * 1000:8.1f} ms")
+
+    pack_time, peaks_a = _time(lambda: peaks_to_array(spectrum_a))
+    peaks_b = peaks_to_array(spectrum_b)
+    prepare_time, prepared_a = _time(lambda: prepare_spectrum(peaks_a, MASS_RANGE))
+    prepared_b = prepare_spectrum(peaks_b, MASS_RANGE)
+    score_time, _ = _time(lambda: cosine_similarity(prepared_a.copy(), prepared_b.copy(), tolerance=0.1, sqrt_transform=False))
+    plot_time, (fig, score) = _time(lambda: create_mirror_plot(spectrum_a, spectrum_b, MASS_RANGE))
+    json_time, fig_json = _time(fig.to_json)
+
+    print(f"peaks_to_array:     {pack_time * 1000:8.1f} ms")
+    print(f"prepare_spectrum:   {prepare_time * 1000:8.1f} ms")
+    print(f"cosine_similarity:  {score_time * 1000:8.1f} ms")
+    print(f"create_mirror_plot: {plot_time * 1000:8.1f} ms ({len(fig.data)} traces, score {score:.4f})")
+    print(f"figure to_json:     {json_time * 1000:8.1f} ms ({len(fig_json) / 1e6:.1f} MB)")
+
+if __name__ == "__main__":
+    main()
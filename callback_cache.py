@@ -0,0 +1,157 @@
+import hashlib
+import json
+import logging
+import pickle
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from dash import no_update
+
+from data_loader import redis_client, get_database_version
+
+# Results are first looked up in a per-worker LRU, then in Redis (shared by all workers)
+CACHE_KEY_PREFIX = 'callback_cache'
+CACHE_KEY_STATS = 'callback_cache:stats'
+REDIS_TIMEOUT = 24 * 60 * 60            # Entries of old database versions expire on their own
+MAX_ENTRY_BYTES = 8 * 1024 * 1024       # Larger results (pickled) are not cached at all
+LOCAL_MAX_BYTES = 64 * 1024 * 1024      # Default budget of each per-worker LRU, in pickled bytes
+
+_caches = {}
+_cache_bytes = {}
+_stats = {}
+_lock = threading.Lock()
+
+def _contains_no_update(result)->bool:
+    no_update_type = type(no_update)
+    if isinstance(result, no_update_type):
+        return True
+    if isinstance(result, (list, tuple)):
+        return any(isinstance(x, no_update_type) for x in result)
+    return False
+
+def _count(name:str, event:str):
+    with _lock:
+        _stats[name][event] += 1
+
+    if redis_client is not None:
+        try:
+            redis_client.hincrby(CACHE_KEY_STATS, f"{name}:{event}", 1)
+        except Exception as e:
+            logging.error(f"Failed to update callback cache stats: {e}")
+
+def memoize_callback(name:str=None, maxsize:int=64, version=get_database_version, max_bytes:int=LOCAL_MAX_BYTES):
+    """ Memoizes a pure function (typically a Dash callback) across requests and users.
+    The cache key contains the data version, so results are recomputed once the
+    database is updated.
+
+    Args:
+        name (str, optional): The cache name, defaults to the function name.
+        maxsize (int, optional): The number of results kept in the per-worker LRU.
+        version (callable, optional): Returns the current version of the underlying data.
+        max_bytes (int, optional): The total pickled size of the results kept in the per-worker LRU.
+
+    Returns:
+        callable: The decorator.
+    """
+    def decorator(func):
+        cache_name = name or f"{func.__module__}.{func.__name__}"
+        local_cache = OrderedDict()     # key -> (result, pickled size)
+        _caches[cache_name] = local_cache
+        _cache_bytes[cache_name] = 0
+        _stats[cache_name] = {"hits": 0, "redis_hits": 0, "misses": 0}
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            data_version = version()
+            if data_version is None:
+                # No versioned data to key on
+                return func(*args, **kwargs)
+
+            try:
+                arguments = json.dumps([args, kwargs], sort_keys=True, default=str)
+            except (TypeError, ValueError):
+                return func(*args, **kwargs)
+            key = f"{CACHE_KEY_PREFIX}:{cache_name}:{data_version}:{hashlib.sha1(arguments.encode('utf-8')).hexdigest()}"
+
+            # Getting the result from the local LRU
+            with _lock:
+                if key in local_cache:
+                    local_cache.move_to_end(key)
+                    result = local_cache[key][0]
+                    _stats[cache_name]["hits"] += 1
+                    return result
+
+            # Getting the result from Redis
+            result = None
+            result_bytes = None
+            if redis_client is not None:
+                try:
+                    result_bytes = redis_client.get(key)
+                    if result_bytes is not None:
+                        result = pickle.loads(result_bytes)
+                except Exception as e:
+                    logging.error(f"Error reading callback cache {cache_name}: {e}")
+
+            if result is not None:
+                _count(cache_name, "redis_hits")
+            else:
+                _count(cache_name, "misses")
+                result = func(*args, **kwargs)  # PreventUpdate and errors are not cached
+
+                if _contains_no_update(result):
+                    return result
+
+                try:
+                    result_bytes = pickle.dumps(result)
+                except Exception as e:
+                    logging.error(f"Error serializing callback cache {cache_name}: {e}")
+                    return result
+
+                if len(result_bytes) > MAX_ENTRY_BYTES:
+                    return result
+
+                if redis_client is not None:
+                    try:
+                        redis_client.set(key, result_bytes, ex=REDIS_TIMEOUT)
+                    except Exception as e:
+                        logging.error(f"Error writing callback cache {cache_name}: {e}")
+
+            result_size = len(result_bytes)
+            if result_size > min(MAX_ENTRY_BYTES, max_bytes):
+                return result
+
+            with _lock:
+                if key in local_cache:
+                    _cache_bytes[cache_name] -= local_cache[key][1]
+                local_cache[key] = (result, result_size)
+                local_cache.move_to_end(key)
+                _cache_bytes[cache_name] += result_size
+                while len(local_cache) > maxsize or _cache_bytes[cache_name] > max_bytes:
+                    _cache_bytes[cache_name] -= local_cache.popitem(last=False)[1][1]
+
+            return result
+
+        return wrapper
+    return decorator
+
+def get_cache_stats()->dict:
+    """ Returns the hit/miss counters of all memoized callbacks.
+
+    Returns:
+        dict: {'worker': {name: {...}}, 'all_workers': {name: {...}}}. The Redis hits and
+              misses are aggregated over all workers, local hits are per worker.
+    """
+    with _lock:
+        worker_stats = {cache_name: dict(stats, size=len(_caches[cache_name]), bytes=_cache_bytes[cache_name]) for cache_name, stats in _stats.items()}
+
+    all_worker_stats = {}
+    if redis_client is not None:
+        try:
+            for field, value in redis_client.hgetall(CACHE_KEY_STATS).items():
+                cache_name, event = field.decode("utf-8").rsplit(":", 1)
+                all_worker_stats.setdefault(cache_name, {})[event] = int(value)
+        except Exception as e:
+            logging.error(f"Error reading callback cache stats: {e}")
+
+    return {"worker": worker_stats, "all_workers": all_worker_stats}
@@ -7,12 +7,15 @@ import logging
 import time
 import threading
 import redis
-import pickle
+import json
+
+from release_store import RELEASE_CHANNEL, release_path
+from summary_store import read_summary_tsv
 
 app = dash.Dash(__name__, suppress_callback_exceptions=True)
 server = app.server
 
-# Redis-based cache with stale-while-revalidate pattern
+# Redis carries the release notifications
 # Works across multiple workers since Redis is shared
 try:
     redis_client = redis.Redis(host='idbac-kb-redis', port=6379, db=0, decode_responses=False)
@@ -22,119 +25,183 @@ except Exception as e:
     logging.error(f"Failed to connect to Redis: {e}")
     redis_client = None
 
-_cache_check_interval = 30  # Check for updates every 30 seconds
+# Outputs of the published release (see release_store)
+SUMMARY_FILENAME = "summary.tsv"
+SUMMARY_STATISTICS_FILENAME = "summary_statistics.json"
 
-CACHE_KEY_DATA = 'database:summary:data'
-CACHE_KEY_MTIME = 'database:summary:mtime'
-CACHE_KEY_LAST_CHECK = 'database:summary:last_check'
-CACHE_KEY_REFRESH_LOCK = 'database:summary:refresh_lock'
+RESUBSCRIBE_DELAY = 5           # Seconds to wait before resubscribing after losing Redis
+RELEASE_CHECK_INTERVAL = 60     # Seconds between checks of the subscription and the published release
 
-def _refresh_database_background():
-    """Background task to refresh database cache in Redis."""
-    
-    if redis_client is None:
-        return
-    
-    file_path = "database/summary.tsv"
-    
-    try:
-        if not os.path.exists(file_path):
-            logging.error("Database Summary File Not Found at database/summary.tsv")
+# Each worker keeps the database in memory, swapped when a new release is published
+_database = {"path": None, "mtime": None, "data": None}
+_database_lock = threading.Lock()
+_reload_lock = threading.Lock()
+_subscriber = {"pid": None}
+
+def _reload_database():
+    """Loads the summary of the published release into this worker, unless it is
+    already loaded. Files of a release are never rewritten, so the path and
+    modification time identify the version."""
+    with _reload_lock:
+        file_path = release_path(SUMMARY_FILENAME)
+        try:
+            file_mtime = os.path.getmtime(file_path)
+        except OSError:
+            logging.error(f"Database Summary File Not Found at {file_path}")
+            return
+
+        if _database["path"] == file_path and _database["mtime"] == file_mtime:
+            return
+
+        logging.info(f"Loading database from {file_path}")
+        try:
+            summary_df = read_summary_tsv(file_path)
+        except Exception as e:
+            logging.error(f"Error Loading Database Summary File: {e}")
             return
-        
-        file_mtime = os.path.getmtime(file_path)
-        
-        # Check if file has changed
-        cached_mtime_bytes = redis_client.get(CACHE_KEY_MTIME)
-        if cached_mtime_bytes is not None:
-            cached_mtime = float(cached_mtime_bytes)
-            if cached_mtime == file_mtime:
-                # No changes needed
-                return
-        
-        # File changed or no cache - reload
-        logging.info(f"Reloading database from {file_path} in background")
-        summary_df = pd.read_csv(file_path, sep="\t")
         data = summary_df.to_dict('records')
-        
-        # Update Redis cache
-        redis_client.set(CACHE_KEY_DATA, pickle.dumps(data))
-        redis_client.set(CACHE_KEY_MTIME, str(file_mtime))
-        
-        logging.info("Database reload complete")
-    except Exception as e:
-        logging.error(f"Error reloading database in background: {e}")
-    finally:
-        # Release the distributed lock
-        redis_client.delete(CACHE_KEY_REFRESH_LOCK)
 
-def load_database(search):
-    """Load database with stale-while-revalidate pattern using Redis.
-    Returns cached data immediately, triggers background refresh if needed."""
-    
-    # Fallback to direct file read if Redis is unavailable
+        with _database_lock:
+            _database["path"] = file_path
+            _database["mtime"] = file_mtime
+            _database["data"] = data
+
+def _listen_for_releases():
+    """Reloads the database whenever a release is published. Runs in a thread of
+    each worker for the life of the process."""
+    while True:
+        pubsub = None
+        try:
+            # A connection of its own, pinged every RELEASE_CHECK_INTERVAL
+            subscriber_client = redis.Redis(
+                host='idbac-kb-redis', port=6379, db=0,
+                health_check_interval=RELEASE_CHECK_INTERVAL,
+                socket_keepalive=True,
+            )
+            pubsub = subscriber_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(RELEASE_CHANNEL)
+
+            # Catching up with releases published while not subscribed
+            _reload_database()
+
+            last_check = time.time()
+            while True:
+                message = pubsub.get_message(timeout=RELEASE_CHECK_INTERVAL)
+                if message is not None and message["type"] == "message":
+                    logging.info(f"Release {message['data']} published")
+                    _reload_database()
+
+                # A half-open connection raises no error and delivers no messages, so the
+                # published release is also checked periodically (from the file system)
+                if time.time() - last_check >= RELEASE_CHECK_INTERVAL:
+                    pubsub.check_health()
+                    _reload_database()
+                    last_check = time.time()
+        except Exception as e:
+            logging.error(f"Lost the release subscription: {e}")
+            if pubsub is not None:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+            time.sleep(RESUBSCRIBE_DELAY)
+
+def _ensure_subscribed():
+    """Starts the release subscriber of this worker process (once, after any fork)."""
+    if redis_client is None or _subscriber["pid"] == os.getpid():
+        return
+
+    with _database_lock:
+        if _subscriber["pid"] == os.getpid():
+            return
+        _subscriber["pid"] = os.getpid()
+
+    thread = threading.Thread(target=_listen_for_releases, daemon=True)
+    thread.start()
+
+def _ensure_loaded():
     if redis_client is None:
-        logging.warning("Redis unavailable, reading directly from file")
-        return _load_database_from_file()
-    
-    current_time = time.time()
-    
-    try:
-        # Check if it's time to refresh (but don't block on it)
-        last_check_bytes = redis_client.get(CACHE_KEY_LAST_CHECK)
-        last_check = float(last_check_bytes) if last_check_bytes else 0
-        should_refresh = (current_time - last_check) >= _cache_check_interval
-        
-        if should_refresh:
-            redis_client.set(CACHE_KEY_LAST_CHECK, str(current_time))
-            
-            # Try to acquire distributed lock across all workers
-            lock_acquired = redis_client.set(CACHE_KEY_REFRESH_LOCK, '1', nx=True, ex=60)
-            
-            if lock_acquired:
-                # This worker got the lock - start background refresh
-                thread = threading.Thread(target=_refresh_database_background, daemon=True)
-                thread.start()
-        
-        # Always return cached data immediately if available
-        cached_data_bytes = redis_client.get(CACHE_KEY_DATA)
-        if cached_data_bytes is not None:
-            cached_mtime_bytes = redis_client.get(CACHE_KEY_MTIME)
-            cached_mtime = float(cached_mtime_bytes) if cached_mtime_bytes else None
-            data = pickle.loads(cached_data_bytes)
-            return data, cached_mtime
-        
-        # First call ever - must load synchronously
-        logging.info("First load - loading database synchronously")
-        return _load_database_from_file(update_redis=True)
-        
-    except Exception as e:
-        logging.error(f"Error accessing Redis cache: {e}")
-        return _load_database_from_file()
-
-def _load_database_from_file(update_redis=False):
-    """Fallback: load database directly from file."""
-    file_path = "database/summary.tsv"
-    
-    if not os.path.exists(file_path):
-        logging.error("Database Summary File Not Found at database/summary.tsv")
-        return None, None
-    
+        # No notifications without Redis, checking the published release on every call
+        _reload_database()
+    elif _database["data"] is None:
+        _reload_database()
+    _ensure_subscribed()
+
+def load_database_version():
+    """Returns the version (modification time) of the database served by load_database.
+
+    Returns:
+        float: The version, None if no database is loaded yet.
+    """
+    _ensure_loaded()
+    return _database["mtime"]
+
+def load_database(search):
+    """Returns the database held by this worker. It is loaded on the first call and
+    swapped by the release subscriber when a new release is published, so Redis is
+    not accessed here.
+
+    Returns:
+        tuple: The records (shared, not to be modified) and the version, (None, None)
+            if the summary is not available.
+    """
+    _ensure_loaded()
+    with _database_lock:
+        return _database["data"], _database["mtime"]
+
+
+_summary_statistics_cache = {"mtime": None, "data": None}
+
+def load_summary_statistics():
+    """Load the summary statistics written by the summarize task. The parsed file is
+    memoized per worker and only reread when its modification time changes.
+
+    Returns:
+        dict: The summary statistics, None if the file is missing or unreadable.
+    """
+    summary_statistics_path = release_path(SUMMARY_STATISTICS_FILENAME)
     try:
-        summary_df = pd.read_csv(file_path, sep="\t")
-        file_mtime = os.path.getmtime(file_path)
-        data = summary_df.to_dict('records')
-        
-        # Update Redis if requested and available
-        if update_redis and redis_client is not None:
-            try:
-                redis_client.set(CACHE_KEY_DATA, pickle.dumps(data))
-                redis_client.set(CACHE_KEY_MTIME, str(file_mtime))
-                redis_client.set(CACHE_KEY_LAST_CHECK, str(time.time()))
-            except Exception as e:
-                logging.error(f"Failed to update Redis cache: {e}")
-        
-        return data, file_mtime
-    except Exception as e:
-        logging.error(f"Error Loading Database Summary File: {e}")
-        return None, None
+        file_mtime = os.path.getmtime(summary_statistics_path)
+    except OSError:
+        return None
+
+    if _summary_statistics_cache["mtime"] != file_mtime:
+        try:
+            with open(summary_statistics_path, "r", encoding='utf-8') as f:
+                _summary_statistics_cache["data"] = json.load(f)
+            _summary_statistics_cache["mtime"] = file_mtime
+        except Exception as e:
+            logging.error(f"Error Loading Summary Statistics: {e}")
+            return None
+
+    return _summary_statistics_cache["data"]
+
+def get_summary_statistics_version():
+    """Returns the version (modification time) of the loaded summary statistics."""
+    load_summary_statistics()
+    return _summary_statistics_cache["mtime"]
+
+if os.path.isdir('/app'):
+    NEXTFLOW_OUTPUT_FOLDER = "/app/workflows/idbac_summarize_database/nf_output"
+else:
+    NEXTFLOW_OUTPUT_FOLDER = "workflows/idbac_summarize_database/nf_output"
+
+def get_database_version():
+    """Returns a version string of the served data. It changes whenever the summary
+    or the processed spectra (nextflow output) are rewritten.
+
+    Returns:
+        str: The version, built from the modification times of both outputs.
+    """
+    version_files = [
+        release_path(SUMMARY_FILENAME),
+        os.path.join(NEXTFLOW_OUTPUT_FOLDER, "idbac_database.json.sha256"),
+    ]
+
+    mtimes = []
+    for version_file in version_files:
+        try:
+            mtimes.append(str(os.path.getmtime(version_file)))
+        except OSError:
+            mtimes.append("missing")
+    return "-".join(mtimes)
@@ -0,0 +1,192 @@
+import threading
+from bisect import bisect_left, bisect_right
+
+from data_loader import load_database, load_database_version
+
+# Maximum number of options returned per keystroke
+SEARCH_RESULT_LIMIT = 50
+
+# Fields searched for each dropdown search type
+SEARCH_FIELDS = {
+    "strain_name": "Strain name",
+    "database_id": "database_id",
+}
+
+class _FieldIndex:
+    """ Prefix and substring index over one field of the database. """
+
+    def __init__(self, labels:list, values:list):
+        keys = [label.lower().replace("\n", " ") for label in labels]
+        order = sorted(range(len(labels)), key=lambda i: keys[i])
+        self.labels = [labels[i] for i in order]
+        self.values = [values[i] for i in order]
+        self.keys = [keys[i] for i in order]
+        self.value_positions = {value: i for i, value in enumerate(self.values)}
+
+        # All keys in one string, so substring matches are found by str.find (in C)
+        self.haystack = "\n".join(self.keys)
+        self.offsets = []
+        offset = 0
+        for key in self.keys:
+            self.offsets.append(offset)
+            offset += len(key) + 1
+
+    def search(self, query:str, limit:int)->list:
+        """ Returns the positions of the matching entries, prefix matches first.
+
+        Args:
+            query (str): The lower case query.
+            limit (int): The maximum number of results.
+
+        Returns:
+            list: Positions into labels/values.
+        """
+        # Prefix matches are a contiguous range of the sorted keys
+        start = bisect_left(self.keys, query)
+        end = min(bisect_right(self.keys, query + "\uffff"), start + limit)
+        positions = list(range(start, end))
+        seen = set(positions)
+
+        # Substring matches
+        found = self.haystack.find(query)
+        while found != -1 and len(positions) < limit:
+            position = bisect_right(self.offsets, found) - 1
+            if position not in seen:
+                seen.add(position)
+                positions.append(position)
+            # Continuing after the current key
+            found = self.haystack.find(query, self.offsets[position] + len(self.keys[position]) + 1)
+
+        return positions
+
+class DatabaseIndex:
+    """ Search structures over the database, built once per database version. """
+
+    def __init__(self, database:list):
+        self.database = database
+
+        # Exact lookups
+        self.id_positions = {}
+        self.strain_ids = {}
+        for position, entry in enumerate(database):
+            database_id = str(entry.get("database_id", ""))
+            self.id_positions.setdefault(database_id, position)
+            self.strain_ids.setdefault(str(entry.get("Strain name", "")), []).append(database_id)
+
+        self.field_indices = {}
+        for search_type, field in SEARCH_FIELDS.items():
+            labels = [str(entry.get(field, "")) for entry in database]
+            values = [str(entry.get("database_id", "")) for entry in database]
+            self.field_indices[search_type] = _FieldIndex(labels, values)
+
+    def get_position(self, database_id:str)->int:
+        """ Returns the row position of a database id in the database.
+
+        Args:
+            database_id (str): The database id.
+
+        Returns:
+            int: The position, None if the database id is unknown.
+        """
+        return self.id_positions.get(str(database_id).strip())
+
+    def get_record(self, database_id:str)->dict:
+        """ Returns the database entry of a database id.
+
+        Args:
+            database_id (str): The database id.
+
+        Returns:
+            dict: The entry, None if the database id is unknown.
+        """
+        position = self.get_position(database_id)
+        if position is None:
+            return None
+        return self.database[position]
+
+    def get_ids_for_strain(self, strain_name:str)->list:
+        """ Returns the database ids of a strain name.
+
+        Args:
+            strain_name (str): The exact strain name.
+
+        Returns:
+            list: The database ids, in database order.
+        """
+        return self.strain_ids.get(str(strain_name), [])
+
+    def search(self, search_type:str, query:str, limit:int=SEARCH_RESULT_LIMIT)->list:
+        """ Searches the database for a strain name or database id.
+
+        Args:
+            search_type (str): 'strain_name' or 'database_id'.
+            query (str): The (partial) text typed by the user, case insensitive.
+            limit (int, optional): The maximum number of results.
+
+        Returns:
+            list: Dropdown options ({'label', 'value'}), prefix matches first.
+        """
+        field_index = self.field_indices[search_type]
+        query = str(query or "").strip().lower()
+
+        if query == "":
+            positions = range(min(limit, len(field_index.labels)))
+        else:
+            positions = field_index.search(query, limit)
+
+        return [{"label": field_index.labels[i], "value": field_index.values[i]} for i in positions]
+
+    def get_option(self, search_type:str, database_id:str)->dict:
+        """ Returns the dropdown option of a database id.
+
+        Args:
+            search_type (str): 'strain_name' or 'database_id'.
+            database_id (str): The database id.
+
+        Returns:
+            dict: The option ({'label', 'value'}), None if the database id is unknown.
+        """
+        field_index = self.field_indices[search_type]
+        position = field_index.value_positions.get(database_id)
+        if position is None:
+            return None
+        return {"label": field_index.labels[position], "value": field_index.values[position]}
+
+_index_cache = {"version": None, "index": None}
+_index_lock = threading.Lock()
+
+def get_database_index()->DatabaseIndex:
+    """ Returns the index of the current database, rebuilding it when the database changes.
+
+    Returns:
+        DatabaseIndex: The index, None if the database is not available.
+    """
+    # Checking the version first, so an up to date index does not load the database
+    version = load_database_version()
+    with _index_lock:
+        if version is not None and _index_cache["index"] is not None and _index_cache["version"] == version:
+            return _index_cache["index"]
+
+    database, version = load_database(None)
+    if database is None:
+        return None
+
+    with _index_lock:
+        if _index_cache["index"] is None or _index_cache["version"] != version:
+            _index_cache["index"] = DatabaseIndex(database)
+            _index_cache["version"] = version
+        return _index_cache["index"]
+
+def get_database_record(database_id:str)->dict:
+    """ Returns one entry of the current database, from the index of this worker.
+
+    Args:
+        database_id (str): The database id.
+
+    Returns:
+        dict: The entry, None if the database id is unknown.
+    """
+    database_index = get_database_index()
+    if database_index is None:
+        return None
+    return database_index.get_record(str(database_id).strip())
@@ -0,0 +1,644 @@
+import os
+import sys
+import json
+import glob
+import struct
+import zlib
+import fcntl
+import mmap
+from time import time
+
+# Journaled storage for depositions. Instead of one file per deposit, records are
+# appended to segment files. Every record is
+#
+#   magic (4s) | record type (B) | payload length (I) | ULID (26s) | crc32 of payload (I) | payload
+#
+# where the payload is the deposition JSON (empty for deletions). The segment
+# format is also read by workflows/idbac_summarize_database/bin/format_database.py,
+# keep both in sync.
+#
+# Only the highest numbered segment is appended to, all others are sealed and are
+# only ever rewritten by compact_journal. Writers and the compaction hold the
+# journal lock while they touch the index or swap segments.
+
+JOURNAL_FOLDER = "database/depositions/journal"
+INDEX_FILENAME = "index.ndjson"
+LOCK_FILENAME = "journal.lock"
+
+RECORD_MAGIC = b"IDBJ"
+RECORD_HEADER = struct.Struct("<4sBI26sI")
+RECORD_PUT = 0
+RECORD_DELETE = 1
+
+SEGMENT_MAX_BYTES = 256 * 1024 * 1024
+FSYNC_BATCH_SIZE = 32       # fsync after this many records...
+FSYNC_INTERVAL = 5.0        # ...or this many seconds, whichever comes first, while appending
+
+def _segment_name(segment_number:int)->str:
+    return f"segment-{segment_number:06d}.seg"
+
+def _segment_number(segment_path:str)->int:
+    return int(os.path.basename(segment_path).split("-")[1].split(".")[0])
+
+def list_segments(folder:str=JOURNAL_FOLDER)->list:
+    """ Returns the segment files of the journal, oldest first.
+
+    Args:
+        folder (str): The journal folder.
+
+    Returns:
+        list: Paths to the segment files.
+    """
+    return sorted(glob.glob(os.path.join(folder, "segment-*.seg")), key=_segment_number)
+
+def _encode_record(database_id:str, record_type:int, payload:bytes)->bytes:
+    header = RECORD_HEADER.pack(RECORD_MAGIC, record_type, len(payload), database_id.encode("ascii"), zlib.crc32(payload))
+    return header + payload
+
+def _index_entry(database_id:str, segment:str, offset:int, record_type:int, payload_length:int, metadata:dict)->dict:
+    return {
+        "database_id": database_id,
+        "segment": segment,
+        "offset": offset,
+        "length": payload_length,
+        "type": record_type,
+        "metadata": metadata,
+    }
+
+def _metadata_from_deposition(deposit_dict:dict)->dict:
+    return {key: value for key, value in deposit_dict.items() if key != "spectrum"}
+
+def _find_record_header(f, offset:int)->int:
+    """ Returns the offset of the next record magic at or after offset, -1 if there is none. """
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as segment_map:
+        return segment_map.find(RECORD_MAGIC, offset)
+
+def iter_segment(segment_path:str, verify:bool=True, start_offset:int=0):
+    """ Iterates over the records of a segment. Records with a bad checksum are skipped,
+    and after a malformed record iteration resumes at the next record header.
+
+    Args:
+        segment_path (str): Path to the segment file.
+        verify (bool): Whether to read and verify the payloads. If False, payload is None.
+        start_offset (int): The offset of the first record to read.
+
+    Yields:
+        tuple: (offset, record_type, database_id, payload)
+    """
+    file_size = os.path.getsize(segment_path)
+    with open(segment_path, "rb") as f:
+        offset = start_offset
+        while offset + RECORD_HEADER.size <= file_size:
+            f.seek(offset)
+            magic, record_type, payload_length, database_id, checksum = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+            if magic != RECORD_MAGIC or offset + RECORD_HEADER.size + payload_length > file_size:
+                next_offset = _find_record_header(f, offset + 1)
+                if next_offset < 0:
+                    break
+                print(f"Malformed record in {segment_path} at offset {offset}, skipping to offset {next_offset}", file=sys.stderr, flush=True)
+                offset = next_offset
+                continue
+
+            payload = None
+            if verify:
+                payload = f.read(payload_length)
+                if zlib.crc32(payload) != checksum:
+                    print(f"Checksum mismatch in {segment_path} at offset {offset}", file=sys.stderr, flush=True)
+                    offset += RECORD_HEADER.size + payload_length
+                    continue
+
+            yield offset, record_type, database_id.decode("ascii"), payload
+            offset += RECORD_HEADER.size + payload_length
+
+class JournalCorruptError(Exception):
+    """ Raised when a segment is damaged before its end, where truncating it would drop good records. """
+
+def _valid_length(segment_path:str)->int:
+    """ Returns the length of a segment without its torn tail, i.e. a last record that
+    was only partially written (short, or zero filled) when a writer crashed.
+
+    Args:
+        segment_path (str): Path to the segment file.
+
+    Raises:
+        JournalCorruptError: If a malformed record is followed by more data.
+
+    Returns:
+        int: The offset just after the last complete record.
+    """
+    file_size = os.path.getsize(segment_path)
+    valid_length = 0
+    with open(segment_path, "rb") as f:
+        while valid_length < file_size:
+            f.seek(valid_length)
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                # Short header at the end
+                break
+
+            magic, _, payload_length, _, checksum = RECORD_HEADER.unpack(header)
+            record_end = valid_length + RECORD_HEADER.size + payload_length
+            if magic == RECORD_MAGIC and record_end <= file_size:
+                if record_end == file_size and zlib.crc32(f.read(payload_length)) != checksum:
+                    # Last record with a partially written payload
+                    break
+                valid_length = record_end
+                continue
+
+            if magic == RECORD_MAGIC:
+                # Short payload at the end
+                break
+
+            f.seek(valid_length)
+            if f.read().strip(b"\0") == b"":
+                # Zero filled tail, the file was extended but the record never reached the disk
+                break
+
+            raise JournalCorruptError(f"Malformed record in {segment_path} at offset {valid_length} of {file_size} bytes")
+
+    return valid_length
+
+class DepositionJournal:
+    """ Appends depositions to the journal. Records are flushed to the OS on every
+    append and fsync'ed in batches of FSYNC_BATCH_SIZE records or FSYNC_INTERVAL
+    seconds while appending. The batch is only bounded by later appends, so call
+    sync() at the end of every unit of work (e.g. each deposit task).
+    """
+
+    def __init__(self, folder:str=JOURNAL_FOLDER):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+
+        self.index_path = os.path.join(folder, INDEX_FILENAME)
+        self.lock_path = os.path.join(folder, LOCK_FILENAME)
+
+        self._segment_file = None
+        self._index_file = None
+        self._pending = 0
+        self._last_sync = time()
+
+        with self._locked():
+            self._open_active_segment()
+            self._reconcile_index()
+
+    def _locked(self):
+        return _JournalLock(self.lock_path)
+
+    def _open_active_segment(self):
+        segments = list_segments(self.folder)
+        if len(segments) == 0:
+            segment_path = os.path.join(self.folder, _segment_name(1))
+        else:
+            segment_path = segments[-1]
+
+        # Drop a partially written record left by a crashed writer, damage anywhere else
+        # raises JournalCorruptError
+        if os.path.exists(segment_path):
+            valid_length = _valid_length(segment_path)
+            if valid_length != os.path.getsize(segment_path):
+                print(f"Truncating {segment_path} to {valid_length} bytes", file=sys.stderr, flush=True)
+                os.truncate(segment_path, valid_length)
+
+        if self._segment_file is not None:
+            self._segment_file.close()
+        self._segment_file = open(segment_path, "ab")
+        self.segment_path = segment_path
+
+    def _roll_segment(self):
+        self.sync()
+        next_segment = os.path.join(self.folder, _segment_name(_segment_number(self.segment_path) + 1))
+        self._segment_file.close()
+        self._segment_file = open(next_segment, "ab")
+        self.segment_path = next_segment
+
+    def _follow_active_segment(self):
+        # Another writer may have rolled to a new segment since our last append
+        segments = list_segments(self.folder)
+        if len(segments) > 0 and segments[-1] != self.segment_path:
+            self.sync()
+            self._segment_file.close()
+            self._segment_file = open(segments[-1], "ab")
+            self.segment_path = segments[-1]
+
+    def _reconcile_index(self):
+        """ Brings the index in line with the segments, when opening the journal. Records
+        that reached a segment but not the index (a crash between the two writes) are
+        indexed, and the index is rebuilt if it refers to segments that do not exist.
+        """
+        segments = list_segments(self.folder)
+        segment_names = set(os.path.basename(segment_path) for segment_path in segments)
+
+        # End of the indexed records of each segment
+        indexed_ends = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "rb") as f:
+                index_bytes = f.read()
+
+            # Drop a partially written last line, its record is indexed again below
+            complete_length = index_bytes.rfind(b"\n") + 1
+            if complete_length != len(index_bytes):
+                print(f"Truncating {self.index_path} to {complete_length} bytes", file=sys.stderr, flush=True)
+                os.truncate(self.index_path, complete_length)
+
+            for line in index_bytes[:complete_length].splitlines():
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if entry["segment"] not in segment_names:
+                    print(f"Index refers to missing segment {entry['segment']}, rebuilding it", file=sys.stderr, flush=True)
+                    _write_index(self.folder)
+                    return
+                record_end = entry["offset"] + RECORD_HEADER.size + entry["length"]
+                indexed_ends[entry["segment"]] = max(indexed_ends.get(entry["segment"], 0), record_end)
+
+        missing_entries = []
+        for segment_path in segments:
+            segment = os.path.basename(segment_path)
+            for offset, record_type, database_id, payload in iter_segment(segment_path, verify=True, start_offset=indexed_ends.get(segment, 0)):
+                metadata = None
+                if record_type == RECORD_PUT:
+                    metadata = _metadata_from_deposition(json.loads(payload))
+                missing_entries.append(_index_entry(database_id, segment, offset, record_type, len(payload), metadata))
+
+        if len(missing_entries) == 0:
+            return
+
+        print(f"Indexing {len(missing_entries)} records missing from {self.index_path}", file=sys.stderr, flush=True)
+        with open(self.index_path, "a") as f:
+            for entry in missing_entries:
+                f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _open_index(self):
+        # The compaction replaces the index file, so reopen if it is no longer ours
+        if self._index_file is not None:
+            try:
+                if os.fstat(self._index_file.fileno()).st_ino == os.stat(self.index_path).st_ino:
+                    return
+            except FileNotFoundError:
+                pass
+            self._index_file.close()
+        self._index_file = open(self.index_path, "a")
+
+    def _append(self, database_id:str, record_type:int, payload:bytes, metadata:dict):
+        record = _encode_record(database_id, record_type, payload)
+
+        with self._locked():
+            self._follow_active_segment()
+
+            # The file is opened for appending, its size is where the record goes
+            offset = os.fstat(self._segment_file.fileno()).st_size
+            if offset + len(record) > SEGMENT_MAX_BYTES and offset > 0:
+                self._roll_segment()
+                offset = os.fstat(self._segment_file.fileno()).st_size
+
+            self._segment_file.write(record)
+            self._segment_file.flush()
+
+            self._open_index()
+            entry = _index_entry(database_id, os.path.basename(self.segment_path), offset, record_type, len(payload), metadata)
+            self._index_file.write(json.dumps(entry) + "\n")
+            self._index_file.flush()
+
+        self._pending += 1
+        if self._pending >= FSYNC_BATCH_SIZE or time() - self._last_sync >= FSYNC_INTERVAL:
+            self.sync()
+
+    def append(self, database_id:str, deposit_dict:dict):
+        """ Appends a deposition.
+
+        Args:
+            database_id (str): The database id (ULID).
+            deposit_dict (dict): The full deposition, including the 'spectrum' key.
+        """
+        payload = json.dumps(deposit_dict).encode("utf-8")
+        self._append(database_id, RECORD_PUT, payload, _metadata_from_deposition(deposit_dict))
+
+    def delete(self, database_id:str):
+        """ Appends a deletion marker, the deposition is dropped at the next compaction.
+
+        Args:
+            database_id (str): The database id (ULID).
+        """
+        self._append(database_id, RECORD_DELETE, b"", None)
+
+    def sync(self):
+        """ Forces the appended records to disk. """
+        if self._pending == 0:
+            return
+        os.fsync(self._segment_file.fileno())
+        if self._index_file is not None:
+            os.fsync(self._index_file.fileno())
+        self._pending = 0
+        self._last_sync = time()
+
+    def close(self):
+        self.sync()
+        self._segment_file.close()
+        if self._index_file is not None:
+            self._index_file.close()
+
+class _JournalLock:
+    """ Exclusive advisory lock shared by the deposition worker and the compaction. """
+
+    def __init__(self, lock_path:str):
+        self.lock_path = lock_path
+
+    def __enter__(self):
+        self._file = open(self.lock_path, "a")
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+
+def load_index(folder:str=JOURNAL_FOLDER)->dict:
+    """ Loads the journal index, later records win and deletions remove entries.
+
+    Args:
+        folder (str): The journal folder.
+
+    Returns:
+        dict: database_id -> index entry.
+    """
+    index_path = os.path.join(folder, INDEX_FILENAME)
+    if not os.path.exists(index_path):
+        return {}
+
+    index = {}
+    with open(index_path, "r") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # Partially written last line
+                continue
+            if entry["type"] == RECORD_DELETE:
+                index.pop(entry["database_id"], None)
+            else:
+                index[entry["database_id"]] = entry
+
+    return index
+
+_index_cache = {"key": None, "index": {}}
+
+def _cached_index(folder:str)->dict:
+    index_path = os.path.join(folder, INDEX_FILENAME)
+    try:
+        stat = os.stat(index_path)
+    except FileNotFoundError:
+        return {}
+
+    key = (index_path, stat.st_ino, stat.st_size, stat.st_mtime)
+    if _index_cache["key"] != key:
+        _index_cache["index"] = load_index(folder)
+        _index_cache["key"] = key
+
+    return _index_cache["index"]
+
+def _read_payload(folder:str, entry:dict)->bytes:
+    segment_path = os.path.join(folder, entry["segment"])
+    with open(segment_path, "rb") as f:
+        f.seek(entry["offset"])
+        magic, _, payload_length, database_id, checksum = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+        if magic != RECORD_MAGIC or database_id.decode("ascii") != entry["database_id"]:
+            return None
+        payload = f.read(payload_length)
+        if zlib.crc32(payload) != checksum:
+            return None
+        return payload
+
+def read_deposition(database_id:str, folder:str=JOURNAL_FOLDER)->dict:
+    """ Reads a single deposition from the journal.
+
+    Args:
+        database_id (str): The database id (ULID).
+        folder (str): The journal folder.
+
+    Returns:
+        dict: The full deposition, None if it is not in the journal.
+    """
+    database_id = os.path.basename(str(database_id))
+    entry = _cached_index(folder).get(database_id)
+    if entry is None:
+        return None
+
+    try:
+        payload = _read_payload(folder, entry)
+    except FileNotFoundError:
+        payload = None
+
+    if payload is None:
+        # The segment may have been compacted since the index was loaded
+        _index_cache["key"] = None
+        entry = _cached_index(folder).get(database_id)
+        if entry is None:
+            return None
+        payload = _read_payload(folder, entry)
+        if payload is None:
+            return None
+
+    return json.loads(payload)
+
+def iter_metadata(folder:str=JOURNAL_FOLDER):
+    """ Iterates over the metadata of all live depositions in the journal, from the
+    index only, so no peak data is read.
+
+    Args:
+        folder (str): The journal folder.
+
+    Yields:
+        tuple: (database_id, metadata)
+    """
+    for database_id, entry in load_index(folder).items():
+        yield database_id, dict(entry["metadata"])
+
+def compact_journal(folder:str=JOURNAL_FOLDER, min_dead_fraction:float=0.25)->bool:
+    """ Rewrites the sealed segments without deleted, superseded or corrupt records,
+    packing them into as few segments as possible, and rewrites the index.
+    The active segment is never touched, so deposits can continue meanwhile.
+
+    Args:
+        folder (str): The journal folder.
+        min_dead_fraction (float): Only compact if at least this fraction of the sealed
+            bytes is dead, or if sealed segments can be packed into fewer files.
+
+    Returns:
+        bool: Whether a compaction was performed.
+    """
+    lock = _JournalLock(os.path.join(folder, LOCK_FILENAME))
+
+    with lock:
+        segments = list_segments(folder)
+    sealed_segments = segments[:-1]
+    if len(sealed_segments) == 0:
+        return False
+
+    # Deletions anywhere in the journal, including the active segment, apply
+    deleted = set()
+    latest = {}
+    for segment_path in segments:
+        for offset, record_type, database_id, _ in iter_segment(segment_path, verify=False):
+            if record_type == RECORD_DELETE:
+                deleted.add(database_id)
+                latest.pop(database_id, None)
+            else:
+                deleted.discard(database_id)
+                latest[database_id] = (os.path.basename(segment_path), offset)
+
+    # Only the locations of the live records are kept, the payloads are copied one at a time below
+    sealed_bytes = sum(os.path.getsize(segment_path) for segment_path in sealed_segments)
+    live_records = []
+    live_bytes = 0
+    for segment_path in sealed_segments:
+        segment = os.path.basename(segment_path)
+        with open(segment_path, "rb") as f:
+            for offset, record_type, database_id, _ in iter_segment(segment_path, verify=False):
+                if record_type != RECORD_PUT or latest.get(database_id) != (segment, offset):
+                    continue
+                f.seek(offset)
+                payload_length = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))[2]
+                live_records.append((database_id, segment, offset, payload_length))
+                live_bytes += RECORD_HEADER.size + payload_length
+
+    packed_segment_count = max(1, -(-live_bytes // SEGMENT_MAX_BYTES))
+    dead_fraction = 1.0 - live_bytes / sealed_bytes if sealed_bytes > 0 else 0.0
+    if dead_fraction < min_dead_fraction and packed_segment_count >= len(sealed_segments):
+        return False
+
+    print(f"Compacting {len(sealed_segments)} segments, {dead_fraction:.0%} dead", file=sys.stderr, flush=True)
+
+    # Write the packed segments next to the originals, reusing the lowest segment numbers
+    segment_numbers = [_segment_number(segment_path) for segment_path in sealed_segments]
+    new_segments = []
+    new_entries = []
+    current_file = None
+    source_file = None
+    for database_id, segment, offset, payload_length in live_records:
+        if source_file is None or os.path.basename(source_file.name) != segment:
+            if source_file is not None:
+                source_file.close()
+            source_file = open(os.path.join(folder, segment), "rb")
+
+        source_file.seek(offset)
+        checksum = RECORD_HEADER.unpack(source_file.read(RECORD_HEADER.size))[4]
+        payload = source_file.read(payload_length)
+        if zlib.crc32(payload) != checksum:
+            print(f"Checksum mismatch in {segment} at offset {offset}", file=sys.stderr, flush=True)
+            continue
+
+        record = _encode_record(database_id, RECORD_PUT, payload)
+        if current_file is None or (current_file.tell() + len(record) > SEGMENT_MAX_BYTES and current_file.tell() > 0):
+            if current_file is not None:
+                current_file.flush()
+                os.fsync(current_file.fileno())
+                current_file.close()
+            segment = _segment_name(segment_numbers[len(new_segments)])
+            new_segments.append(segment)
+            current_file = open(os.path.join(folder, segment + ".compact"), "wb")
+
+        offset = current_file.tell()
+        current_file.write(record)
+        metadata = _metadata_from_deposition(json.loads(payload))
+        new_entries.append(_index_entry(database_id, new_segments[-1], offset, RECORD_PUT, len(payload), metadata))
+
+    if source_file is not None:
+        source_file.close()
+    if current_file is not None:
+        current_file.flush()
+        os.fsync(current_file.fileno())
+        current_file.close()
+
+    with lock:
+        # Keep the index entries of the segments that were not compacted
+        sealed_names = set(os.path.basename(segment_path) for segment_path in sealed_segments)
+        index_path = os.path.join(folder, INDEX_FILENAME)
+        kept_lines = []
+        if os.path.exists(index_path):
+            with open(index_path, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if entry["segment"] not in sealed_names:
+                        kept_lines.append(line if line.endswith("\n") else line + "\n")
+
+        temp_index_path = index_path + ".compact"
+        with open(temp_index_path, "w") as f:
+            for entry in new_entries:
+                f.write(json.dumps(entry) + "\n")
+            f.writelines(kept_lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+        for segment in new_segments:
+            os.replace(os.path.join(folder, segment + ".compact"), os.path.join(folder, segment))
+        for segment_path in sealed_segments:
+            if os.path.basename(segment_path) not in new_segments:
+                os.remove(segment_path)
+        os.replace(temp_index_path, index_path)
+
+    return True
+
+def _write_index(folder:str):
+    # Called with the journal lock held
+    index_path = os.path.join(folder, INDEX_FILENAME)
+    temp_index_path = index_path + ".rebuild"
+    with open(temp_index_path, "w") as f:
+        for segment_path in list_segments(folder):
+            segment = os.path.basename(segment_path)
+            for offset, record_type, database_id, payload in iter_segment(segment_path, verify=True):
+                metadata = None
+                if record_type == RECORD_PUT:
+                    metadata = _metadata_from_deposition(json.loads(payload))
+                f.write(json.dumps(_index_entry(database_id, segment, offset, record_type, len(payload), metadata)) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_index_path, index_path)
+
+def rebuild_index(folder:str=JOURNAL_FOLDER):
+    """ Rebuilds the index by scanning all segments, e.g. after the index was lost.
+
+    Args:
+        folder (str): The journal folder.
+    """
+    lock = _JournalLock(os.path.join(folder, LOCK_FILENAME))
+    with lock:
+        _write_index(folder)
+
+def test_journal_recovery(tmp_path):
+    folder = str(tmp_path)
+    journal = DepositionJournal(folder)
+    for i in range(3):
+        journal.append(f"{i:026d}", {"spectrum": [[1000.0, 1.0]], "i": i})
+    journal.close()
+    segment_path = list_segments(folder)[0]
+    segment_size = os.path.getsize(segment_path)
+
+    # A crash left a torn record in the segment and a partial line in the index
+    with open(segment_path, "ab") as f:
+        f.write(_encode_record("9" * 26, RECORD_PUT, b'{"spectrum": []}')[:40])
+    index_path = os.path.join(folder, INDEX_FILENAME)
+    with open(index_path) as f:
+        lines = f.readlines()
+    with open(index_path, "w") as f:
+        f.writelines(lines[:2] + [lines[2][:10]])
+
+    journal = DepositionJournal(folder)
+    journal.close()
+    assert os.path.getsize(segment_path) == segment_size
+    assert sorted(load_index(folder)) == [f"{i:026d}" for i in range(3)]
+
+    # Damage before the end is not truncated away, readers skip over it
+    with open(segment_path, "r+b") as f:
+        f.write(b"XXXX")
+    try:
+        DepositionJournal(folder)
+        assert False
+    except JournalCorruptError:
+        pass
+    assert [record[2] for record in iter_segment(segment_path)] == [f"{i:026d}" for i in range(1, 3)]
@@ -0,0 +1,156 @@
+import os
+import json
+import gzip
+import hashlib
+import glob
+from time import time
+
+from ulid import ULID
+
+# Staging area shared by the web tier and the deposition worker. Payloads are
+# content-addressed by the sha256 of their canonical JSON, so only the reference
+# goes through the broker, and resubmitting an identical payload is a no-op.
+SPOOL_FOLDER = "staging/deposits"
+
+# Receipts answer status polls and deduplicate resubmissions for this long (seconds)
+RECEIPT_TTL = 7 * 24 * 3600
+
+def _spool_path(deposit_id:str, suffix:str)->str:
+    deposit_id = os.path.basename(str(deposit_id))
+    return os.path.join(SPOOL_FOLDER, deposit_id[:2], deposit_id + suffix)
+
+def payload_path(deposit_id:str)->str:
+    return _spool_path(deposit_id, ".json.gz")
+
+def receipt_path(deposit_id:str)->str:
+    return _spool_path(deposit_id, ".done.json")
+
+def _atomic_write(path:str, content:bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(content)
+    os.replace(temp_path, path)
+
+def spool_depositions(deposit_dicts:list)->str:
+    """ Writes depositions to the staging area.
+
+    Args:
+        deposit_dicts (list): The full depositions, including 'task', 'user' and 'spectrum'.
+
+    Returns:
+        str: The deposit id, i.e. the sha256 of the payload.
+    """
+    payload = json.dumps(deposit_dicts, sort_keys=True).encode("utf-8")
+    deposit_id = hashlib.sha256(payload).hexdigest()
+
+    # Identical payloads were already staged or deposited
+    if not os.path.exists(payload_path(deposit_id)) and not os.path.exists(receipt_path(deposit_id)):
+        _atomic_write(payload_path(deposit_id), gzip.compress(payload, compresslevel=1))
+
+    return deposit_id
+
+def staged_database_ids(deposit_id:str, count:int)->list:
+    """ Returns the database ids of staged depositions. They only depend on the deposit id,
+    the position of each deposition and when the payload was staged, so a retried deposit
+    stores the depositions it already stored under the same ids instead of duplicating them.
+
+    Args:
+        deposit_id (str): The deposit id returned by spool_depositions.
+        count (int): The number of staged depositions.
+
+    Returns:
+        list: The database ids (ULID), in deposition order.
+    """
+    staged_ms = int(os.path.getmtime(payload_path(deposit_id)) * 1000)
+
+    database_ids = []
+    for index in range(count):
+        randomness = hashlib.sha256(f"{deposit_id}:{index}".encode("utf-8")).digest()[:10]
+        database_ids.append(str(ULID.from_bytes(staged_ms.to_bytes(6, "big") + randomness)))
+    return database_ids
+
+def load_depositions(deposit_id:str)->list:
+    """ Loads staged depositions.
+
+    Args:
+        deposit_id (str): The deposit id returned by spool_depositions.
+
+    Returns:
+        list: The depositions, None if they are not staged.
+    """
+    path = payload_path(deposit_id)
+    if not os.path.exists(path):
+        return None
+
+    with open(path, "rb") as f:
+        return json.loads(gzip.decompress(f.read()))
+
+def complete_depositions(deposit_id:str, database_ids:list):
+    """ Records the database ids of staged depositions and removes the payload.
+
+    Args:
+        deposit_id (str): The deposit id returned by spool_depositions.
+        database_ids (list): The database ids the depositions were stored under.
+    """
+    _atomic_write(receipt_path(deposit_id), json.dumps({"database_ids": database_ids}).encode("utf-8"))
+
+    try:
+        os.remove(payload_path(deposit_id))
+    except FileNotFoundError:
+        pass
+
+def load_receipt(deposit_id:str)->dict:
+    """ Loads the receipt of completed depositions.
+
+    Args:
+        deposit_id (str): The deposit id returned by spool_depositions.
+
+    Returns:
+        dict: {'database_ids': [...]}, None if the depositions were not completed.
+    """
+    path = receipt_path(deposit_id)
+    if not os.path.exists(path):
+        return None
+
+    with open(path, "r") as f:
+        return json.load(f)
+
+def is_staged(deposit_id:str)->bool:
+    return os.path.exists(payload_path(deposit_id))
+
+def sweep_receipts(max_age:float=RECEIPT_TTL)->int:
+    """ Removes the receipts of depositions completed more than max_age seconds ago.
+
+    Args:
+        max_age (float, optional): The age in seconds after which receipts are removed.
+
+    Returns:
+        int: The number of receipts removed.
+    """
+    removed_count = 0
+    for path in glob.glob(os.path.join(SPOOL_FOLDER, "*", "*.done.json")):
+        try:
+            if time() - os.path.getmtime(path) > max_age:
+                os.remove(path)
+                removed_count += 1
+        except FileNotFoundError:
+            pass
+    return removed_count
+
+def test_spooled_database_ids(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    deposit_dicts = [{"task": "t", "user": "u", "spectrum": [[1000.0, float(i)]]} for i in range(3)]
+
+    deposit_id = spool_depositions(deposit_dicts)
+    database_ids = staged_database_ids(deposit_id, len(deposit_dicts))
+    assert len(set(database_ids)) == 3
+    assert all(len(database_id) == 26 for database_id in database_ids)
+    # A retry gets the same ids
+    assert staged_database_ids(deposit_id, len(deposit_dicts)) == database_ids
+
+    complete_depositions(deposit_id, database_ids)
+    assert sweep_receipts() == 0
+    os.utime(receipt_path(deposit_id), (0, 0))
+    assert sweep_receipts() == 1
+    assert load_receipt(deposit_id) is None
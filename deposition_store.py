@@ -0,0 +1,246 @@
+import os
+import json
+import numpy as np
+from time import time
+
+from spectrum_decimation import minmax_decimate
+
+# Full depositions (metadata + raw spectra), read by the summarize task and nextflow
+DEPOSITIONS_FOLDER = "database/depositions"
+
+# Compact per-deposition files, so metadata scans never have to parse the peaks
+SIDECAR_FOLDER = "database/deposition_sidecars"
+
+# Append-only record of every deposition, one JSON object per line
+DEPOSITION_LOG = "database/deposition_log.ndjson"
+
+# Points per replicate of the coarse levels of the raw spectrum pyramids. The full
+# resolution is not duplicated in the pyramid, it is read from the peaks sidecar (or the
+# deposition itself)
+PYRAMID_LEVELS = [1000, 8000]
+PYRAMID_FULL = "full"
+
+def _sidecar_folder(database_id:str)->str:
+    """ Returns the sidecar folder for a database id. ULIDs start with a timestamp,
+    so the random suffix is used to spread the files over shards.
+
+    Args:
+        database_id (str): The database id (ULID).
+
+    Returns:
+        str: The folder holding the sidecars of this database id.
+    """
+    database_id = os.path.basename(str(database_id))
+    return os.path.join(SIDECAR_FOLDER, database_id[-2:].upper())
+
+def metadata_sidecar_path(database_id:str)->str:
+    return os.path.join(_sidecar_folder(database_id), os.path.basename(str(database_id)) + ".meta.json")
+
+def peaks_sidecar_path(database_id:str)->str:
+    return os.path.join(_sidecar_folder(database_id), os.path.basename(str(database_id)) + ".peaks.npz")
+
+def pyramid_sidecar_path(database_id:str)->str:
+    return os.path.join(_sidecar_folder(database_id), os.path.basename(str(database_id)) + ".pyramid.npz")
+
+def _atomic_write(path:str, write_function):
+    """ Writes a file through a temporary file so readers never see partial content.
+
+    Args:
+        path (str): The final path of the file.
+        write_function (callable): Called with a binary file handle to write the content.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        write_function(f)
+    os.replace(temp_path, path)
+
+def pack_peaks(spectrum:list)->dict:
+    """ Packs the replicates of a raw spectrum into flat arrays.
+
+    Args:
+        spectrum (list): List of replicates, each a list of [mz, intensity] pairs.
+
+    Returns:
+        dict: 'mz' (float64), 'i' (float32) and 'offsets' (int64), where replicate k
+              spans offsets[k]:offsets[k+1].
+    """
+    replicates = [np.asarray(replicate, dtype=np.float64).reshape(-1, 2) for replicate in spectrum]
+    offsets = np.zeros(len(replicates) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(replicate) for replicate in replicates])
+
+    if len(replicates) > 0:
+        all_peaks = np.concatenate(replicates)
+    else:
+        all_peaks = np.zeros((0, 2), dtype=np.float64)
+
+    return {
+        "mz": all_peaks[:, 0],
+        "i": all_peaks[:, 1].astype(np.float32),
+        "offsets": offsets,
+    }
+
+def unpack_peaks(packed:dict)->list:
+    """ Inverse of pack_peaks.
+
+    Args:
+        packed (dict): The packed arrays.
+
+    Returns:
+        list: List of replicates as (n, 2) np.ndarrays of [mz, intensity].
+    """
+    offsets = packed["offsets"]
+    return [
+        np.column_stack((packed["mz"][start:end], packed["i"][start:end].astype(np.float64)))
+        for start, end in zip(offsets[:-1], offsets[1:])
+    ]
+
+def write_metadata_sidecar(database_id:str, metadata:dict):
+    """ Writes the metadata sidecar for a deposition.
+
+    Args:
+        database_id (str): The database id (ULID).
+        metadata (dict): The deposition without the 'spectrum' key.
+    """
+    content = json.dumps(metadata).encode("utf-8")
+    _atomic_write(metadata_sidecar_path(database_id), lambda f: f.write(content))
+
+def write_sidecars(database_id:str, deposit_dict:dict):
+    """ Writes the metadata sidecar and the binary peaks file for a deposition.
+
+    Args:
+        database_id (str): The database id (ULID).
+        deposit_dict (dict): The full deposition, including the 'spectrum' key.
+    """
+    metadata = {key: value for key, value in deposit_dict.items() if key != "spectrum"}
+    write_metadata_sidecar(database_id, metadata)
+
+    packed = pack_peaks(deposit_dict.get("spectrum", []))
+    _atomic_write(peaks_sidecar_path(database_id), lambda f: np.savez(f, **packed))
+
+def build_pyramid(spectrum:list)->dict:
+    """ Builds the multi-resolution pyramid of the replicates of a raw spectrum. Each
+    coarse level keeps the minimum and maximum intensity of its m/z buckets.
+
+    Args:
+        spectrum (list): List of replicates, each a list of [mz, intensity] pairs.
+
+    Returns:
+        dict: For every level in PYRAMID_LEVELS, the arrays of pack_peaks prefixed with the
+              level, e.g. '1000_mz', and 'lengths', the number of points of each replicate
+              at full resolution. Replicates are sorted by m/z.
+    """
+    replicates = []
+    for replicate in spectrum:
+        replicate = np.asarray(replicate, dtype=np.float64).reshape(-1, 2)
+        replicates.append(replicate[np.argsort(replicate[:, 0], kind="stable")])
+
+    pyramid = {"lengths": np.array([len(replicate) for replicate in replicates], dtype=np.int64)}
+    for level in PYRAMID_LEVELS:
+        level_replicates = [minmax_decimate(replicate, n_buckets=level // 2) for replicate in replicates]
+        for key, value in pack_peaks(level_replicates).items():
+            pyramid[f"{level}_{key}"] = value
+    return pyramid
+
+def write_pyramid_sidecar(database_id:str, spectrum:list):
+    """ Writes the raw spectrum pyramid of a deposition.
+
+    Args:
+        database_id (str): The database id (ULID).
+        spectrum (list): List of replicates, each a list of [mz, intensity] pairs.
+    """
+    pyramid = build_pyramid(spectrum)
+    _atomic_write(pyramid_sidecar_path(database_id), lambda f: np.savez(f, **pyramid))
+
+def load_pyramid_level(database_id:str, level)->list:
+    """ Loads one level of the raw spectrum pyramid of a deposition. Only the arrays of
+    that level are read from the file.
+
+    Args:
+        database_id (str): The database id (ULID).
+        level (int): A level of PYRAMID_LEVELS.
+
+    Returns:
+        list: List of replicates as (n, 2) np.ndarrays sorted by m/z, None if there is no pyramid.
+    """
+    path = pyramid_sidecar_path(database_id)
+    if not os.path.exists(path):
+        return None
+
+    with np.load(path) as pyramid:
+        return unpack_peaks({key: pyramid[f"{level}_{key}"] for key in ["mz", "i", "offsets"]})
+
+def load_pyramid_lengths(database_id:str)->list:
+    """ Returns the number of points of each replicate at full resolution, without reading the peaks.
+
+    Args:
+        database_id (str): The database id (ULID).
+
+    Returns:
+        list: The lengths, None if there is no pyramid (or one written before the lengths were stored).
+    """
+    path = pyramid_sidecar_path(database_id)
+    if not os.path.exists(path):
+        return None
+
+    with np.load(path) as pyramid:
+        if "lengths" not in pyramid.files:
+            return None
+        return pyramid["lengths"].tolist()
+
+def load_metadata_sidecar(database_id:str, source_filename:str=None)->dict:
+    """ Loads the metadata sidecar for a deposition.
+
+    Args:
+        database_id (str): The database id (ULID).
+        source_filename (str, optional): The full deposition. If given, a sidecar older
+            than this file (e.g. after a manual curation) is treated as missing.
+
+    Returns:
+        dict: The deposition metadata, None if there is no up-to-date sidecar.
+    """
+    path = metadata_sidecar_path(database_id)
+    if not os.path.exists(path):
+        return None
+
+    if source_filename is not None and os.path.getmtime(path) < os.path.getmtime(source_filename):
+        return None
+
+    with open(path, "r") as f:
+        return json.load(f)
+
+def load_peaks_sidecar(database_id:str)->list:
+    """ Loads the binary peaks file for a deposition.
+
+    Args:
+        database_id (str): The database id (ULID).
+
+    Returns:
+        list: List of replicates as (n, 2) np.ndarrays, None if there is no peaks file.
+    """
+    path = peaks_sidecar_path(database_id)
+    if not os.path.exists(path):
+        return None
+
+    with np.load(path) as packed:
+        return unpack_peaks(packed)
+
+def append_deposition_log(database_id:str, deposit_dict:dict, output_filename:str):
+    """ Appends a deposition to the deposition log.
+
+    Args:
+        database_id (str): The database id (ULID).
+        deposit_dict (dict): The deposition.
+        output_filename (str): Where the full deposition was written.
+    """
+    record = {
+        "database_id": database_id,
+        "task": deposit_dict.get("task"),
+        "user": deposit_dict.get("user"),
+        "path": output_filename,
+        "time": time(),
+    }
+
+    os.makedirs(os.path.dirname(DEPOSITION_LOG), exist_ok=True)
+    with open(DEPOSITION_LOG, "a") as f:
+        f.write(json.dumps(record) + "\n")
@@ -8,13 +8,17 @@ import dash_bootstrap_components as dbc
 import plotly.express as px
 import os
 from io import BytesIO
+from urllib.parse import urlencode
 
 import pandas as pd
 
 import dash
 from dash import html, register_page  #, callback # If you need callbacks, import it here.
 
-from data_loader import load_database
+from data_loader import load_database, load_summary_statistics, get_summary_statistics_version
+from utils import compute_taxonomy_distribution
+from callback_cache import memoize_callback
+from table_export import STREAMED_FORMATS
 
 # from app import server
 # memory_cache = Cache(config={
@@ -60,6 +64,14 @@ STATUS_BANNER = dbc.Row(
     # style={"marginTop": 30},
 )
 
+DOWNLOAD_FORMAT_OPTIONS = [
+    {'label': 'CSV', 'value': 'csv'},
+    {'label': 'TSV', 'value': 'tsv'},
+    {'label': 'CSV (gzip)', 'value': 'csv.gz'},
+    {'label': 'TSV (gzip)', 'value': 'tsv.gz'},
+    {'label': 'Parquet', 'value': 'parquet'},
+]
+
 DATASELECTION_CARD = [
     dbc.CardHeader(html.H5("IDBac-KB Spectra List")),
     dbc.CardBody(
@@ -105,11 +117,20 @@ DATASELECTION_CARD = [
             html.Br(),
             dbc.Row(
             dbc.Col(
-                    dbc.Button("Download Table as CSV", id="download-button", color="primary"),
+                    [
+                        dcc.Dropdown(
+                            id="download-format",
+                            options=DOWNLOAD_FORMAT_OPTIONS,
+                            value='csv',
+                            clearable=False,
+                            style={'width': '160px', 'marginRight': '5px'},
+                        ),
+                        dbc.Button("Download Table", id="download-button", color="primary",
+                                   href="/api/export?format=csv", external_link=True, target="_blank"),
+                    ],
                     className="d-flex justify-content-end"
                 )
             ),
-            dcc.Download(id="download-dataframe-csv"),
             html.Br(),
             html.Div(id="update-summary")
 
@@ -186,16 +207,31 @@ def update_view_raw_link(selected_rows, table_data):
     return f"/raw-viewer/?database_id={database_id}"
 
 @callback(
-    Output("download-dataframe-csv", "data"),
-    Input("download-button", "n_clicks"),
-    prevent_initial_call=True
+    Output("download-button", "href"),
+    Output("download-button", "children"),
+    Output("download-format", "options"),
+    Input("download-format", "value"),
+    Input("displaytable", "filter_query"),
 )
-def download_table_as_csv(n_clicks):
-    database = pd.DataFrame(load_database(None)[0])
-    if database is None or database.empty:
-        return dash.no_update
-    df = pd.DataFrame(database)
-    return dcc.send_data_frame(df.to_csv, "IDBac_KB_Spectra_List.csv", index=False)
+def update_download_link(export_format, filter_query):
+    """ Points the download button at the prebuilt export, or at a streamed export
+    of the rows matching the current table filter.
+
+    Args:
+        export_format (str): The selected format.
+        filter_query (str): The filter_query of the table.
+    """
+    options = [dict(option) for option in DOWNLOAD_FORMAT_OPTIONS]
+
+    if not filter_query or not filter_query.strip():
+        return f"/api/export?format={export_format}", "Download Table", options
+
+    # Filtered exports are streamed as text only
+    for option in options:
+        option["disabled"] = option["value"] not in STREAMED_FORMATS
+    if export_format not in STREAMED_FORMATS:
+        export_format = "csv"
+    return f"/api/export?{urlencode({'format': export_format, 'filter_query': filter_query})}", "Download Filtered Table", options
 
 
 db_content_dropdown_options = [
@@ -448,40 +484,37 @@ BODY = dbc.Container(
     Output('dynamic-taxonomy-pie-chart', 'figure'),
     Input('taxonomy-dropdown', 'value'),
 )
+@memoize_callback(version=get_summary_statistics_version)  # The figure only depends on the rank and the summary statistics
 def update_dynamic_pie_chart(selected_taxonomy):
-    dynamic_summary_df = None
-    count_16S = 0
-    number_of_database_entries = ""
-    percent_16S = 0.0
-    database = pd.DataFrame(load_database(None)[0])
-    if database is not None:
-        dynamic_summary_df = pd.DataFrame(database)
-
-        dynamic_summary_df[selected_taxonomy] = dynamic_summary_df[selected_taxonomy].fillna("No Taxonomy")
-        
-        # Handle 16S
-        is_16S = (dynamic_summary_df[selected_taxonomy] == "No Taxonomy") & (dynamic_summary_df['16S Taxonomy'].notna())
-
-        # Strip the column of whitespace
-        dynamic_summary_df[selected_taxonomy] = dynamic_summary_df[selected_taxonomy].str.strip()
-
-        # If genus, only take the first word
-        if selected_taxonomy == "genus":
-            dynamic_summary_df.loc[is_16S, selected_taxonomy] = dynamic_summary_df.loc[is_16S, "16S Taxonomy"]
-            dynamic_summary_df.loc[dynamic_summary_df["genus"]!="No Taxonomy", "genus"] = dynamic_summary_df.loc[dynamic_summary_df["genus"]!="No Taxonomy", "genus"].str.split().str[0]
-        else:
-            dynamic_summary_df.loc[is_16S, selected_taxonomy] = "User Submitted 16S"
-
-        # Get counts by Genus and Species for px.bar
-        dynamic_summary_df = dynamic_summary_df.groupby([selected_taxonomy]).size().reset_index(name="count")
-
-        count_16S = dynamic_summary_df[dynamic_summary_df[selected_taxonomy] == "User Submitted 16S"]["count"].sum()
-        percent_16S = (count_16S / dynamic_summary_df["count"].sum()) * 100
-
-        dynamic_summary_df = dynamic_summary_df[dynamic_summary_df[selected_taxonomy] != "User Submitted 16S"]
-
-        dynamic_summary_df = dynamic_summary_df.loc[~ dynamic_summary_df[selected_taxonomy].isna()]
-
+    return _create_pie_chart(selected_taxonomy)
+
+def _get_taxonomy_distribution(selected_taxonomy):
+    """ Returns the counts per taxon, precomputed by the summarize task if available.
+
+    Args:
+        selected_taxonomy (str): The taxonomic rank.
+
+    Returns:
+        tuple: (pd.DataFrame with columns [selected_taxonomy, 'count'], number of 16S entries, total number of entries)
+    """
+    stats = load_summary_statistics()
+    if stats is not None and selected_taxonomy in stats.get("taxonomy_distribution", {}):
+        distribution = stats["taxonomy_distribution"][selected_taxonomy]
+        counts_df = pd.DataFrame({
+            selected_taxonomy: list(distribution["counts"].keys()),
+            "count": list(distribution["counts"].values()),
+        })
+        return counts_df, distribution["count_16S"], distribution["total_count"]
+
+    # Summaries written before the counts were precomputed
+    database = load_database(None)[0]
+    if database is None:
+        return None, 0, 0
+    return compute_taxonomy_distribution(pd.DataFrame(database), selected_taxonomy)
+
+def _create_pie_chart(selected_taxonomy):
+    dynamic_summary_df, count_16S, total_count = _get_taxonomy_distribution(selected_taxonomy)
+    percent_16S = (count_16S / total_count) * 100 if total_count > 0 else 0.0
 
     fig = px.pie(dynamic_summary_df, 
                  values="count", 
@@ -5,6 +5,8 @@ from dash.dependencies import Input, Output, State
 from dash import callback
 import json
 
+from data_loader import load_summary_statistics
+
 register_page(
     __name__,
     name='IDBac',
@@ -63,13 +65,11 @@ DATABASE_CONTENTS = dbc.Container(html.H3(
 def update_database_contents(_,):
     num_entries = 0
     num_genera = 0
-    stats_path = "database/summary_statistics.json"
 
     try:
-        stats = json.load(open(stats_path, "r", encoding='utf-8'))
+        stats = load_summary_statistics()
         num_entries = stats["num_entries"]
         num_genera = stats["num_genera"]
-        # TODO: Make pie chart statistics a part of summary stats
     except Exception as _:
         return ""
     
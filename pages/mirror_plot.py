@@ -10,10 +10,9 @@ import dash_bootstrap_components as dbc
 import json
 import plotly
 import plotly.express as px
-from plotly.graph_objs import Scatter, Figure
+from plotly.graph_objs import Scatter, Scattergl, Figure
 import glob
 
-import numba as nb
 import numpy as np
 
 from scipy.ndimage import uniform_filter1d
@@ -23,11 +22,14 @@ import pandas as pd
 
 from dash import html, register_page 
 
-from utils import convert_to_mzml, fetch_with_retry
+from utils import convert_to_mzml
+from spectrum_similarity import cosine_similarity, peaks_to_array, prepare_spectrum, index_mask
+from usi_resolver import resolve_usi, request_usi, USI_PENDING, USI_READY, USI_FAILED
 import logging
-from typing import Tuple
 
 from data_loader import load_database
+from callback_cache import memoize_callback
+from database_index import get_database_index, SEARCH_FIELDS
 
 dev_mode = False
 if not os.path.isdir('/app'):
@@ -59,6 +61,7 @@ SPECTRA_DASHBOARD = html.Div([
             className="mb-3",
             style={"display": "flex", "alignItems": "center"}
         ),
+        html.Div(id="mirror-plot-usi-status", className="mb-3"),
         html.H6("Select Data Identifiers to Compare", className="mb-3"),
         dbc.RadioItems(
             id="mirror-plot-search-type",
@@ -155,34 +158,20 @@ def layout(**kwargs):
     return html.Div(children=[BODY,
                                # Store for intermediate data
                                 dcc.Store(id='mirror-data-store', storage_type='memory'),
+                                # USIs resolved in the background, polled until they are available
+                                dcc.Store(id='mirror-usi-pending', storage_type='memory', data=[]),
+                                dcc.Store(id='mirror-plot-waiting', storage_type='memory', data=False),
+                                dcc.Interval(id='mirror-usi-poll', interval=1000, disabled=True),
     ])
 
-def _get_spectrum_resolver(usi:str)->dict:
+def _get_spectrum_resolver(usi:str)->np.ndarray:
     """ Returns the exact spectrum specified by the usi.
     Args:
         usi (str): The USI of the spectrum to fetch.
     Returns:
-        dict: The spectrum in JSON format.
+        np.ndarray: (n, 2) array of [mz, intensity] sorted by mz, None if the USI could not be resolved.
     """
-
-    # Looks like this: https://metabolomics-usi.gnps2.org/json/?usi1=mzspec%3AGNPS2%3ATASK-ddd9cb3cf41f435ab66c06554836dc5e-gnps_network/specs_ms.mgf%3Ascan%3A714
-
-    response_text = fetch_with_retry(
-        f"https://metabolomics-usi.gnps2.org/json/?usi1={usi}",
-    )
-
-    j = json.loads(response_text) # j['peaks] is a list of lists [[mz, intensity], ...]
-    if 'peaks' not in j:
-        logging.error(f"Failed to fetch spectrum for USI {usi}. Response: {j}")
-        return None
-    if len(j['peaks']) == 0:
-        return {}
-    
-    # Convert to dict with 'mz' and 'i' keys
-    spectrum = {
-        'peaks': [{'mz': peak[0], 'i': peak[1]} for peak in sorted(j['peaks'], key=lambda x: x[0])],
-    }
-    return spectrum
+    return resolve_usi(usi)
 
 def _get_processed_spectrum(database_id:str, bin_width:int)->dict:
     """ Returns the processed spectrum for a given database_id.
@@ -191,7 +180,7 @@ def _get_processed_spectrum(database_id:str, bin_width:int)->dict:
         database_id (str): The database_id to search for.
 
     Returns:
-        dict: The processed spectrum.
+        dict: The processed spectrum. For USIs, an (n, 2) array of [mz, intensity].
     """
 
     if str(database_id).startswith("mzspec"):
@@ -215,12 +204,12 @@ def _get_processed_spectrum(database_id:str, bin_width:int)->dict:
 
         return spectrum_dict
 
-def get_id_from_name(strain_name:str, data:dict)->str:
+def get_id_from_name(strain_name:str, data:list=None)->str:
     """ Returns the database ID for a given strain name.
 
     Args:
         strain_name (str): The strain name to search for.
-        data (dict): The data store.
+        data (list, optional): The data store containing the strain names and database IDs of added USIs.
 
     Returns:
         str: The database ID.
@@ -229,7 +218,11 @@ def get_id_from_name(strain_name:str, data:dict)->str:
         logging.warning("No strain name provided to get_id_from_name.")
         return None, "No strain name provided."
 
-    candidates = [x for x in data['Strain name'] == strain_name]
+    candidates = [x["database_id"] for x in data or [] if x["Strain name"] == strain_name]
+    database_index = get_database_index()
+    if database_index is not None:
+        candidates += database_index.get_ids_for_strain(strain_name)
+
     if len(candidates) == 0:
         return None, "No matching database ID found."
     if len(candidates) > 1:
@@ -237,268 +230,73 @@ def get_id_from_name(strain_name:str, data:dict)->str:
         return candidates[0], "Multiple candidates found."
     return candidates[0], None
 
-@nb.njit
-def find_matches(ref_spec_mz: np.ndarray, qry_spec_mz: np.ndarray,
-                 tolerance: float, shift: float = 0.0) -> Tuple[np.ndarray, np.ndarray]:
-    """Find matching peaks between two spectra."""
-    matches_idx1 = np.empty(len(ref_spec_mz) * len(qry_spec_mz), dtype=np.int64)
-    matches_idx2 = np.empty_like(matches_idx1)
-    match_count = 0
-    lowest_idx = 0
-
-    for peak1_idx in range(len(ref_spec_mz)):
-        mz = ref_spec_mz[peak1_idx]
-        low_bound = mz - tolerance
-        high_bound = mz + tolerance
-
-        for peak2_idx in range(lowest_idx, len(qry_spec_mz)):
-            mz2 = qry_spec_mz[peak2_idx] - shift
-            if mz2 > high_bound:
-                break
-            if mz2 < low_bound:
-                lowest_idx = peak2_idx
-            else:
-                matches_idx1[match_count] = peak1_idx
-                matches_idx2[match_count] = peak2_idx
-                match_count += 1
-
-    return matches_idx1[:match_count], matches_idx2[:match_count]
-
-@nb.njit
-def collect_peak_pairs(ref_spec: np.ndarray, qry_spec: np.ndarray, min_matched_peak: int, sqrt_transform: bool,
-                       tolerance: float, shift: float = 0.0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
-    """Find and score matching peak pairs between spectra."""
-
-    if len(ref_spec) == 0 or len(qry_spec) == 0:
-        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
-
-    # Exact matching
-    matches_idx1, matches_idx2 = find_matches(ref_spec[:, 0], qry_spec[:, 0], tolerance, 0.0)
-
-    # If shift is not 0, perform hybrid search
-    if abs(shift) > 1e-6:
-        matches_idx1_shift, matches_idx2_shift = find_matches(ref_spec[:, 0], qry_spec[:, 0], tolerance, shift)
-        matches_idx1 = np.concatenate((matches_idx1, matches_idx1_shift))
-        matches_idx2 = np.concatenate((matches_idx2, matches_idx2_shift))
-
-    if len(matches_idx1) < min_matched_peak:
-        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
-
-    # Calculate scores for matches
-    if sqrt_transform:
-        scores = np.sqrt(ref_spec[matches_idx1, 1] * qry_spec[matches_idx2, 1]).astype(np.float32)
-    else:
-        scores = (ref_spec[matches_idx1, 1] * qry_spec[matches_idx2, 1]).astype(np.float32)
-
-    # Sort by score descending
-    sort_idx = np.argsort(-scores)
-    return matches_idx1[sort_idx], matches_idx2[sort_idx], scores[sort_idx]
-
-
-@nb.njit
-def score_matches(matches_idx1: np.ndarray, matches_idx2: np.ndarray,
-                  scores: np.ndarray, ref_spec: np.ndarray, qry_spec: np.ndarray,
-                  sqrt_transform: bool, penalty: float):
-    """Calculate final similarity score from matching peaks."""
-
-    # Use boolean arrays for tracking used peaks - initialized to False
-    used1 = np.zeros(len(ref_spec), dtype=nb.boolean)
-    used2 = np.zeros(len(qry_spec), dtype=nb.boolean)
-
-    total_score = 0.0
-    used_matches = 0
-
-    # Find best non-overlapping matches
-    for i in range(len(matches_idx1)):
-        idx1 = matches_idx1[i]
-        idx2 = matches_idx2[i]
-        if not used1[idx1] and not used2[idx2]:
-            total_score += scores[i]
-            used1[idx1] = True
-            used2[idx2] = True
-            used_matches += 1
-
-    if used_matches == 0:
-        return 0.0, 0
-
-    # # Sum intensities of matched peaks
-    # matched_intensities = np.zeros(used_matches, dtype=np.float32)
-
-    # new intensities of qry peaks, matched peaks are the same, others are penalized
-    new_qry_intensities = np.zeros(len(qry_spec), dtype=np.float32)
-
-    match_idx = 0
-    for i in range(len(qry_spec)):
-        if used2[i]:
-            # matched_intensities[match_idx] = qry_spec[i, 1]
-            new_qry_intensities[i] = qry_spec[i, 1]
-            match_idx += 1
-        else:
-            new_qry_intensities[i] = qry_spec[i, 1] * (1 - penalty)
-
-    if sqrt_transform:
-        norm1 = np.sqrt(np.sum(np.sqrt(ref_spec[:, 1] * ref_spec[:, 1])))
-        norm2 = np.sqrt(np.sum(np.sqrt(new_qry_intensities * new_qry_intensities)))
-    else:
-        norm1 = np.sqrt(np.sum(ref_spec[:, 1] * ref_spec[:, 1]))
-        norm2 = np.sqrt(np.sum(new_qry_intensities * new_qry_intensities))
-
-    if norm1 == 0.0 or norm2 == 0.0:
-        return 0.0, used_matches
-
-    score = total_score / (norm1 * norm2)
-
-    return min(float(score), 1.0), used_matches
-
-
-def cosine_similarity(qry_spec: np.ndarray, ref_spec: np.ndarray,
-                      tolerance: float = 0.1,
-                      min_matched_peak: int = 1,
-                      sqrt_transform: bool = True,
-                      penalty: float = 0.,
-                      shift: float = 0.0):
-    """
-    Calculate similarity between two spectra.
-
-    Parameters
-    ----------
-    qry_spec: np.ndarray
-        Query spectrum.
-    ref_spec: np.ndarray
-        Reference spectrum.
-    tolerance: float
-        Tolerance for m/z matching.
-    min_matched_peak: int
-        Minimum number of matched peaks.
-    sqrt_transform: bool
-        If True, use square root transformation.
-    penalty: float
-        Penalty for unmatched peaks. If set to 0, traditional cosine score; if set to 1, traditional reverse cosine score.
-    shift: float
-        Shift for m/z values. If not 0, hybrid search is performed. shift = prec_mz(qry) - prec_mz(ref)
-    """
-    tolerance = np.float32(tolerance)
-    penalty = np.float32(penalty)
-    shift = np.float32(shift)
-
-    if qry_spec.size == 0 or ref_spec.size == 0:
-        return (0.0, 0), np.array([]), np.array([])
-
-    # normalize the intensity
-    ref_spec[:, 1] /= np.max(ref_spec[:, 1])
-    qry_spec[:, 1] /= np.max(qry_spec[:, 1])
-
-    matches_idx1, matches_idx2, scores = collect_peak_pairs(
-        ref_spec, qry_spec, min_matched_peak, sqrt_transform,
-        tolerance, shift
-    )
-
-    if len(matches_idx1) == 0:
-        return (0.0, 0), np.array([]), np.array([])
-
-    return score_matches(
-        matches_idx1, matches_idx2, scores,
-        ref_spec, qry_spec, sqrt_transform, penalty
-    ), matches_idx2, matches_idx1   # Note this is reversed, this is correct based on return from collect_peak_pairs
-
-def create_mirror_plot(spectrum_a, spectrum_b=None, mass_range=None, mass_tolerance=0.1):
+def create_mirror_plot(spectrum_a, spectrum_b=None, mass_range=None, mass_tolerance=0.1, presence=False):
     """ Creates a mirror plot of two spectra using stem plots and computes cosine similarity.
 
     Args:
-        spectrum_a (dict): The first spectrum.
-        spectrum_b (dict, optional): The second spectrum.
+        spectrum_a (dict or np.ndarray): The first spectrum.
+        spectrum_b (dict or np.ndarray, optional): The second spectrum.
         mass_range (tuple, optional): The mass range to filter peaks (min, max).
         mass_tolerance (float, optional): The mass tolerance for matching peaks.
+        presence (bool, optional): If True, plot presence/absence instead of intensities.
 
     Returns:
         tuple: (Figure, cosine similarity score)
     """
     fig = Figure()
 
-    def filter_mass_range(mz_values, intensity_values, mass_range):
-        """Filters the mz and intensity values based on the mass range."""
-        if mass_range is None:
-            return mz_values, intensity_values
-        mask = (mz_values >= mass_range[0]) & (mz_values <= mass_range[1])
-        return mz_values[mask], intensity_values[mask]
-
     def add_stem_trace(fig, mz_values, intensity_values, color):
-        """Adds a stem plot trace for given mz and intensity values."""
-        for mz, intensity in zip(mz_values, intensity_values):
-            fig.add_trace(
-                Scatter(
-                    x=[mz, mz], 
-                    y=[0, intensity], 
-                    mode='lines',
-                    line=dict(color=color, width=1),
-                    showlegend=False
-                )
+        """Adds all stems of a color as a single WebGL trace, separated by gaps."""
+        if len(mz_values) == 0:
+            return
+        x = np.repeat(mz_values, 3)
+        x[2::3] = np.nan
+        y = np.zeros(len(x))
+        y[1::3] = intensity_values
+        y[2::3] = np.nan
+        fig.add_trace(
+            Scattergl(
+                x=x,
+                y=y,
+                mode='lines',
+                line=dict(color=color, width=1),
+                connectgaps=False,
+                showlegend=False
             )
+        )
 
     # First spectrum
-    mz_a = np.array([x['mz'] for x in spectrum_a['peaks']])
-    i_a = np.array([x['i'] for x in spectrum_a['peaks']])
-    mz_a, i_a = filter_mass_range(mz_a, i_a, mass_range)
-    sorted_indices = np.argsort(mz_a)
-    mz_a = mz_a[sorted_indices]
-    i_a = i_a[sorted_indices]
-    # Normalize intensities
-    if len(i_a) > 0:
-        i_a = i_a / np.max(i_a) * 100.0
-    spectrum_a = np.column_stack((mz_a, i_a))
+    spectrum_a = prepare_spectrum(peaks_to_array(spectrum_a), mass_range, presence)
+    mz_a, i_a = spectrum_a[:, 0], spectrum_a[:, 1]
 
     cosine_score = None  # Default in case there's no second spectrum
 
-    if spectrum_b:
+    if spectrum_b is not None and len(spectrum_b) > 0:
         # Second spectrum (inverted intensities)
-        mz_b = np.array([x['mz'] for x in spectrum_b['peaks']])
-        i_b = np.array([x['i'] for x in spectrum_b['peaks']])
-        mz_b, i_b = filter_mass_range(mz_b, i_b, mass_range)
-        sorted_indices = np.argsort(mz_b)
-        mz_b = mz_b[sorted_indices]
-        i_b = i_b[sorted_indices]
-        # Normalize intensities
-        if len(i_b) > 0:
-            i_b = i_b / np.max(i_b) * 100.0
-        spectrum_b = np.column_stack((mz_b, i_b))
+        spectrum_b = prepare_spectrum(peaks_to_array(spectrum_b), mass_range, presence)
+        mz_b, i_b = spectrum_b[:, 0], spectrum_b[:, 1]
 
+        # Scoring normalizes intensities in place, the plotted arrays are kept as is
         (cosine_score, num_matched_peaks), used_peaks_a, used_peaks_b = cosine_similarity(
-            qry_spec=spectrum_a,
-            ref_spec=spectrum_b,
+            qry_spec=spectrum_a.copy(),
+            ref_spec=spectrum_b.copy(),
             tolerance=mass_tolerance,
             min_matched_peak=1,
             sqrt_transform=False,
             penalty=0.0
         )
 
-        if len(used_peaks_a)>0:
-            matched_mz_a = mz_a[used_peaks_a]   # Contains indices of matched peaks
-            matched_i_a = i_a[used_peaks_a]
-        else:
-            matched_mz_a = np.array([])
-            matched_i_a = np.array([])
-
-        if len(used_peaks_b)>0:
-            matched_mz_b = mz_b[used_peaks_b]
-            matched_i_b = i_b[used_peaks_b]
-        else:
-            matched_mz_b = np.array([])
-            matched_i_b = np.array([])
-
-        unmatched_mz_a = mz_a[np.setdiff1d(np.arange(len(mz_a)), used_peaks_a)]
-        unmatched_i_a = i_a[np.setdiff1d(np.arange(len(i_a)), used_peaks_a)]
-        unmatched_mz_b = mz_b[np.setdiff1d(np.arange(len(mz_b)), used_peaks_b)]
-        unmatched_i_b = i_b[np.setdiff1d(np.arange(len(i_b)), used_peaks_b)]
-
-        print(used_peaks_a)
+        # Peaks taking part in any match
+        matched_a = index_mask(len(mz_a), used_peaks_a)
+        matched_b = index_mask(len(mz_b), used_peaks_b)
 
         # Plot matched peaks in green
-        add_stem_trace(fig, matched_mz_a, matched_i_a, 'green')
-        add_stem_trace(fig, matched_mz_b, -1 * matched_i_b, 'green')
+        add_stem_trace(fig, mz_a[matched_a], i_a[matched_a], 'green')
+        add_stem_trace(fig, mz_b[matched_b], -1 * i_b[matched_b], 'green')
 
         # Plot unmatched peaks in blue (spectrum A) and red (spectrum B)
-        add_stem_trace(fig, unmatched_mz_a, unmatched_i_a, 'blue')
-        add_stem_trace(fig, unmatched_mz_b, -1 * unmatched_i_b, 'red')
+        add_stem_trace(fig, mz_a[~matched_a], i_a[~matched_a], 'blue')
+        add_stem_trace(fig, mz_b[~matched_b], -1 * i_b[~matched_b], 'red')
     else:
         # If there's only one spectrum, plot everything in blue
         add_stem_trace(fig, mz_a, i_a, 'blue')
@@ -510,86 +308,161 @@ def create_mirror_plot(spectrum_a, spectrum_b=None, mass_range=None, mass_tolera
     return fig, cosine_score
 
 @callback(
-    Output("mirror-data-store", "data", allow_duplicate=True),
+    Output("mirror-usi-pending", "data", allow_duplicate=True),
+    Output("mirror-plot-usi-status", "children", allow_duplicate=True),
     Input("mirror-plot-usi-submit", "n_clicks"),
     State("mirror-plot-usi-input", "value"),
-    State("mirror-data-store", "data"),
+    State("mirror-usi-pending", "data"),
     prevent_initial_call=True,
 )
-def update_data_store(n_clicks, usi, data_store):
-    """ Updates the data store with the spectrum data from the USI input.
+def update_data_store(n_clicks, usi, pending):
+    """ Starts resolving the USI input in the background. Once resolved, poll_pending_usis
+    adds it to the data store.
 
     Args:
         n_clicks (int): The number of clicks on the submit button.
         usi (str): The USI of the spectrum to fetch.
+        pending (list): The USIs being resolved.
 
     Returns:
-        dict: The data store containing strain names and database IDs.
+        list: The USIs being resolved.
+        str: The status message.
     """
     logging.info(f"Adding USI {usi} to data store.")
     print(f"Adding USI {usi} to data store.", flush=True)
     if not usi:
-        return dash.no_update
+        return dash.no_update, dash.no_update
 
-    # Fetch the spectrum using the USI
-    spectrum = _get_spectrum_resolver(usi)
-    if not spectrum or 'peaks' not in spectrum or len(spectrum['peaks']) == 0:
-        return dash.no_update
+    usi = usi.strip()
+    request_usi(usi)
 
-    # Add the usi to the store as an option
-    new_value =  {
-        "Strain name": usi,
-        "database_id": usi,
-    }
+    pending = pending or []
+    if usi not in pending:
+        pending = pending + [usi]
 
-    if data_store is None:
-        data_store = [new_value]
-    else:
-        data_store.append(new_value)
+    return pending, f"Resolving USI {usi}..."
+
+@callback(
+    Output("mirror-data-store", "data", allow_duplicate=True),
+    Output("mirror-usi-pending", "data", allow_duplicate=True),
+    Output("mirror-plot-usi-status", "children", allow_duplicate=True),
+    Input("mirror-usi-poll", "n_intervals"),
+    State("mirror-usi-pending", "data"),
+    State("mirror-data-store", "data"),
+    prevent_initial_call=True,
+)
+def poll_pending_usis(n_intervals, pending, data_store):
+    """ Adds the USIs resolved in the background to the data store.
 
-    logging.info(f"Successfully added USI {usi} to data store.")
-    print(f"Successfully added USI {usi} to data store.", flush=True)
+    Args:
+        n_intervals (int): The number of polls.
+        pending (list): The USIs being resolved.
+        data_store (list): The data store containing strain names and database IDs.
+
+    Returns:
+        list: The data store, the USIs still being resolved and the status message.
+    """
+    if not pending:
+        return dash.no_update, dash.no_update, dash.no_update
+
+    still_pending = []
+    messages = []
+    new_values = []
+    for usi in pending:
+        status, peaks = request_usi(usi)
+        if status == USI_PENDING:
+            still_pending.append(usi)
+        elif status == USI_READY and len(peaks) > 0:
+            # Add the usi to the store as an option
+            new_values.append({
+                "Strain name": usi,
+                "database_id": usi,
+            })
+            logging.info(f"Successfully added USI {usi} to data store.")
+            print(f"Successfully added USI {usi} to data store.", flush=True)
+            messages.append(f"Added USI {usi}.")
+        else:
+            messages.append(f"Could not resolve USI {usi}.")
+
+    if len(still_pending) == len(pending):
+        return dash.no_update, dash.no_update, dash.no_update
 
-    return data_store
+    if len(still_pending) > 0:
+        messages.append(f"Resolving {len(still_pending)} USI(s)...")
+
+    if len(new_values) > 0:
+        data_store = (data_store or []) + new_values
+    else:
+        data_store = dash.no_update
+
+    return data_store, still_pending, " ".join(messages)
 
 @callback(
-    Output("mirror-plot-input-a", "options"),
-    Output("mirror-plot-input-b", "options"),
-    Input("mirror-plot-search-type", "value"),
-    Input("mirror-data-store", "data"),
-    prevent_initial_call=False,
+    Output("mirror-usi-poll", "disabled"),
+    Input("mirror-usi-pending", "data"),
+    Input("mirror-plot-waiting", "data"),
 )
-def update_input_options(search_type, data):
-    """ Updates the options for the input dropdowns based on the data store.
+def toggle_usi_polling(pending, waiting):
+    # Only poll while something is being resolved
+    return not pending and not waiting
+
+def _search_options(search_value, value, search_type, data)->list:
+    """ Returns the dropdown options matching the text typed by the user.
 
     Args:
+        search_value (str): The text typed in the dropdown.
+        value (str): The currently selected database id, always kept in the options.
         search_type (str): The selected search type.
-        data (dict): The data store containing strain names and database IDs.
+        data (list): The data store containing the strain names and database IDs of added USIs.
 
     Returns:
-        list: The options for the input dropdowns.
+        list: The options for the dropdown, at most SEARCH_RESULT_LIMIT database entries.
     """
-    database = load_database(None)[0]
-
-    if data is None:
-        data = database
-    else:
-        # Concat the data 
-        data = data + database
-    if data is None:
-        return [], []
-
-    names = [x["Strain name"] for x in data]
-    db_ids = [x["database_id"] for x in data]
-
-    if search_type == "strain_name":
-        options = [{"label": "None", "value": ""}] + [{"label": name, "value": db_id} for name, db_id in zip(names, db_ids)]
-    elif search_type == "database_id":
-        options = [{"label": "None", "value": ""}] + [{"label": db_id, "value": db_id} for name, db_id in zip(names, db_ids)]
-    else:
+    if search_type not in SEARCH_FIELDS:
         raise ValueError("Invalid search type")
-        
-    return options, options
+    label_field = SEARCH_FIELDS[search_type]
+
+    options = [{"label": "None", "value": ""}]
+
+    # Added USIs are few, so they are searched directly
+    query = str(search_value or "").strip().lower()
+    for entry in data or []:
+        if query in str(entry[label_field]).lower() or entry["database_id"] == value:
+            options.append({"label": entry[label_field], "value": entry["database_id"]})
+
+    database_index = get_database_index()
+    if database_index is not None:
+        options += database_index.search(search_type, search_value)
+
+        # The selected value has to stay in the options, otherwise the dropdown clears it
+        if value and all(option["value"] != value for option in options):
+            selected_option = database_index.get_option(search_type, value)
+            if selected_option is not None:
+                options.append(selected_option)
+
+    return options
+
+@callback(
+    Output("mirror-plot-input-a", "options"),
+    Input("mirror-plot-input-a", "search_value"),
+    Input("mirror-plot-input-a", "value"),
+    Input("mirror-plot-search-type", "value"),
+    Input("mirror-data-store", "data"),
+    prevent_initial_call=False,
+)
+def update_input_a_options(search_value, value, search_type, data):
+    return _search_options(search_value, value, search_type, data)
+
+@callback(
+    Output("mirror-plot-input-b", "options"),
+    Input("mirror-plot-input-b", "search_value"),
+    Input("mirror-plot-input-b", "value"),
+    Input("mirror-plot-search-type", "value"),
+    Input("mirror-data-store", "data"),
+    prevent_initial_call=False,
+)
+def update_input_b_options(search_value, value, search_type, data):
+    return _search_options(search_value, value, search_type, data)
 
 # Callback that sets inputs from URL if not specied
 @callback(
@@ -625,21 +498,56 @@ def set_inputs_from_url(search, _):
 
 @callback(
     Output("mirror-plot-container", "children"),
+    Output("mirror-plot-waiting", "data"),
     State("mirror-plot-input-a", "value"),
     State("mirror-plot-input-b", "value"),
     State("mirror-plot-mass-range", "value"),
     State("mirror-plot-bin-size", "value"),
     State("presence-absence", "value"),
+    State("mirror-plot-waiting", "data"),
     Input("mirror-plot-update", "n_clicks"),
+    Input("mirror-usi-poll", "n_intervals"),
     prevent_initial_call=True,
 )
-def update_plot(input_a, input_b, mass_range, bin_size, presence, n_clicks):
+def update_plot(input_a, input_b, mass_range, bin_size, presence, waiting, n_clicks, n_intervals):
     """ Updates the search input based on the selected search type.
     Args:
         input_a (str): The value of the first input.
         input_b (str): The value of the second input.
         data (dict): The data store.
+        waiting (bool): Whether the plot is waiting for a USI to be resolved.
         n_clicks (int): The number of clicks on the update button."
+        n_intervals (int): The number of polls.
+    """
+    # Polls only redraw a plot that is waiting for a USI
+    if ctx.triggered_id == "mirror-usi-poll" and not waiting:
+        return dash.no_update, dash.no_update
+
+    # USIs are resolved in the background, the poll redraws once they are available
+    for usi in (input_a, input_b):
+        if str(usi).startswith("mzspec"):
+            status, _ = request_usi(usi)
+            if status == USI_PENDING:
+                return html.Div(f"Resolving USI {usi}..."), True
+            if status == USI_FAILED:
+                return html.Div(f"Could not resolve USI {usi}."), False
+
+    return _render_mirror_plot(input_a, input_b, mass_range, bin_size, presence), False
+
+@memoize_callback()
+def _render_mirror_plot(input_a, input_b, mass_range, bin_size, presence):
+    """ Renders the mirror plot of two spectra. Independent of the button clicks, so
+    identical plots are shared across users.
+
+    Args:
+        input_a (str): The database id or USI of the top spectrum.
+        input_b (str): The database id or USI of the bottom spectrum.
+        mass_range (list): The m/z range to display.
+        bin_size (int): The bin size of the processed spectra.
+        presence (bool): Whether to plot presence/absence instead of intensities.
+
+    Returns:
+        html.Div: The mirror plot.
     """
     if input_a is None or input_a == "":
         return html.Div("Please select a valid input for A.")
@@ -652,18 +560,8 @@ def update_plot(input_a, input_b, mass_range, bin_size, presence, n_clicks):
     spectrum_a = _get_processed_spectrum(database_id_a, bin_size)
     spectrum_b = _get_processed_spectrum(database_id_b, bin_size)
 
-    # If presence-absence set nonzero intensities to 1
-    if presence and spectrum_a is not None:
-        for peak in spectrum_a['peaks']:
-            if peak['i'] > 0:
-                peak['i'] = 1.0
-    if presence and spectrum_b is not None:
-        for peak in spectrum_b['peaks']:
-            if peak['i'] > 0:
-                peak['i'] = 1.0
-
-    # Create the mirror plot
-    fig, cos_sim = create_mirror_plot(spectrum_a, spectrum_b, mass_range)
+    # Create the mirror plot, presence-absence sets nonzero intensities to 1
+    fig, cos_sim = create_mirror_plot(spectrum_a, spectrum_b, mass_range, presence=bool(presence))
 
     fig.update_layout(
         title=f"Mirror Plot of Spectra, Cosine Similarity: {cos_sim:.2f}" if cos_sim else "Mirror Plot of Spectrum A",
@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
+import dash
 from dash import dcc
 from dash import html
 from dash import dash_table
 import sys
 from dash import callback
+from dash import Patch
 from dash.dependencies import Input, Output, State
 import dash_bootstrap_components as dbc
 import json
@@ -23,10 +25,11 @@ import pandas as pd
 from dash import html, register_page 
 
 from utils import convert_to_mzml
-from typing import List
 
 
 from data_loader import load_database
+from callback_cache import memoize_callback
+from raw_view import get_raw_view
 
 
 dev_mode = False
@@ -42,6 +45,9 @@ register_page(
 
 PAGE_SIZE = 12
 
+# Points sent per replicate are bounded by the decimation, detail is fetched again on zoom
+RAW_VIEWER_BUCKETS = 2000
+
 SPECTRA_DASHBOARD = html.Div([
     dbc.CardHeader(html.H5("Raw Database Spectra")),
     dbc.CardBody([
@@ -62,6 +68,8 @@ SPECTRA_DASHBOARD = html.Div([
                 "gap": "10px",
             },
         ),
+        dcc.Store(id="raw-spectra-id"),
+        dcc.Graph(id="raw-spectra-graph", figure=go.Figure()),
     ]),
 ])
 
@@ -84,54 +92,57 @@ BODY = dbc.Container(
 def layout(**kwargs):
     return html.Div(children=[BODY])
 
-def _get_raw_spectrum(database_id:str)->dict:
-    # Finding all the database files
-    if database_id.upper().startswith("DELETED-"):
-        query_path = "database/deleted_depositions/**/{}.json".format(os.path.basename(database_id.upper().replace("DELETED-", "")))
-    else:
-        query_path = "database/depositions/**/{}.json".format(os.path.basename(database_id))
-
-    database_files = glob.glob(query_path)
-
-    if len(database_files) == 0:
-        print("No files found for:", query_path, flush=True, file=sys.stderr)
-        return "File not found", 404
-    
-    if len(database_files) > 1:
-        print("Multiple files found for:", query_path, flush=True, file=sys.stderr)
-        return "Multiple files found", 500
-    
-
-    with open(os.path.join(os.path.dirname(database_files[0]), os.path.basename(database_files[0]))) as json_file:
-        return json.load(json_file)
+def _parse_x_range(relayout_data:dict)->tuple:
+    """ Returns the visible m/z window of a zoom or pan event.
 
+    Args:
+        relayout_data (dict): The relayoutData of the graph. The subplots share their x-axis,
+            so any of xaxis, xaxis2, ... may carry the range.
 
-def format_spectrum(spectrum: dict) -> List[np.array]:
-    """Formats the spectrum for display.
+    Returns:
+        tuple: (min, max), None to show the whole spectrum, False if the event did not change the x-axis.
+    """
+    if relayout_data is None:
+        return False
+
+    for key, value in relayout_data.items():
+        if key.startswith("xaxis") and key.endswith(".autorange") and value:
+            return None
+        if key.startswith("xaxis") and key.endswith(".range[0]"):
+            return (float(value), float(relayout_data[key.replace("[0]", "[1]")]))
+        if key.startswith("xaxis") and key.endswith(".range") and isinstance(value, list):
+            return (float(value[0]), float(value[1]))
+    return False
+
+def _decimate_replicates(database_id:str, x_range:tuple=None)->list:
+    """ Downsamples the replicates of a raw spectrum for the visible m/z window, from the
+    precomputed pyramid when there is one.
 
     Args:
-        spectrum (dict): The spectrum to format.
+        database_id (str): The database id.
+        x_range (tuple, optional): (min, max) visible m/z window, the whole spectrum if None.
 
     Returns:
-        List[np.array]: The formatted spectrum.
+        list: (x, y) lists for each replicate, None if the spectrum was not found.
     """
-    peaks_list = spectrum["spectrum"]
+    if x_range is None:
+        x_range = (None, None)
 
-    peaks = [np.array(x) for x in peaks_list]
-    sorted_peaks = []
-    # Sort eah peak list by mz
-    for peak_list in peaks:
-        sorted_indices = np.argsort(peak_list[:,0])
-        sorted_peaks.append(peak_list[sorted_indices])
+    raw_view = get_raw_view(database_id, x_range[0], x_range[1], width=RAW_VIEWER_BUCKETS)
+    if raw_view is None:
+        return None
 
-    return sorted_peaks
+    return [(replicate[:, 0].tolist(), replicate[:, 1].tolist()) for replicate in raw_view["replicates"]]
 
 @callback(
     Output("raw-spectra", "children"),
+    Output("raw-spectra-graph", "figure"),
+    Output("raw-spectra-id", "data"),
     Input("database-id", 'value'),
     Input('url', 'search'),
     prevent_initial_call=False
 )
+@memoize_callback()
 def update_raw_viewer(database_id, search):
     print("got database_id", database_id, "search", search, flush=True)
     if database_id is None and search is not None:
@@ -140,12 +151,10 @@ def update_raw_viewer(database_id, search):
     database = load_database(None)[0]
 
     if database is None:
-        return []
-
-    data_table = pd.DataFrame(database)
+        return [], go.Figure(), None
 
     if database_id is None:
-        database_id = data_table.iloc[0]["database_id"]
+        database_id = database[0]["database_id"]
 
     database_id = str(database_id).strip()
     
@@ -157,8 +166,9 @@ def update_raw_viewer(database_id, search):
                             style={"margin": "5px"},
                         )
 
-    spectrum_data = _get_raw_spectrum(database_id)
-    spectra_to_display = format_spectrum(spectrum_data)
+    spectra_to_display = _decimate_replicates(database_id)
+    if spectra_to_display is None:
+        return [html.Div(f"No raw spectrum found for: {database_id}")], go.Figure(), None
 
     # Calculate the number of subplots needed
     num_spectra = len(spectra_to_display)
@@ -166,8 +176,8 @@ def update_raw_viewer(database_id, search):
     # Create subplots with shared x-axes
     fig = make_subplots(rows=num_spectra, cols=1, shared_xaxes=True, vertical_spacing=0.02)
 
-    for i, s in enumerate(spectra_to_display, start=1):
-        fig.add_trace(go.Scatter(x=s[:, 0], y=s[:, 1], mode='lines', name=f"Replicate {i}"), row=i, col=1)
+    for i, (x, y) in enumerate(spectra_to_display, start=1):
+        fig.add_trace(go.Scattergl(x=x, y=y, mode='lines', name=f"Replicate {i}"), row=i, col=1)
 
     fig.update_layout(
         height=200 * num_spectra,
@@ -211,7 +221,34 @@ def update_raw_viewer(database_id, search):
             ],
             style={"display":"block", "width":"100%"}
         ),
-        html.Div(dcc.Graph(figure=fig))
     ]
 
-    return children
\ No newline at end of file
+    return children, fig, database_id
+
+@callback(
+    Output("raw-spectra-graph", "figure", allow_duplicate=True),
+    Input("raw-spectra-graph", "relayoutData"),
+    State("raw-spectra-id", "data"),
+    prevent_initial_call=True
+)
+def update_raw_viewer_detail(relayout_data, database_id):
+    """ Resamples the replicates for the visible m/z window after a zoom or pan.
+
+    Args:
+        relayout_data (dict): The relayoutData of the graph.
+        database_id (str): The database id of the plotted spectrum.
+    """
+    x_range = _parse_x_range(relayout_data)
+    if database_id is None or x_range is False:
+        return dash.no_update
+
+    spectra_to_display = _decimate_replicates(database_id, x_range)
+    if spectra_to_display is None:
+        return dash.no_update
+
+    # Only the trace data is replaced, the zoom of the figure is kept
+    patched_figure = Patch()
+    for i, (x, y) in enumerate(spectra_to_display):
+        patched_figure["data"][i]["x"] = x
+        patched_figure["data"][i]["y"] = y
+    return patched_figure
\ No newline at end of file
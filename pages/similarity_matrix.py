@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+import dash
+from dash import dcc
+from dash import html
+from dash import callback
+from dash.dependencies import Input, Output, State
+import dash_bootstrap_components as dbc
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+
+import numpy as np
+from scipy.cluster.hierarchy import linkage, dendrogram
+from scipy.spatial.distance import squareform
+
+from dash import html, register_page
+
+from callback_cache import memoize_callback
+from database_index import get_database_index
+from spectra_loader import load_processed_peaks_batch
+from spectrum_similarity import similarity_matrix, prepare_spectrum
+
+register_page(
+    __name__,
+    name='IDBac Similarity Matrix',
+    top_nav=True,
+    path='/admin/similarity_matrix'
+)
+
+# Upper bound on the number of spectra compared at once
+MAX_SELECTED_SPECTRA = 300
+
+SIMILARITY_DASHBOARD = html.Div([
+    dbc.CardHeader(html.H5("Spectral Similarity Matrix")),
+    dbc.CardBody([
+        html.H6(f"Select up to {MAX_SELECTED_SPECTRA} Database Entries", className="mb-3"),
+        dcc.Dropdown(
+            id="similarity-input",
+            placeholder="Search by strain name",
+            style={'margin':'5px'},
+            options=[],
+            multi=True
+        ),
+        html.Label("Bin Size:"),
+        dcc.Dropdown(
+            id='similarity-bin-size',
+            options=[
+                {'label': '10 Da', 'value': 10},
+                {'label': '5 Da', 'value': 5},
+                {'label': '1 Da', 'value': 1},
+            ],
+            value=10,
+            clearable=False,
+            style={'margin':'5px'},
+        ),
+        html.Label("Similarity:"),
+        dcc.Dropdown(
+            id="similarity-metric",
+            options=[
+                {'label': 'Cosine', 'value': 'cosine'},
+                {'label': 'Presence-Absence', 'value': 'presence'},
+            ],
+            value='cosine',
+            clearable=False,
+            style={'margin':'5px'},
+        ),
+        dbc.Button("Compute", id="similarity-update", n_clicks=0),
+        dcc.Loading(
+            html.Div(id="similarity-container", style={"marginTop": 20}),
+        ),
+    ]),
+])
+
+BODY = dbc.Container(
+    [
+        dbc.Row([
+            dbc.Col(
+                dbc.Card(SIMILARITY_DASHBOARD),
+                className="w-100"
+            ),
+        ], style={"marginTop": 30}),
+    ],
+    fluid=True,
+    className="",
+)
+
+def layout(**kwargs):
+    return html.Div(children=[BODY])
+
+@callback(
+    Output("similarity-input", "options"),
+    Input("similarity-input", "search_value"),
+    Input("similarity-input", "value"),
+)
+def update_similarity_options(search_value, values):
+    """ Returns the dropdown options matching the text typed by the user.
+
+    Args:
+        search_value (str): The text typed in the dropdown.
+        values (list): The selected database ids, always kept in the options.
+
+    Returns:
+        list: The options for the dropdown.
+    """
+    database_index = get_database_index()
+    if database_index is None:
+        return []
+
+    options = database_index.search("strain_name", search_value)
+
+    # The selected values have to stay in the options, otherwise the dropdown clears them
+    option_values = set(option["value"] for option in options)
+    for value in values or []:
+        if value not in option_values:
+            selected_option = database_index.get_option("strain_name", value)
+            if selected_option is not None:
+                options.append(selected_option)
+
+    return options
+
+@memoize_callback(maxsize=16)
+def compute_similarity(database_ids:list, bin_width:int, metric:str)->dict:
+    """ Computes the pairwise similarity of processed spectra.
+
+    Args:
+        database_ids (list): The database ids.
+        bin_width (int): The size of bins used in the spectra (Da).
+        metric (str): 'cosine' or 'presence' (cosine on presence/absence).
+
+    Returns:
+        dict: 'database_ids' (those with a processed spectrum), 'missing' and 'matrix' (N x N list).
+    """
+    all_peaks = load_processed_peaks_batch(database_ids, bin_width)
+
+    found_ids = [database_id for database_id in database_ids if database_id in all_peaks]
+    spectra = [prepare_spectrum(all_peaks[database_id], presence=(metric == "presence")) for database_id in found_ids]
+
+    return {
+        "database_ids": found_ids,
+        "missing": [database_id for database_id in database_ids if database_id not in all_peaks],
+        "matrix": similarity_matrix(spectra).tolist(),
+    }
+
+def create_similarity_figure(matrix:np.ndarray, labels:list)->go.Figure:
+    """ Creates a heatmap of the similarity matrix ordered by hierarchical clustering,
+    with the dendrogram on top.
+
+    Args:
+        matrix (np.ndarray): The (N, N) similarity matrix, N >= 2.
+        labels (list): The labels of the rows.
+
+    Returns:
+        go.Figure: The figure.
+    """
+    # Average linkage on cosine distances, linkage rejects NaN so undefined scores count as 0
+    matrix = np.nan_to_num(np.asarray(matrix, dtype=np.float64), nan=0.0)
+    distances = squareform(np.clip(1.0 - matrix, 0.0, None), checks=False)
+    clustering = dendrogram(linkage(distances, method="average"), no_plot=True)
+    order = clustering["leaves"]
+
+    fig = make_subplots(rows=2, cols=1, shared_xaxes=True, row_heights=[0.25, 0.75], vertical_spacing=0.01)
+
+    # Dendrogram leaves are placed at 5, 15, 25, ...
+    for x, y in zip(clustering["icoord"], clustering["dcoord"]):
+        fig.add_trace(go.Scatter(x=x, y=y, mode="lines", line=dict(color="black", width=1),
+                                 hoverinfo="skip", showlegend=False), row=1, col=1)
+
+    positions = [5 + 10 * i for i in range(len(order))]
+    ordered_labels = [labels[i] for i in order]
+    fig.add_trace(
+        go.Heatmap(
+            z=matrix[np.ix_(order, order)],
+            x=positions,
+            y=positions,
+            customdata=[[f"{row_label} / {column_label}" for column_label in ordered_labels] for row_label in ordered_labels],
+            hovertemplate="%{customdata}<br>Similarity: %{z:.3f}<extra></extra>",
+            colorscale="Viridis",
+            zmin=0,
+            zmax=1,
+        ),
+        row=2, col=1
+    )
+
+    fig.update_xaxes(tickvals=positions, ticktext=ordered_labels, row=2, col=1)
+    fig.update_yaxes(tickvals=positions, ticktext=ordered_labels, autorange="reversed", row=2, col=1)
+    fig.update_xaxes(showticklabels=False, row=1, col=1)
+    fig.update_yaxes(showticklabels=False, row=1, col=1)
+
+    size = min(max(600, 20 * len(labels) + 300), 2000)
+    fig.update_layout(height=size, width=size, margin=dict(l=10, r=10, t=10, b=10))
+    return fig
+
+@callback(
+    Output("similarity-container", "children"),
+    State("similarity-input", "value"),
+    State("similarity-bin-size", "value"),
+    State("similarity-metric", "value"),
+    Input("similarity-update", "n_clicks"),
+    prevent_initial_call=True,
+)
+def update_similarity_matrix(database_ids, bin_width, metric, n_clicks):
+    """ Computes and plots the similarity matrix of the selected entries.
+
+    Args:
+        database_ids (list): The selected database ids.
+        bin_width (int): The size of bins used in the spectra (Da).
+        metric (str): 'cosine' or 'presence'.
+        n_clicks (int): The number of clicks on the compute button.
+    """
+    database_ids = list(dict.fromkeys(database_ids or []))
+    if len(database_ids) < 2:
+        return html.Div("Please select at least two entries.")
+    if len(database_ids) > MAX_SELECTED_SPECTRA:
+        return html.Div(f"Please select at most {MAX_SELECTED_SPECTRA} entries.")
+
+    # Sorted, so the same selection in any order shares the cached matrix
+    result = compute_similarity(sorted(database_ids), int(bin_width), metric)
+
+    messages = []
+    if len(result["missing"]) > 0:
+        messages.append(html.P(f"No processed spectrum for: {', '.join(result['missing'])}"))
+    if len(result["database_ids"]) < 2:
+        return html.Div(messages + [html.P("Not enough processed spectra to compare.")])
+
+    database_index = get_database_index()
+    labels = []
+    for database_id in result["database_ids"]:
+        record = database_index.get_record(database_id) if database_index is not None else None
+        labels.append(f"{record.get('Strain name', database_id)} ({database_id})" if record is not None else database_id)
+
+    fig = create_similarity_figure(np.array(result["matrix"]), labels)
+
+    return html.Div(messages + [dcc.Graph(id="similarity-plot", figure=fig)])
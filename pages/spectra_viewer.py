@@ -24,6 +24,10 @@ from dash import html, register_page
 from utils import convert_to_mzml
 
 from data_loader import load_database
+from callback_cache import memoize_callback
+from database_index import get_database_index
+from spectra_loader import load_processed_peaks_batch, get_processed_spectra_store
+from qc_metrics import QC_CONVEXITY, QC_TIC, QC_PEAK_COUNT, QC_REPLICATE_COUNT, QC_NOISE_LEVEL
 
 dev_mode = False
 if not os.path.isdir('/app'):
@@ -38,6 +42,16 @@ register_page(
 
 PAGE_SIZE = 12
 
+# Gallery orders, ranking outliers by the QC columns of the summary
+GALLERY_ORDERS = {
+    "database": ("Database order", None, True),
+    "convexity": ("Convexity (highest first)", QC_CONVEXITY, False),
+    "noise": ("Noise level (highest first)", QC_NOISE_LEVEL, False),
+    "peak_count": ("Peak count (lowest first)", QC_PEAK_COUNT, True),
+    "tic": ("TIC (lowest first)", QC_TIC, True),
+    "replicates": ("Replicate count (lowest first)", QC_REPLICATE_COUNT, True),
+}
+
 SPECTRA_DASHBOARD = html.Div([
     dbc.CardHeader(html.H5("Processed Database Spectra")),
     dbc.CardBody([
@@ -45,6 +59,14 @@ SPECTRA_DASHBOARD = html.Div([
             dbc.Input(id="search-input", placeholder="Enter Database ID...", type="text"),
             dbc.Button("Search", id="search-button", n_clicks=0),
         ], className="mb-3"),
+        html.Label("Order by:"),
+        dcc.Dropdown(
+            id="gallery-order",
+            options=[{"label": label, "value": value} for value, (label, _, _) in GALLERY_ORDERS.items()],
+            value="database",
+            clearable=False,
+            style={'margin':'5px'},
+        ),
         html.Div(
             id="spectra-container",
             style={
@@ -84,33 +106,6 @@ BODY = dbc.Container(
 def layout(**kwargs):
     return html.Div(children=[BODY])
 
-def _get_processed_spectrum(database_id:str)->dict:
-    """ Returns the processed spectrum for a given database id.
-
-    Args:
-        database_id (str): The database id to search for.
-
-    Returns:
-        dict: The processed spectrum.
-    """
-    # Finding all the database files
-    bin_width = 10 # Fixed bin width of 10 for now
-    if dev_mode:
-        database_files = glob.glob(f"workflows/idbac_summarize_database/nf_output/{str(bin_width)}_da_bin/output_spectra_json/**/{os.path.basename(database_id)}.json")
-    else:
-        database_files = glob.glob(f"/app/workflows/idbac_summarize_database/nf_output/{str(bin_width)}_da_bin/output_spectra_json/**/{os.path.basename(database_id)}.json")
-
-    if len(database_files) == 0:
-        return None
-    
-    if len(database_files) > 1:
-        return None
-
-    with open(database_files[0]) as file_handle:
-        spectrum_dict = json.load(file_handle)
-
-        return spectrum_dict
-
 @callback(
     Output("pagination", "max_value"),
     Input("pagination", "active_page"), # We don't really need this, but dash requires some input
@@ -181,40 +176,121 @@ def estimate_convexity(spectrum: dict, rescale:bool=False) -> tuple:
     
     return convexity, x, fitted_y
 
+@memoize_callback(maxsize=8)
+def _get_gallery_order(order:str)->list:
+    """ Returns the database ids in the order of the gallery, using the QC columns of the
+    summary so no spectra are read. Entries without the metric come last.
+
+    Args:
+        order (str): A key of GALLERY_ORDERS.
+
+    Returns:
+        list: The database ids.
+    """
+    database_index = get_database_index()
+    if database_index is None:
+        return []
+
+    database_ids = [str(record.get("database_id")) for record in database_index.database]
+    _, column, ascending = GALLERY_ORDERS.get(order, GALLERY_ORDERS["database"])
+    if column is None:
+        return database_ids
+
+    values = pd.to_numeric(pd.Series([record.get(column) for record in database_index.database]), errors="coerce")
+    ordered_positions = values.sort_values(ascending=ascending, na_position="last", kind="stable").index
+    return [database_ids[position] for position in ordered_positions]
+
 @callback(
     Output("spectra-container", "children"),
     Output("pagination", "active_page"),
     Input("pagination", "active_page"),
     Input("search-button", "n_clicks"),
+    Input("gallery-order", "value"),
     State("search-input", "value"),
     prevent_initial_call=False
 )
-def update_spectra_display(active_page, n_clicks, search_id):
-    database = load_database(None)[0]
-    if database is None:
+def update_spectra_display(active_page, n_clicks, order, search_id):
+    database_index = get_database_index()
+    if database_index is None:
         return [], 1
 
-    data_table = pd.DataFrame(database)
+    if order is None:
+        order = "database"
+
     # Determine if this callback was triggered by the search button
     if ctx.triggered_id == "search-button" and search_id:
         # Find the index of the searched ID
-        matching_rows = data_table.index[data_table['database_id'] == search_id].tolist()
-        if not matching_rows:
+        if order == "database":
+            index = database_index.get_position(search_id)
+        else:
+            gallery_order = _get_gallery_order(order)
+            index = gallery_order.index(search_id.strip()) if search_id.strip() in gallery_order else None
+        if index is None:
             return dash.no_update  # No match found
 
-        index = matching_rows[0]
         active_page = (index // PAGE_SIZE) + 1  # Calculate the page number
+    elif ctx.triggered_id == "gallery-order":
+        active_page = 1
 
     # Normal pagination handling
     if active_page is None:
         active_page = 1
 
+    return _render_spectra_page(active_page, order), active_page
+
+@memoize_callback()
+def _render_spectra_page(active_page:int, order:str="database")->list:
+    """ Renders the processed spectra of a page.
+
+    Args:
+        active_page (int): The page number, starting at 1.
+        order (str, optional): A key of GALLERY_ORDERS.
+
+    Returns:
+        list: The spectra cards.
+    """
+    database_index = get_database_index()
+    if database_index is None:
+        return []
+
     start_index = (active_page - 1) * PAGE_SIZE
     end_index = start_index + PAGE_SIZE
-    ids_to_display = data_table.iloc[start_index:end_index]['database_id'].values
-    if ids_to_display is None:
-        return [], active_page
-    
+    page_ids = _get_gallery_order(order)[start_index:end_index]
+
+    # One read of the packed store for the whole page, the convexity fits are precomputed
+    bin_width = 10 # Fixed bin width of 10 for now
+    all_peaks = load_processed_peaks_batch(page_ids, bin_width)
+    store = get_processed_spectra_store(bin_width)
+
+    ids_to_display = []
+    spectra_to_display = []
+    estimated_convexity_rescaled = []
+    x = []
+    fitted_y = []
+    for database_id in page_ids:
+        peaks = all_peaks.get(database_id)
+        if peaks is None:
+            continue
+        spectrum = {"x": peaks[:, 0], "y": peaks[:, 1]}
+
+        # Spectra with too few peaks for a quadratic fit are shown without one
+        if store is not None and database_id in store:
+            coefficients = store.get_convexity(database_id)
+            rescaled_convexity = store.get_convexity(database_id, rescale=True)[0]
+            spectrum_fitted_y = np.polyval(coefficients, spectrum["x"])
+        elif len(peaks) < 3:
+            rescaled_convexity = np.nan
+            spectrum_fitted_y = np.full(len(peaks), np.nan)
+        else:
+            _, _, spectrum_fitted_y = estimate_convexity(spectrum)
+            rescaled_convexity, _, _ = estimate_convexity(spectrum, rescale=True)
+
+        ids_to_display.append(database_id)
+        spectra_to_display.append(spectrum)
+        estimated_convexity_rescaled.append(rescaled_convexity)
+        x.append(spectrum["x"])
+        fitted_y.append(spectrum_fitted_y)
+
     # Create download links for each database id
     download_links = [
         html.A(
@@ -226,12 +302,18 @@ def update_spectra_display(active_page, n_clicks, search_id):
         for database_id in ids_to_display
     ]
 
-    spectra_to_display = [_get_processed_spectrum(i) for i in ids_to_display]
-    spectra_to_display = [format_spectrum(s) for s in spectra_to_display if s is not None]
-    temp = [estimate_convexity(s) for s in spectra_to_display]
-    estimated_convexity, x, fitted_y = zip(*temp)
-    temp = [estimate_convexity(s, rescale=True) for s in spectra_to_display]
-    estimated_convexity_rescaled, x_rescaled, fitted_y_rescaled = zip(*temp)
+    # QC metrics from the summary, when the workflow has computed them
+    qc_labels = []
+    for database_id in ids_to_display:
+        record = database_index.get_record(database_id) or {}
+        peak_count = pd.to_numeric(record.get(QC_PEAK_COUNT), errors="coerce")
+        replicate_count = pd.to_numeric(record.get(QC_REPLICATE_COUNT), errors="coerce")
+        if pd.isna(peak_count):
+            qc_labels.append("")
+        elif pd.isna(replicate_count):
+            qc_labels.append(f"Peaks: {int(peak_count)}")
+        else:
+            qc_labels.append(f"Peaks: {int(peak_count)}, Replicates: {int(replicate_count)}")
 
     children = [
         html.Div(
@@ -239,7 +321,8 @@ def update_spectra_display(active_page, n_clicks, search_id):
                 html.Div(
                     [
                         f"Database ID: {ids_to_display[idx]}", html.Br(),
-                        f"Rescaled Convexity: {estimated_convexity_rescaled[idx].item():.2e}", html.Br(),
+                        "Rescaled Convexity: " + ("n/a" if np.isnan(estimated_convexity_rescaled[idx]) else f"{float(estimated_convexity_rescaled[idx]):.2e}"), html.Br(),
+                        qc_labels[idx], html.Br(),
                         download_links[idx],
                     ],
                     style={
@@ -284,4 +367,4 @@ def update_spectra_display(active_page, n_clicks, search_id):
         for idx, s in enumerate(spectra_to_display)
     ]
     
-    return children, active_page
+    return children
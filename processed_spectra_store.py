@@ -0,0 +1,213 @@
+import glob
+import json
+import os
+import shutil
+
+import ijson
+import numpy as np
+from ulid import ULID
+
+# Packed copy of the processed spectra of one bin width, built after the nextflow
+# workflow. Peaks of all entries are stored in flat arrays, so a page of spectra is
+# read with a few slices of memory-mapped files instead of one JSON file per entry.
+#
+# Every build writes a new version folder (processed_spectra-<ULID>), published by
+# atomically replacing the processed_spectra symlink. Readers resolve the link once and
+# open every file of the store from that version, which is never modified.
+STORE_FOLDER_NAME = "processed_spectra"
+
+# The previous version is kept for readers that resolved it just before a swap
+STORE_VERSIONS_KEPT = 2
+
+def convexity_coefficients(x:np.ndarray, y:np.ndarray, rescale:bool=False)->np.ndarray:
+    """ Fits a quadratic polynomial to a spectrum.
+
+    Args:
+        x (np.ndarray): The m/z values, sorted.
+        y (np.ndarray): The intensities.
+        rescale (bool): Whether to rescale the x & y values between 0 and 100 before fitting.
+
+    Returns:
+        np.ndarray: The 3 polynomial coefficients, the first one is the convexity. NaN if
+            there are fewer than 3 peaks.
+    """
+    if len(x) < 3:
+        return np.full(3, np.nan)
+
+    if rescale:
+        x = (x - np.min(x)) / (np.max(x) - np.min(x)) * 100
+        y = (y - np.min(y)) / (np.max(y) - np.min(y)) * 100
+
+    return np.polyfit(x, y, 2)
+
+def _iter_processed_spectra(bin_folder:str):
+    """ Yields (database_id, peaks) from the nextflow output of one bin width. """
+    merged_filename = os.path.join(bin_folder, "output_merged_spectra.json")
+    if os.path.exists(merged_filename):
+        # Streamed one entry at a time, the merged file of the 1 Da bins is the largest output
+        with open(merged_filename, "rb") as f:
+            for entry in ijson.items(f, "item", use_float=True):
+                yield str(entry["database_id"]), entry.get("peaks", [])
+        return
+
+    for json_filename in glob.glob(os.path.join(bin_folder, "output_spectra_json", "**", "*.json"), recursive=True):
+        with open(json_filename) as f:
+            entry = json.load(f)
+        yield os.path.basename(json_filename).replace(".json", ""), entry.get("peaks", [])
+
+def resolve_store_folder(store_folder:str)->str:
+    """ Returns the version folder a store link points to (the folder itself for a store
+    of the previous layout), so every file of the store is read from the same version.
+
+    Args:
+        store_folder (str): The store link, e.g. nf_output/10_da_bin/processed_spectra.
+
+    Returns:
+        str: The version folder, None if no store has been built.
+    """
+    if os.path.islink(store_folder):
+        return os.path.join(os.path.dirname(store_folder), os.readlink(store_folder))
+    if os.path.isdir(store_folder):
+        return store_folder
+    return None
+
+def _prune_store_versions(bin_folder:str, current_version:str):
+    version_names = sorted(
+        name for name in os.listdir(bin_folder)
+        if name.startswith(f"{STORE_FOLDER_NAME}-") and os.path.isdir(os.path.join(bin_folder, name))
+    )
+    for version_name in version_names[:-STORE_VERSIONS_KEPT]:
+        if version_name != current_version:
+            shutil.rmtree(os.path.join(bin_folder, version_name), ignore_errors=True)
+
+def build_processed_spectra_store(bin_folder:str)->str:
+    """ Packs the processed spectra of one bin width and precomputes their convexity.
+
+    Args:
+        bin_folder (str): The nextflow output folder of the bin width, e.g. nf_output/10_da_bin.
+
+    Returns:
+        str: The store folder.
+    """
+    database_ids = []
+    offsets = [0]
+    mz_chunks = []
+    intensity_chunks = []
+    convexity = []
+    convexity_rescaled = []
+
+    for database_id, peaks in _iter_processed_spectra(bin_folder):
+        peak_array = np.array([[peak["mz"], peak["i"]] for peak in peaks], dtype=np.float64).reshape(-1, 2)
+        peak_array = peak_array[np.argsort(peak_array[:, 0], kind="stable")]
+
+        database_ids.append(database_id)
+        offsets.append(offsets[-1] + len(peak_array))
+        mz_chunks.append(peak_array[:, 0])
+        intensity_chunks.append(peak_array[:, 1])
+        convexity.append(convexity_coefficients(peak_array[:, 0], peak_array[:, 1]))
+        convexity_rescaled.append(convexity_coefficients(peak_array[:, 0], peak_array[:, 1], rescale=True))
+
+    store_folder = os.path.join(bin_folder, STORE_FOLDER_NAME)
+    version_name = f"{STORE_FOLDER_NAME}-{ULID()}"
+    version_folder = os.path.join(bin_folder, version_name)
+    os.makedirs(version_folder)
+
+    np.save(os.path.join(version_folder, "offsets.npy"), np.array(offsets, dtype=np.int64))
+    np.save(os.path.join(version_folder, "mz.npy"), np.concatenate(mz_chunks) if mz_chunks else np.zeros(0))
+    np.save(os.path.join(version_folder, "i.npy"), np.concatenate(intensity_chunks) if intensity_chunks else np.zeros(0))
+    np.save(os.path.join(version_folder, "convexity.npy"), np.array(convexity, dtype=np.float64).reshape(-1, 3))
+    np.save(os.path.join(version_folder, "convexity_rescaled.npy"), np.array(convexity_rescaled, dtype=np.float64).reshape(-1, 3))
+    with open(os.path.join(version_folder, "ids.json"), "w") as f:
+        json.dump(database_ids, f)
+
+    # A store folder of the previous layout is moved aside once, so the link can replace it
+    if os.path.isdir(store_folder) and not os.path.islink(store_folder):
+        os.replace(store_folder, os.path.join(bin_folder, f"{STORE_FOLDER_NAME}-0-legacy"))
+
+    # Swapping in the new version with a single rename of the link
+    temp_link = f"{store_folder}.{os.getpid()}.tmp"
+    if os.path.lexists(temp_link):
+        os.remove(temp_link)
+    os.symlink(version_name, temp_link)
+    os.replace(temp_link, store_folder)
+
+    _prune_store_versions(bin_folder, version_name)
+
+    return store_folder
+
+class ProcessedSpectraStore:
+    """ Read access to a store written by build_processed_spectra_store. """
+
+    def __init__(self, store_folder:str):
+        # Resolved once, a rebuild during the load cannot mix two versions
+        resolved_folder = resolve_store_folder(store_folder)
+        if resolved_folder is None:
+            raise FileNotFoundError(f"No processed spectra store at {store_folder}")
+        store_folder = resolved_folder
+        self.store_folder = store_folder
+
+        with open(os.path.join(store_folder, "ids.json")) as f:
+            self.database_ids = json.load(f)
+        self.positions = {database_id: position for position, database_id in enumerate(self.database_ids)}
+
+        # Memory-mapped, so only the pages that are read are loaded
+        self.offsets = np.load(os.path.join(store_folder, "offsets.npy"))
+        self.mz = np.load(os.path.join(store_folder, "mz.npy"), mmap_mode="r")
+        self.intensities = np.load(os.path.join(store_folder, "i.npy"), mmap_mode="r")
+        self.convexity = np.load(os.path.join(store_folder, "convexity.npy"))
+        self.convexity_rescaled = np.load(os.path.join(store_folder, "convexity_rescaled.npy"))
+
+    def __contains__(self, database_id:str)->bool:
+        return database_id in self.positions
+
+    def get_peaks(self, database_id:str)->np.ndarray:
+        """ Returns the peaks of an entry.
+
+        Args:
+            database_id (str): The database id.
+
+        Returns:
+            np.ndarray: (n, 2) array of [mz, intensity] sorted by mz, None if the entry is not in the store.
+        """
+        position = self.positions.get(database_id)
+        if position is None:
+            return None
+        start, end = self.offsets[position], self.offsets[position + 1]
+        return np.column_stack((self.mz[start:end], self.intensities[start:end]))
+
+    def get_convexity(self, database_id:str, rescale:bool=False)->np.ndarray:
+        """ Returns the precomputed convexity fit of an entry.
+
+        Args:
+            database_id (str): The database id.
+            rescale (bool): Whether to return the fit on rescaled values.
+
+        Returns:
+            np.ndarray: The 3 polynomial coefficients, None if the entry is not in the store.
+        """
+        position = self.positions.get(database_id)
+        if position is None:
+            return None
+        return (self.convexity_rescaled if rescale else self.convexity)[position]
+
+def test_store_swap(tmp_path):
+    bin_folder = str(tmp_path)
+    store_folder = os.path.join(bin_folder, STORE_FOLDER_NAME)
+
+    def write_merged_spectra(intensity):
+        with open(os.path.join(bin_folder, "output_merged_spectra.json"), "w") as f:
+            json.dump([{"database_id": "01A", "peaks": [{"mz": 2000.0, "i": intensity}, {"mz": 1000.0, "i": 1.0}]}], f)
+
+    write_merged_spectra(5.0)
+    build_processed_spectra_store(bin_folder)
+    first_store = ProcessedSpectraStore(store_folder)
+
+    for intensity in [7.0, 9.0]:
+        write_merged_spectra(intensity)
+        build_processed_spectra_store(bin_folder)
+
+    # A reader keeps the version it resolved, new readers see the latest one
+    assert os.path.islink(store_folder)
+    assert ProcessedSpectraStore(store_folder).get_peaks("01A").tolist() == [[1000.0, 1.0], [2000.0, 9.0]]
+    assert first_store.get_peaks("01A").tolist() == [[1000.0, 1.0], [2000.0, 5.0]]
+    assert len([name for name in os.listdir(bin_folder) if name.startswith(f"{STORE_FOLDER_NAME}-")]) == STORE_VERSIONS_KEPT
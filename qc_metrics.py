@@ -0,0 +1,91 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from processed_spectra_store import ProcessedSpectraStore
+
+# Written by the summarize workflow, merged into the summary as columns
+QC_METRICS_PATH = "database/qc_metrics.tsv"
+
+QC_CONVEXITY = "QC convexity"
+QC_TIC = "QC TIC"
+QC_PEAK_COUNT = "QC peak count"
+QC_REPLICATE_COUNT = "QC replicate count"
+QC_NOISE_LEVEL = "QC noise level"
+QC_COLUMNS = [QC_CONVEXITY, QC_TIC, QC_PEAK_COUNT, QC_REPLICATE_COUNT, QC_NOISE_LEVEL]
+
+def compute_qc_metrics(store_folder:str, scan_mapping_filename:str=None)->pd.DataFrame:
+    """ Computes the quality metrics of every processed spectrum in a store.
+
+    Args:
+        store_folder (str): The processed spectra store (see build_processed_spectra_store).
+        scan_mapping_filename (str, optional): The scan mapping written by format_database.py,
+            used to count the replicate spectra of each entry.
+
+    Returns:
+        pd.DataFrame: One row per database_id with the QC_COLUMNS. The convexity is fitted on
+            rescaled values, the noise level is the median absolute deviation of the
+            intensities relative to the base peak.
+    """
+    store = ProcessedSpectraStore(store_folder)
+
+    starts = store.offsets[:-1]
+    peak_counts = np.diff(store.offsets)
+    intensities = np.asarray(store.intensities)
+
+    tic = np.zeros(len(peak_counts))
+    noise_level = np.full(len(peak_counts), np.nan)
+    for position, (start, peak_count) in enumerate(zip(starts, peak_counts)):
+        if peak_count == 0:
+            continue
+        spectrum_intensities = intensities[start:start + peak_count]
+        tic[position] = np.sum(spectrum_intensities)
+        base_peak = np.max(spectrum_intensities)
+        if base_peak > 0:
+            noise_level[position] = np.median(np.abs(spectrum_intensities - np.median(spectrum_intensities))) / base_peak
+
+    qc_df = pd.DataFrame({
+        "database_id": store.database_ids,
+        QC_CONVEXITY: store.convexity_rescaled[:, 0],
+        QC_TIC: tic,
+        QC_PEAK_COUNT: peak_counts,
+        QC_NOISE_LEVEL: noise_level,
+    })
+
+    # Counting the spectra that were merged into each entry
+    if scan_mapping_filename is not None and os.path.exists(scan_mapping_filename):
+        scan_mapping_df = pd.read_csv(scan_mapping_filename, sep="\t", dtype={"database_id": str})
+        replicate_counts = scan_mapping_df.groupby("database_id").size()
+        qc_df[QC_REPLICATE_COUNT] = qc_df["database_id"].map(replicate_counts).astype("Int64")
+    else:
+        qc_df[QC_REPLICATE_COUNT] = pd.Series(pd.NA, index=qc_df.index, dtype="Int64")
+
+    return qc_df[["database_id"] + QC_COLUMNS]
+
+def merge_qc_metrics(summary_df:pd.DataFrame, qc_filename:str=QC_METRICS_PATH)->pd.DataFrame:
+    """ Adds the QC columns to the summary, replacing any previous values.
+
+    Args:
+        summary_df (pd.DataFrame): The summary, with a database_id column.
+        qc_filename (str, optional): The QC metrics written by compute_qc_metrics.
+
+    Returns:
+        pd.DataFrame: The summary with the QC columns, unchanged if there are no QC metrics yet.
+    """
+    if not os.path.exists(qc_filename):
+        return summary_df
+
+    qc_df = pd.read_csv(qc_filename, sep="\t", dtype={"database_id": str})
+    qc_df = qc_df.drop_duplicates("database_id").set_index("database_id")
+
+    summary_df = summary_df.copy()
+    database_ids = summary_df["database_id"].astype(str)
+    for column in QC_COLUMNS:
+        if column in qc_df.columns:
+            summary_df[column] = database_ids.map(qc_df[column])
+    # Counts stay integers next to entries without metrics
+    for column in [QC_PEAK_COUNT, QC_REPLICATE_COUNT]:
+        if column in summary_df.columns:
+            summary_df[column] = summary_df[column].round().astype("Int64")
+    return summary_df
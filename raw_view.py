@@ -0,0 +1,136 @@
+import glob
+import json
+import os
+import sys
+
+import numpy as np
+
+from deposition_journal import read_deposition
+from deposition_store import DEPOSITIONS_FOLDER, PYRAMID_LEVELS, PYRAMID_FULL, load_pyramid_level, load_pyramid_lengths, load_peaks_sidecar
+from spectrum_decimation import minmax_decimate
+
+# Points per replicate requested by a view, about one bucket per horizontal pixel
+RAW_VIEW_DEFAULT_WIDTH = 1000
+RAW_VIEW_MAX_WIDTH = 8000
+
+def load_raw_spectrum(database_id:str)->dict:
+    """ Loads the full deposition of a raw spectrum, from the JSON files or the deposition journal.
+
+    Args:
+        database_id (str): The database id, 'DELETED-' prefixed ids are looked up in the deleted depositions.
+
+    Returns:
+        dict: The deposition, None if it was not found (or found more than once).
+    """
+    # Finding all the database files
+    if database_id.upper().startswith("DELETED-"):
+        query_path = "database/deleted_depositions/**/{}.json".format(os.path.basename(database_id.upper().replace("DELETED-", "")))
+    else:
+        query_path = os.path.join(DEPOSITIONS_FOLDER, "**/{}.json".format(os.path.basename(database_id)))
+
+    database_files = glob.glob(query_path)
+
+    if len(database_files) == 0 and not database_id.upper().startswith("DELETED-"):
+        # Falling back to the deposition journal
+        deposition = read_deposition(database_id)
+        if deposition is not None:
+            return deposition
+
+    if len(database_files) == 0:
+        print("No files found for:", query_path, flush=True, file=sys.stderr)
+        return None
+
+    if len(database_files) > 1:
+        print("Multiple files found for:", query_path, flush=True, file=sys.stderr)
+        return None
+
+    with open(database_files[0]) as json_file:
+        return json.load(json_file)
+
+def sort_replicates(replicates:list)->list:
+    """ Sorts each replicate of a raw spectrum by m/z.
+
+    Args:
+        replicates (list): List of replicates, each a list of [mz, intensity] pairs or an (n, 2) array.
+
+    Returns:
+        list: List of replicates as (n, 2) np.ndarrays.
+    """
+    sorted_replicates = []
+    for replicate in replicates:
+        replicate = np.asarray(replicate, dtype=np.float64).reshape(-1, 2)
+        sorted_replicates.append(replicate[np.argsort(replicate[:, 0], kind="stable")])
+    return sorted_replicates
+
+def load_raw_replicates(database_id:str)->list:
+    """ Loads the replicates of a raw spectrum at full resolution, from the peaks sidecar
+    when it exists, otherwise from the full deposition.
+
+    Args:
+        database_id (str): The database id.
+
+    Returns:
+        list: List of replicates as (n, 2) np.ndarrays sorted by m/z, None if the spectrum was not found.
+    """
+    if not database_id.upper().startswith("DELETED-"):
+        replicates = load_peaks_sidecar(database_id)
+        if replicates is not None:
+            return sort_replicates(replicates)
+
+    deposition = load_raw_spectrum(database_id)
+    if deposition is None:
+        return None
+    return sort_replicates(deposition.get("spectrum", []))
+
+def _points_in_window(replicate:np.ndarray, mz_min:float, mz_max:float)->int:
+    return int(np.searchsorted(replicate[:, 0], mz_max, side="right") - np.searchsorted(replicate[:, 0], mz_min, side="left"))
+
+def get_raw_view(database_id:str, mz_min:float=None, mz_max:float=None, width:int=RAW_VIEW_DEFAULT_WIDTH)->dict:
+    """ Returns the replicates of a raw spectrum for an m/z window, with just enough points
+    to draw it at the given width. The coarsest pyramid level with at least two points per
+    bucket in the window is used, and is decimated to the window.
+
+    Args:
+        database_id (str): The database id.
+        mz_min (float, optional): The start of the window, the start of the spectrum if None.
+        mz_max (float, optional): The end of the window, the end of the spectrum if None.
+        width (int, optional): The number of m/z buckets (about pixels) across the window.
+
+    Returns:
+        dict: 'level' (the pyramid level used) and 'replicates', a list of (n, 2) np.ndarrays
+              of [mz, intensity]. None if the spectrum was not found.
+    """
+    database_id = str(database_id).strip()
+    mz_min = -np.inf if mz_min is None else mz_min
+    mz_max = np.inf if mz_max is None else mz_max
+
+    replicates = None
+    level_used = PYRAMID_FULL
+    full_lengths = None
+    if not database_id.upper().startswith("DELETED-"):
+        full_lengths = load_pyramid_lengths(database_id)
+
+    # Without a pyramid, or if no level is detailed enough, the full resolution replicates
+    # are decimated below
+    if full_lengths is not None:
+        for level in PYRAMID_LEVELS:
+            level_replicates = load_pyramid_level(database_id, level)
+
+            # A level is detailed enough if it has two points per bucket in the window,
+            # or if the replicate was short enough to be stored undecimated
+            if all(len(replicate) == full_length or _points_in_window(replicate, mz_min, mz_max) >= 2 * width
+                   for replicate, full_length in zip(level_replicates, full_lengths)):
+                replicates = level_replicates
+                level_used = level
+                break
+
+    if replicates is None:
+        replicates = load_raw_replicates(database_id)
+        if replicates is None:
+            return None
+
+    mz_range = None if (np.isinf(mz_min) and np.isinf(mz_max)) else (mz_min, mz_max)
+    return {
+        "level": level_used,
+        "replicates": [minmax_decimate(replicate, mz_range=mz_range, n_buckets=width) for replicate in replicates],
+    }
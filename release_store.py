@@ -0,0 +1,137 @@
+import logging
+import os
+import shutil
+import time
+
+import redis
+from ulid import ULID
+
+# Every build writes its outputs (summary, statistics, exports) to a new release folder,
+# which is published by atomically swapping the 'current' link. Files of a published
+# release are never modified, so readers never see a partially written file.
+RELEASES_FOLDER = "database/releases"
+CURRENT_LINK = os.path.join(RELEASES_FOLDER, "current")
+
+# Before the first release, the outputs are read from where the builds used to write them
+LEGACY_FOLDER = "database"
+
+# Old releases are kept for readers that resolved them just before a swap
+RELEASES_KEPT = 3
+
+# Published on every swap, with the new release id as the message
+RELEASE_CHANNEL = "database:release"
+CACHE_KEY_RELEASE = "database:release:current"
+
+def create_release(carry_over:list=None)->str:
+    """ Creates the folder of a new, unpublished release.
+
+    Args:
+        carry_over (list, optional): Files of the current release that are unchanged in the
+            new one. They are hard linked, so they must not be rewritten in place.
+
+    Returns:
+        str: The release folder.
+    """
+    release_folder = os.path.join(RELEASES_FOLDER, str(ULID()))
+    os.makedirs(release_folder)
+
+    for filename in carry_over or []:
+        source_path = release_path(filename)
+        if not os.path.exists(source_path):
+            continue
+        try:
+            os.link(source_path, os.path.join(release_folder, filename))
+        except OSError:
+            shutil.copy2(source_path, os.path.join(release_folder, filename))
+
+    return release_folder
+
+def discard_release(release_folder:str):
+    """ Removes a release that failed to build, before it is published. """
+    shutil.rmtree(release_folder, ignore_errors=True)
+
+def get_current_release()->str:
+    """ Returns the id of the published release, None before the first release. """
+    try:
+        return os.readlink(CURRENT_LINK)
+    except OSError:
+        return None
+
+def release_path(filename:str)->str:
+    """ Returns the path of a build output in the published release. The link is resolved
+    once, so files opened through the returned path all belong to the same release.
+
+    Args:
+        filename (str): The file (or folder) name within the release.
+
+    Returns:
+        str: The path, in the legacy folder if nothing is published yet.
+    """
+    release_id = get_current_release()
+    if release_id is None:
+        return os.path.join(LEGACY_FOLDER, filename)
+    return os.path.join(RELEASES_FOLDER, release_id, filename)
+
+def _notify_release(release_id:str):
+    try:
+        redis_client = redis.Redis(host='idbac-kb-redis', port=6379, db=0)
+        redis_client.set(CACHE_KEY_RELEASE, release_id)
+        redis_client.publish(RELEASE_CHANNEL, release_id)
+    except Exception as e:
+        logging.error(f"Failed to notify release {release_id}: {e}")
+
+def _prune_releases(current_release_id:str):
+    release_ids = sorted(release_id for release_id in os.listdir(RELEASES_FOLDER) if not release_id.startswith(os.path.basename(CURRENT_LINK)))
+    for release_id in release_ids[:-RELEASES_KEPT]:
+        if release_id == current_release_id:
+            continue
+        shutil.rmtree(os.path.join(RELEASES_FOLDER, release_id), ignore_errors=True)
+
+def publish_release(release_folder:str, notify:bool=True):
+    """ Makes a release current, by replacing the 'current' link in a single rename, then
+    notifies the workers and removes old releases.
+
+    Args:
+        release_folder (str): The folder returned by create_release, with every output written.
+        notify (bool, optional): Whether to publish the release id on RELEASE_CHANNEL.
+    """
+    release_id = os.path.basename(os.path.normpath(release_folder))
+
+    temp_link = f"{CURRENT_LINK}.{os.getpid()}.tmp"
+    if os.path.lexists(temp_link):
+        os.remove(temp_link)
+    os.symlink(release_id, temp_link)
+    os.replace(temp_link, CURRENT_LINK)
+
+    if notify:
+        _notify_release(release_id)
+    _prune_releases(release_id)
+
+def test_release_swap(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(LEGACY_FOLDER)
+    with open(os.path.join(LEGACY_FOLDER, "summary.tsv"), "w") as f:
+        f.write("legacy")
+
+    assert get_current_release() is None
+    assert release_path("summary.tsv") == os.path.join(LEGACY_FOLDER, "summary.tsv")
+
+    release_folders = []
+    for i in range(RELEASES_KEPT + 2):
+        time.sleep(0.002)   # Release ids are ordered by their millisecond timestamp
+        release_folder = create_release(carry_over=["summary.json"])
+        if i == 0:
+            with open(os.path.join(release_folder, "summary.json"), "w") as f:
+                f.write("json")
+        with open(os.path.join(release_folder, "summary.tsv"), "w") as f:
+            f.write(f"release {i}")
+        publish_release(release_folder, notify=False)
+        release_folders.append(release_folder)
+
+        with open(release_path("summary.tsv")) as f:
+            assert f.read() == f"release {i}"
+        with open(release_path("summary.json")) as f:
+            assert f.read() == "json"
+
+    # Only the newest releases are kept
+    assert sorted(os.listdir(RELEASES_FOLDER)) == sorted([os.path.basename(folder) for folder in release_folders[-RELEASES_KEPT:]] + ["current"])
@@ -0,0 +1,113 @@
+import gzip
+import hashlib
+import threading
+from functools import wraps
+
+from flask import request, Response
+
+# Serialized responses of read-only endpoints, one entry per endpoint, rebuilt when the
+# version of the underlying data changes. Clients revalidate with If-None-Match.
+GZIP_MIN_BYTES = 1024
+
+_responses = {}
+_locks = {}
+_locks_lock = threading.Lock()
+
+def _build_entry(body, version:str)->dict:
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+
+    # The ETag is a checksum of the body, so it is the same in every worker
+    digest = hashlib.sha256(body).hexdigest()[:32]
+    return {
+        "version": version,
+        "etag": digest,
+        "body": body,
+        "gzip_body": gzip.compress(body, compresslevel=6) if len(body) >= GZIP_MIN_BYTES else None,
+    }
+
+def _get_lock(name:str)->threading.Lock:
+    with _locks_lock:
+        if name not in _locks:
+            _locks[name] = threading.Lock()
+        return _locks[name]
+
+def cached_response(version, mimetype:str="application/json", name:str=None):
+    """ Caches the serialized response of a Flask view with no arguments. The view is only
+    called again once the data version changes; in between the same bytes are served,
+    gzip compressed if the client accepts it, and a matching If-None-Match gets a 304.
+
+    Args:
+        version (callable): Returns the current version of the underlying data.
+        mimetype (str, optional): The mimetype of the response.
+        name (str, optional): The cache name, defaults to the view name.
+
+    Returns:
+        callable: The decorator.
+    """
+    def decorator(func):
+        cache_name = name or f"{func.__module__}.{func.__name__}"
+
+        @wraps(func)
+        def wrapper():
+            current_version = version()
+
+            entry = _responses.get(cache_name)
+            if entry is None or entry["version"] != current_version:
+                # One rebuild per worker, concurrent requests wait for it
+                with _get_lock(cache_name):
+                    entry = _responses.get(cache_name)
+                    if entry is None or entry["version"] != current_version:
+                        entry = _build_entry(func(), current_version)
+                        _responses[cache_name] = entry
+
+            use_gzip = entry["gzip_body"] is not None and "gzip" in request.accept_encodings
+
+            # Each encoding is a different representation, with its own ETag
+            etag = entry["etag"] + ("-gzip" if use_gzip else "")
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+            else:
+                response = Response(entry["gzip_body"] if use_gzip else entry["body"], mimetype=mimetype)
+                if use_gzip:
+                    response.headers["Content-Encoding"] = "gzip"
+
+            response.set_etag(etag)
+            response.headers["Cache-Control"] = "no-cache"
+            response.headers["Vary"] = "Accept-Encoding"
+            return response
+
+        return wrapper
+    return decorator
+
+def test_cached_response():
+    from flask import Flask
+
+    app = Flask(__name__)
+    state = {"version": "1", "calls": 0}
+
+    @app.route("/options")
+    @cached_response(lambda: state["version"])
+    def options():
+        state["calls"] += 1
+        return "[" + ",".join(['{"value": %d}' % i for i in range(500)]) + "]"
+
+    client = app.test_client()
+    first = client.get("/options")
+    assert first.status_code == 200
+    assert first.headers.get("Content-Encoding") is None
+
+    compressed = client.get("/options", headers={"Accept-Encoding": "gzip"})
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(compressed.data) == first.data
+    assert compressed.headers["ETag"] != first.headers["ETag"]
+
+    not_modified = client.get("/options", headers={"If-None-Match": first.headers["ETag"]})
+    assert not_modified.status_code == 304
+    assert not_modified.data == b""
+    assert state["calls"] == 1
+
+    # A new version is rebuilt, an unchanged body keeps its ETag
+    state["version"] = "2"
+    assert client.get("/options", headers={"If-None-Match": first.headers["ETag"]}).status_code == 304
+    assert state["calls"] == 2
@@ -1,22 +1,49 @@
 import dash
 from dotenv import dotenv_values
-from flask import request
+from flask import request, Response, stream_with_context, current_app
 from flask import send_from_directory, send_file
 import glob
 import json
 import pandas as pd
 import os
+import gzip
+import zlib
 import yaml
+from ulid import ULID
+from celery.result import GroupResult
 
 
 import tasks
 from utils import convert_to_mzml
+from deposition_journal import read_deposition
+from deposition_spool import spool_depositions, load_receipt, is_staged
+from callback_cache import get_cache_stats
+from database_index import get_database_record
+from summary_store import read_summary_columns, get_summary_version
+from response_cache import cached_response
+from release_store import release_path
+from table_export import EXPORT_FOLDER_NAME, EXPORT_FORMATS, STREAMED_FORMATS, export_filename, iter_filtered_export
+from raw_view import get_raw_view, RAW_VIEW_DEFAULT_WIDTH, RAW_VIEW_MAX_WIDTH
 
 from flask import Blueprint
 api_blueprint = Blueprint('api_blueprint', __name__)
 
 _env = dotenv_values()
 
+# Number of spectra per deposition task for batch uploads
+DEPOSIT_BATCH_CHUNK_SIZE = 25
+
+# Largest request body accepted (set as the app's MAX_CONTENT_LENGTH), and largest
+# batch body once decompressed
+MAX_REQUEST_BYTES = 256 * 1024 * 1024
+DEPOSIT_BATCH_MAX_BYTES = 512 * 1024 * 1024
+
+# Batch uploads send the API credentials in this header, so they stay out of access logs
+CREDENTIALS_HEADER = "X-Credentials-Key"
+
+# Stage deposition payloads on disk and only pass references through the broker
+DEPOSITION_SPOOL = str(_env.get("DEPOSITION_SPOOL", "false")).lower() == "true"
+
 dev_mode = False
 if not os.path.isdir('/app'):
     dev_mode =  True
@@ -32,9 +59,15 @@ def refresh():
 
     return "Refreshing"
 
+@api_blueprint.route("/api/cache/stats", methods=["GET"])
+def cache_stats():
+    # Hit/miss counters of the memoized dash callbacks
+    return json.dumps(get_cache_stats())
+
 @api_blueprint.route("/api/get_all_strain_names", methods=["GET"])
+@cached_response(get_summary_version)
 def get_all_strain_names():
-    summary_df = pd.read_csv("database/summary.tsv", sep="\t")
+    summary_df = read_summary_columns(["Strain name"])
 
     return json.dumps(summary_df["Strain name"].tolist())
 
@@ -54,12 +87,187 @@ def deposit():
     spectrum_dict["task"] = request.values.get("task")
     spectrum_dict["user"] = request.values.get("user")
 
+    if DEPOSITION_SPOOL:
+        deposit_id = spool_depositions([spectrum_dict])
+        tasks.task_deposit_spooled.apply_async(args=[deposit_id], task_id=deposit_id)
+
+        response = Response("DONE")
+        response.headers["X-Deposit-Id"] = deposit_id
+        return response
+
     # Saving the results here
     task_result = tasks.task_deposit_data.delay(spectrum_dict, None)
 
     # Enable this call to be blocking
     return "DONE"
 
+class _BodyTooLarge(Exception):
+    pass
+
+def _gunzip_limited(body:bytes, max_bytes:int)->bytes:
+    """ Decompresses a gzip body incrementally, without ever holding more than max_bytes of output.
+
+    Args:
+        body (bytes): The gzip body, possibly of several concatenated members.
+        max_bytes (int): The largest decompressed size accepted.
+
+    Raises:
+        _BodyTooLarge: If the decompressed body is larger than max_bytes.
+        zlib.error: If the body is not valid gzip.
+
+    Returns:
+        bytes: The decompressed body.
+    """
+    chunks = []
+    total_bytes = 0
+    while len(body) > 0:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        data = body
+        while len(data) > 0 and not decompressor.eof:
+            chunk = decompressor.decompress(data, max_bytes - total_bytes + 1)
+            total_bytes += len(chunk)
+            if total_bytes > max_bytes:
+                raise _BodyTooLarge()
+            chunks.append(chunk)
+            data = decompressor.unconsumed_tail
+
+        if not decompressor.eof:
+            raise zlib.error("Truncated gzip body")
+
+        # The next gzip member, if any
+        body = decompressor.unused_data
+
+    return b"".join(chunks)
+
+@api_blueprint.route("/api/spectrum/batch", methods=["POST"])
+def deposit_batch():
+    # The body is NDJSON, one spectrum_json per line, optionally gzip compressed. It is read
+    # before anything else, so it is never parsed as form data.
+    max_request_bytes = current_app.config.get("MAX_CONTENT_LENGTH") or MAX_REQUEST_BYTES
+    if request.content_length is not None and request.content_length > max_request_bytes:
+        return "Request body is too large", 413
+    body = request.get_data(parse_form_data=False)
+
+    # Check the API credentials
+    assert("CREDENTIALSKEY" in _env)
+    request_credentials = request.headers.get(CREDENTIALS_HEADER)
+
+    if request_credentials != _env["CREDENTIALSKEY"]:
+        return "Invalid Credentials", 403
+
+    task = request.args.get("task")
+    user = request.args.get("user")
+
+    if request.headers.get("Content-Encoding", "").lower() == "gzip" or body[:2] == b"\x1f\x8b":
+        try:
+            body = _gunzip_limited(body, DEPOSIT_BATCH_MAX_BYTES)
+        except _BodyTooLarge:
+            return "Decompressed body is too large", 413
+        except zlib.error:
+            return "Invalid gzip body", 400
+
+    spectrum_dicts = []
+    for line_number, line in enumerate(body.splitlines(), start=1):
+        if len(line.strip()) == 0:
+            continue
+        try:
+            spectrum_dict = json.loads(line)
+        except json.JSONDecodeError:
+            return f"Invalid JSON on line {line_number}", 400
+        if not isinstance(spectrum_dict, dict) or "spectrum" not in spectrum_dict:
+            return f"Missing spectrum on line {line_number}", 400
+
+        spectrum_dict["task"] = task
+        spectrum_dict["user"] = user
+        spectrum_dicts.append(spectrum_dict)
+
+    if len(spectrum_dicts) == 0:
+        return "No spectra found", 400
+
+    # One task per chunk, grouped under the batch id for status polling
+    batch_id = str(ULID())
+    results = []
+    for i in range(0, len(spectrum_dicts), DEPOSIT_BATCH_CHUNK_SIZE):
+        chunk = spectrum_dicts[i:i + DEPOSIT_BATCH_CHUNK_SIZE]
+        if DEPOSITION_SPOOL:
+            deposit_id = spool_depositions(chunk)
+            results.append(tasks.task_deposit_spooled.apply_async(args=[deposit_id], task_id=deposit_id))
+        else:
+            results.append(tasks.task_deposit_batch.delay(chunk, None))
+    GroupResult(batch_id, results, app=tasks.celery_instance).save()
+
+    return json.dumps({
+        "batch_id": batch_id,
+        "num_spectra": len(spectrum_dicts),
+        "num_tasks": len(results),
+    })
+
+@api_blueprint.route("/api/spectrum/batch/status", methods=["GET"])
+def deposit_batch_status():
+    batch_id = request.values.get("batch_id")
+    if not batch_id:
+        return "Batch ID is required", 400
+
+    group_result = GroupResult.restore(os.path.basename(batch_id), app=tasks.celery_instance)
+    if group_result is None:
+        return "Batch not found", 404
+
+    num_deposited = 0
+    database_ids = []
+    num_failed = 0
+    num_pending = 0
+    for result in group_result.results:
+        if result.successful():
+            database_ids += result.result
+            num_deposited += len(result.result)
+        elif result.failed():
+            num_failed += 1
+        else:
+            num_pending += 1
+
+    if num_pending > 0:
+        state = "PENDING"
+    elif num_failed > 0:
+        state = "FAILURE"
+    else:
+        state = "SUCCESS"
+
+    return json.dumps({
+        "batch_id": batch_id,
+        "state": state,
+        "num_tasks": len(group_result.results),
+        "num_tasks_pending": num_pending,
+        "num_tasks_failed": num_failed,
+        "num_deposited": num_deposited,
+        "database_ids": database_ids,
+    })
+
+@api_blueprint.route("/api/deposit/status", methods=["GET"])
+def deposit_status():
+    deposit_id = request.values.get("deposit_id")
+    if not deposit_id:
+        return "Deposit ID is required", 400
+    deposit_id = os.path.basename(deposit_id)
+
+    receipt = load_receipt(deposit_id)
+    if receipt is not None:
+        return json.dumps({
+            "deposit_id": deposit_id,
+            "state": "DEPOSITED",
+            "database_ids": receipt["database_ids"],
+        })
+
+    if not is_staged(deposit_id):
+        return "Deposit not found", 404
+
+    # Staged but not yet deposited, the task id is the deposit id
+    task_state = tasks.celery_instance.AsyncResult(deposit_id).state
+    return json.dumps({
+        "deposit_id": deposit_id,
+        "state": "FAILURE" if task_state == "FAILURE" else "STAGED",
+        "database_ids": [],
+    })
+
 @api_blueprint.route("/api/db-checksum", methods=["GET"])
 def checksum():
     if dev_mode:
@@ -82,7 +290,11 @@ def download():
     database_files = glob.glob("database/depositions/**/{}.json".format(os.path.basename(database_id)))
 
     if len(database_files) == 0:
-        return "File not found", 404
+        # Falling back to the deposition journal
+        deposition = read_deposition(database_id)
+        if deposition is None:
+            return "File not found", 404
+        return Response(json.dumps(deposition), mimetype="application/json")
     
     if len(database_files) > 1:
         return "Multiple files found", 500
@@ -101,7 +313,11 @@ def download_mzml_raw():
     database_files = glob.glob(f"database/depositions/**/{os.path.basename(database_id)}.json")
 
     if len(database_files) == 0:
-        return "File not found", 404
+        # Falling back to the deposition journal
+        deposition = read_deposition(database_id)
+        if deposition is None:
+            return "File not found", 404
+        database_files = [deposition]
 
     if len(database_files) > 1:
         return "Multiple files found", 500
@@ -118,6 +334,37 @@ def download_mzml_raw():
         mimetype="application/octet-stream"
     )
 
+@api_blueprint.route("/api/spectrum/raw-view", methods=["GET"])
+def raw_view():
+    # Getting the raw replicates of a spectrum, downsampled for an m/z window
+    database_id = request.args.get("database_id")
+
+    if not database_id:
+        return "Database ID is required", 400
+
+    try:
+        mz_min = request.args.get("mz_min", type=float)
+        mz_max = request.args.get("mz_max", type=float)
+        width = int(request.args.get("width", RAW_VIEW_DEFAULT_WIDTH))
+    except ValueError:
+        return "Invalid mz_min, mz_max or width", 400
+
+    if width < 1 or width > RAW_VIEW_MAX_WIDTH:
+        return f"width must be between 1 and {RAW_VIEW_MAX_WIDTH}", 400
+    if mz_min is not None and mz_max is not None and mz_min > mz_max:
+        return "mz_min must not be greater than mz_max", 400
+
+    view = get_raw_view(database_id, mz_min, mz_max, width=width)
+    if view is None:
+        return "File not found", 404
+
+    response = {
+        "database_id": database_id,
+        "level": view["level"],
+        "replicates": [{"mz": replicate[:, 0].tolist(), "i": replicate[:, 1].tolist()} for replicate in view["replicates"]],
+    }
+    return Response(json.dumps(response), mimetype="application/json")
+
 @api_blueprint.route("/api/spectrum/mzml-filtered", methods=["GET"])
 def download_mzml_filtered():
     # Getting a single spectrum
@@ -184,10 +431,54 @@ def ml_db():    # http://localhost:5392/api/spectrum/ml_db
         # Return an error if the database_id is not "ALL"
         return "Only 'ALL' is supported for ml_db", 400
 
+@api_blueprint.route("/api/spectrum/metadata", methods=["GET"])
+def spectrum_metadata():
+    # Getting the summary record of a single spectrum
+    database_id = request.args.get("database_id")
+
+    if not database_id:
+        return "Database ID is required", 400
+
+    record = get_database_record(database_id)
+    if record is None:
+        return "Database ID not found", 404
+
+    # Missing values are NaN in the summary, which is not valid JSON
+    record = {key: (None if isinstance(value, float) and value != value else value) for key, value in record.items()}
+    return Response(json.dumps(record), mimetype="application/json")
+
+@api_blueprint.route("/api/export", methods=["GET"])
+def export_table():
+    # Downloading the spectra list, optionally filtered like the table
+    export_format = request.args.get("format", "csv")
+    filter_query = request.args.get("filter_query", "")
+
+    if export_format not in EXPORT_FORMATS:
+        return f"format must be one of {', '.join(EXPORT_FORMATS)}", 400
+
+    # Unfiltered exports are prebuilt in every release
+    if not filter_query.strip():
+        export_folder = release_path(EXPORT_FOLDER_NAME)
+        if os.path.exists(os.path.join(export_folder, export_filename(export_format))):
+            return send_from_directory(export_folder, export_filename(export_format), as_attachment=True)
+        if export_format not in STREAMED_FORMATS:
+            return "Export not built yet", 404
+
+    if export_format not in STREAMED_FORMATS:
+        return f"Filtered exports are available as {' or '.join(STREAMED_FORMATS)}", 400
+
+    # Filtered exports are streamed chunk by chunk from the summary
+    return Response(
+        stream_with_context(iter_filtered_export(filter_query, export_format)),
+        mimetype=EXPORT_FORMATS[export_format][1],
+        headers={"Content-Disposition": f"attachment; filename={export_filename(export_format)}"},
+    )
+
 @api_blueprint.route("/api/spectra", methods=["GET"])
+@cached_response(get_summary_version)
 def spectra_list():
     # Parse summary
-    summary_df = pd.read_csv("database/summary.tsv", sep="\t")
+    summary_df = read_summary_columns()
 
     # return json
     return summary_df.to_json(orient="records")
@@ -206,9 +497,10 @@ def nextflow_report():
             return "No Report Found", 404
         
 @api_blueprint.route("/analysis-utils/get_genus_options", methods=["GET"])
+@cached_response(get_summary_version)
 def analysis_utils_get_genus_options():
     # TODO: Make more general to handle other columns
-    summary_df = pd.read_csv("database/summary.tsv", sep="\t")
+    summary_df = read_summary_columns(["genus"])
     genus_options = summary_df.loc[summary_df.genus.notna(), 'genus'].unique().tolist()
 
     # Format as Key: Value JSON
@@ -216,20 +508,29 @@ def analysis_utils_get_genus_options():
     return json.dumps(genus_options)
 
 @api_blueprint.route("/analysis-utils/get_species_options", methods=["GET"])
+@cached_response(get_summary_version)
 def analysis_utils_get_species_options():
-    summary_df = pd.read_csv("database/summary.tsv", sep="\t")
+    summary_df = read_summary_columns(["species"])
     species_options = summary_df.loc[summary_df.species.notna(), 'species'].unique().tolist()
 
     # Format as Key: Value JSON
     species_options = [{"value-key": str(species), "display-key": str(species).capitalize()} for species in species_options]
     return json.dumps(species_options)
 
+INSTRUMENT_CONFIG_PATH = "workflows/idbac_summarize_database/bin/inst_peak_filtration.yml"
+
+def _get_instrument_config_version():
+    try:
+        return str(os.path.getmtime(INSTRUMENT_CONFIG_PATH))
+    except OSError:
+        return "missing"
+
 @api_blueprint.route("/analysis-utils/get_instrument_options", methods=["GET"])
+@cached_response(_get_instrument_config_version)
 def analysis_utils_get_instrument_options():
     # Load the workflow yaml file
-    with open("workflows/idbac_summarize_database/bin/inst_peak_filtration.yml", "r", encoding='utf-8') as f:
+    with open(INSTRUMENT_CONFIG_PATH, "r", encoding='utf-8') as f:
         config = yaml.safe_load(f)
-        print(config, flush=True)
 
         # Reformat keys as a json list with "value" and "display" keys
         keys = (config.keys())
@@ -286,4 +587,21 @@ def download_tree_nwk():
         if os.path.exists("/app/assets/tree.nwk"):
             return send_from_directory("/app/assets", "tree.nwk")
         else:
-            return "No Image Found", 404
\ No newline at end of file
+            return "No Image Found", 404
+def test_gunzip_limited():
+    body = b'{"spectrum": [[1000.0, 1.0]]}\n' * 100
+    assert _gunzip_limited(gzip.compress(body), len(body)) == body
+    # Concatenated members, as gzip.decompress reads them
+    assert _gunzip_limited(gzip.compress(body) + gzip.compress(body), 2 * len(body)) == body + body
+
+    try:
+        _gunzip_limited(gzip.compress(b"\0" * 1024 * 1024), 1024)
+        assert False
+    except _BodyTooLarge:
+        pass
+
+    try:
+        _gunzip_limited(gzip.compress(body)[:-10], len(body))
+        assert False
+    except zlib.error:
+        pass
@@ -0,0 +1,127 @@
+import glob
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from data_loader import NEXTFLOW_OUTPUT_FOLDER
+from processed_spectra_store import STORE_FOLDER_NAME, ProcessedSpectraStore, resolve_store_folder
+
+# Threads used to read processed spectra, file reads release the GIL
+SPECTRA_READ_WORKERS = 8
+
+_stores = {}    # bin_width -> (version, ProcessedSpectraStore)
+_stores_lock = threading.Lock()
+
+def get_processed_spectra_store(bin_width:int)->ProcessedSpectraStore:
+    """ Returns the packed processed spectra of a bin width, reopened when the
+    store is rebuilt.
+
+    Args:
+        bin_width (int): The size of bins used in the spectra (Da).
+
+    Returns:
+        ProcessedSpectraStore: The store, None if it has not been built.
+    """
+    bin_width = int(bin_width)
+    store_folder = os.path.join(NEXTFLOW_OUTPUT_FOLDER, f"{bin_width}_da_bin", STORE_FOLDER_NAME)
+
+    # The version folder the store link points to, each rebuild publishes a new one
+    version = resolve_store_folder(store_folder)
+    if version is None:
+        return None
+
+    with _stores_lock:
+        cached = _stores.get(bin_width)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+    try:
+        store = ProcessedSpectraStore(version)
+    except Exception as e:
+        logging.error(f"Error opening processed spectra store {store_folder}: {e}")
+        return None
+
+    with _stores_lock:
+        _stores[bin_width] = (version, store)
+    return store
+
+def processed_spectrum_path(database_id:str, bin_width:int)->str:
+    """ Returns the path of a processed spectrum written by merge_spectra.py, which
+    shards the files by the first 4 characters of the database id.
+
+    Args:
+        database_id (str): The database id.
+        bin_width (int): The size of bins used in the spectrum (Da).
+
+    Returns:
+        str: The path, None if the spectrum does not exist.
+    """
+    database_id = os.path.basename(str(database_id))
+    spectra_folder = os.path.join(NEXTFLOW_OUTPUT_FOLDER, f"{int(bin_width)}_da_bin", "output_spectra_json")
+
+    path = os.path.join(spectra_folder, database_id[0:4], f"{database_id}.json")
+    if os.path.exists(path):
+        return path
+
+    # Falling back to a search in case of a different layout
+    database_files = glob.glob(os.path.join(spectra_folder, "**", f"{database_id}.json"), recursive=True)
+    if len(database_files) != 1:
+        return None
+    return database_files[0]
+
+def load_processed_peaks(database_id:str, bin_width:int)->np.ndarray:
+    """ Loads a processed spectrum as an array.
+
+    Args:
+        database_id (str): The database id.
+        bin_width (int): The size of bins used in the spectrum (Da).
+
+    Returns:
+        np.ndarray: (n, 2) array of [mz, intensity], None if the spectrum does not exist.
+    """
+    store = get_processed_spectra_store(bin_width)
+    if store is not None and database_id in store:
+        return store.get_peaks(database_id)
+
+    path = processed_spectrum_path(database_id, bin_width)
+    if path is None:
+        return None
+
+    with open(path) as file_handle:
+        peaks = json.load(file_handle).get("peaks", [])
+
+    peak_array = np.empty((len(peaks), 2), dtype=np.float64)
+    peak_array[:, 0] = [peak["mz"] for peak in peaks]
+    peak_array[:, 1] = [peak["i"] for peak in peaks]
+    return peak_array
+
+def load_processed_peaks_batch(database_ids:list, bin_width:int)->dict:
+    """ Loads many processed spectra, from the packed store when it has been built,
+    otherwise concurrently from the individual files.
+
+    Args:
+        database_ids (list): The database ids.
+        bin_width (int): The size of bins used in the spectra (Da).
+
+    Returns:
+        dict: database id -> (n, 2) array of [mz, intensity]. Missing spectra are left out.
+    """
+    database_ids = list(dict.fromkeys(database_ids))
+
+    all_peaks = {}
+    store = get_processed_spectra_store(bin_width)
+    if store is not None:
+        all_peaks = {database_id: store.get_peaks(database_id) for database_id in database_ids if database_id in store}
+        database_ids = [database_id for database_id in database_ids if database_id not in all_peaks]
+        if len(database_ids) == 0:
+            return all_peaks
+
+    with ThreadPoolExecutor(max_workers=SPECTRA_READ_WORKERS) as executor:
+        for database_id, peaks in zip(database_ids, executor.map(lambda database_id: load_processed_peaks(database_id, bin_width), database_ids)):
+            if peaks is not None:
+                all_peaks[database_id] = peaks
+    return all_peaks
@@ -0,0 +1,66 @@
+import numpy as np
+
+# Buckets across the plotted m/z window, about one per horizontal pixel. Each bucket
+# keeps its lowest and highest point, so peaks survive the downsampling.
+DEFAULT_BUCKETS = 2000
+
+def minmax_decimate(peaks:np.ndarray, mz_range:tuple=None, n_buckets:int=DEFAULT_BUCKETS)->np.ndarray:
+    """ Downsamples a profile spectrum for plotting, keeping the minimum and maximum
+    intensity of each m/z bucket.
+
+    Args:
+        peaks (np.ndarray): (n, 2) array of [mz, intensity] sorted by mz.
+        mz_range (tuple, optional): (min, max) m/z window to keep, the whole spectrum if None.
+            The closest point outside the window on each side is kept, so lines reach the edges.
+        n_buckets (int, optional): The number of buckets across the window.
+
+    Returns:
+        np.ndarray: (m, 2) array of [mz, intensity] sorted by mz, with m <= 2 * n_buckets + 2.
+    """
+    if mz_range is not None:
+        start = max(np.searchsorted(peaks[:, 0], mz_range[0], side="left") - 1, 0)
+        end = min(np.searchsorted(peaks[:, 0], mz_range[1], side="right") + 1, len(peaks))
+        peaks = peaks[start:end]
+
+    if len(peaks) <= 2 * n_buckets + 2:
+        return peaks
+
+    mz = peaks[:, 0]
+    intensity = peaks[:, 1]
+    low, high = mz[0], mz[-1]
+    if high <= low:
+        return peaks[[0, -1]]
+
+    buckets = np.minimum(((mz - low) / (high - low) * n_buckets).astype(np.int64), n_buckets - 1)
+
+    # The spectrum is sorted, so every bucket is a contiguous run of points
+    bucket_starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    bucket_lengths = np.diff(np.r_[bucket_starts, len(peaks)])
+
+    keep = [np.array([0, len(peaks) - 1])]
+    for reduce in (np.minimum, np.maximum):
+        extreme = np.repeat(reduce.reduceat(intensity, bucket_starts), bucket_lengths)
+        candidates = np.flatnonzero(intensity == extreme)
+        # First point reaching the extreme in each bucket
+        candidate_buckets = buckets[candidates]
+        keep.append(candidates[np.r_[True, candidate_buckets[1:] != candidate_buckets[:-1]]])
+
+    return peaks[np.unique(np.concatenate(keep))]
+
+def test_minmax_decimate():
+    rng = np.random.default_rng(0)
+    mz = np.sort(rng.uniform(2000, 20000, 50000))
+    intensity = rng.uniform(0, 10, 50000)
+    intensity[12345] = 1000.0
+    peaks = np.column_stack((mz, intensity))
+
+    decimated = minmax_decimate(peaks, n_buckets=500)
+    assert len(decimated) <= 2 * 500 + 2
+    assert np.all(np.diff(decimated[:, 0]) >= 0)
+    assert decimated[:, 1].max() == 1000.0
+    assert decimated[0, 0] == mz[0] and decimated[-1, 0] == mz[-1]
+
+    # A zoomed window is resampled from the full resolution data
+    window = minmax_decimate(peaks, mz_range=(5000, 5100), n_buckets=500)
+    inside = (mz >= 5000) & (mz <= 5100)
+    assert np.all(np.isin(mz[inside], window[:, 0]))
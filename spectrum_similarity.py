@@ -0,0 +1,440 @@
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numba as nb
+import numpy as np
+from typing import Tuple
+
+# The kernels are compiled with cache=True, so compiled machine code is stored in
+# __pycache__ and reused by new processes (e.g. gunicorn workers after --max-requests).
+# They release the GIL, so independent scorings can run in threads.
+
+# Threads used to compute similarity matrices
+SIMILARITY_MATRIX_WORKERS = 4
+
+@nb.njit(cache=True, nogil=True)
+def _scan_matches(ref_spec_mz: np.ndarray, qry_spec_mz: np.ndarray, tolerance: float, shift: float,
+                  matches_idx1: np.ndarray, matches_idx2: np.ndarray, fill: bool) -> int:
+    """Two-pointer scan over two sorted spectra. Counts the matching peak pairs and,
+    if fill is True, writes them to matches_idx1/matches_idx2."""
+    match_count = 0
+    window_start = 0
+    num_qry_peaks = len(qry_spec_mz)
+
+    for peak1_idx in range(len(ref_spec_mz)):
+        mz = ref_spec_mz[peak1_idx]
+        low_bound = mz - tolerance
+        high_bound = mz + tolerance
+
+        # Both spectra are sorted, so the window start only moves forward
+        while window_start < num_qry_peaks and qry_spec_mz[window_start] - shift < low_bound:
+            window_start += 1
+
+        peak2_idx = window_start
+        while peak2_idx < num_qry_peaks and qry_spec_mz[peak2_idx] - shift <= high_bound:
+            if fill:
+                matches_idx1[match_count] = peak1_idx
+                matches_idx2[match_count] = peak2_idx
+            match_count += 1
+            peak2_idx += 1
+
+    return match_count
+
+@nb.njit(cache=True, nogil=True)
+def find_matches(ref_spec_mz: np.ndarray, qry_spec_mz: np.ndarray,
+                 tolerance: float, shift: float = 0.0) -> Tuple[np.ndarray, np.ndarray]:
+    """Find matching peaks between two spectra sorted by m/z. The output is sized to
+    the number of matches, which are counted in a first pass."""
+    no_matches = np.empty(0, dtype=np.int64)
+    match_count = _scan_matches(ref_spec_mz, qry_spec_mz, tolerance, shift, no_matches, no_matches, False)
+
+    matches_idx1 = np.empty(match_count, dtype=np.int64)
+    matches_idx2 = np.empty(match_count, dtype=np.int64)
+    _scan_matches(ref_spec_mz, qry_spec_mz, tolerance, shift, matches_idx1, matches_idx2, True)
+
+    return matches_idx1, matches_idx2
+
+@nb.njit(cache=True, nogil=True)
+def find_matches_batch(ref_spec_mz: np.ndarray, qry_spec_mz: np.ndarray, qry_offsets: np.ndarray,
+                       tolerance: float, shift: float = 0.0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Find matching peaks between one spectrum and many query spectra.
+
+    Query k spans qry_spec_mz[qry_offsets[k]:qry_offsets[k+1]]. Its matches span
+    match_offsets[k]:match_offsets[k+1] of the returned index arrays, with peak indices
+    relative to the query."""
+    num_queries = len(qry_offsets) - 1
+    match_offsets = np.zeros(num_queries + 1, dtype=np.int64)
+    no_matches = np.empty(0, dtype=np.int64)
+
+    for k in range(num_queries):
+        qry_mz = qry_spec_mz[qry_offsets[k]:qry_offsets[k + 1]]
+        match_offsets[k + 1] = match_offsets[k] + _scan_matches(ref_spec_mz, qry_mz, tolerance, shift, no_matches, no_matches, False)
+
+    matches_idx1 = np.empty(match_offsets[num_queries], dtype=np.int64)
+    matches_idx2 = np.empty(match_offsets[num_queries], dtype=np.int64)
+    for k in range(num_queries):
+        qry_mz = qry_spec_mz[qry_offsets[k]:qry_offsets[k + 1]]
+        _scan_matches(ref_spec_mz, qry_mz, tolerance, shift,
+                      matches_idx1[match_offsets[k]:match_offsets[k + 1]],
+                      matches_idx2[match_offsets[k]:match_offsets[k + 1]], True)
+
+    return matches_idx1, matches_idx2, match_offsets
+
+@nb.njit(cache=True, nogil=True)
+def rank_peak_pairs(ref_spec: np.ndarray, qry_spec: np.ndarray, matches_idx1: np.ndarray, matches_idx2: np.ndarray,
+                    min_matched_peak: int, sqrt_transform: bool) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Score matching peak pairs and sort them by score."""
+    if len(matches_idx1) < min_matched_peak:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+    # Calculate scores for matches
+    if sqrt_transform:
+        scores = np.sqrt(ref_spec[matches_idx1, 1] * qry_spec[matches_idx2, 1]).astype(np.float32)
+    else:
+        scores = (ref_spec[matches_idx1, 1] * qry_spec[matches_idx2, 1]).astype(np.float32)
+
+    # Sort by score descending
+    sort_idx = np.argsort(-scores)
+    return matches_idx1[sort_idx], matches_idx2[sort_idx], scores[sort_idx]
+
+@nb.njit(cache=True, nogil=True)
+def collect_peak_pairs(ref_spec: np.ndarray, qry_spec: np.ndarray, min_matched_peak: int, sqrt_transform: bool,
+                       tolerance: float, shift: float = 0.0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Find and score matching peak pairs between spectra."""
+
+    if len(ref_spec) == 0 or len(qry_spec) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+    # Exact matching
+    matches_idx1, matches_idx2 = find_matches(ref_spec[:, 0], qry_spec[:, 0], tolerance, 0.0)
+
+    # If shift is not 0, perform hybrid search
+    if abs(shift) > 1e-6:
+        matches_idx1_shift, matches_idx2_shift = find_matches(ref_spec[:, 0], qry_spec[:, 0], tolerance, shift)
+        matches_idx1 = np.concatenate((matches_idx1, matches_idx1_shift))
+        matches_idx2 = np.concatenate((matches_idx2, matches_idx2_shift))
+
+    return rank_peak_pairs(ref_spec, qry_spec, matches_idx1, matches_idx2, min_matched_peak, sqrt_transform)
+
+
+@nb.njit(cache=True, nogil=True)
+def score_matches(matches_idx1: np.ndarray, matches_idx2: np.ndarray,
+                  scores: np.ndarray, ref_spec: np.ndarray, qry_spec: np.ndarray,
+                  sqrt_transform: bool, penalty: float):
+    """Calculate final similarity score from matching peaks."""
+
+    # Use boolean arrays for tracking used peaks - initialized to False
+    used1 = np.zeros(len(ref_spec), dtype=nb.boolean)
+    used2 = np.zeros(len(qry_spec), dtype=nb.boolean)
+
+    total_score = 0.0
+    used_matches = 0
+
+    # Find best non-overlapping matches
+    for i in range(len(matches_idx1)):
+        idx1 = matches_idx1[i]
+        idx2 = matches_idx2[i]
+        if not used1[idx1] and not used2[idx2]:
+            total_score += scores[i]
+            used1[idx1] = True
+            used2[idx2] = True
+            used_matches += 1
+
+    if used_matches == 0:
+        return 0.0, 0
+
+    # # Sum intensities of matched peaks
+    # matched_intensities = np.zeros(used_matches, dtype=np.float32)
+
+    # new intensities of qry peaks, matched peaks are the same, others are penalized
+    new_qry_intensities = np.zeros(len(qry_spec), dtype=np.float32)
+
+    match_idx = 0
+    for i in range(len(qry_spec)):
+        if used2[i]:
+            # matched_intensities[match_idx] = qry_spec[i, 1]
+            new_qry_intensities[i] = qry_spec[i, 1]
+            match_idx += 1
+        else:
+            new_qry_intensities[i] = qry_spec[i, 1] * (1 - penalty)
+
+    if sqrt_transform:
+        norm1 = np.sqrt(np.sum(np.sqrt(ref_spec[:, 1] * ref_spec[:, 1])))
+        norm2 = np.sqrt(np.sum(np.sqrt(new_qry_intensities * new_qry_intensities)))
+    else:
+        norm1 = np.sqrt(np.sum(ref_spec[:, 1] * ref_spec[:, 1]))
+        norm2 = np.sqrt(np.sum(new_qry_intensities * new_qry_intensities))
+
+    if norm1 == 0.0 or norm2 == 0.0:
+        return 0.0, used_matches
+
+    score = total_score / (norm1 * norm2)
+
+    return min(float(score), 1.0), used_matches
+
+
+def cosine_similarity(qry_spec: np.ndarray, ref_spec: np.ndarray,
+                      tolerance: float = 0.1,
+                      min_matched_peak: int = 1,
+                      sqrt_transform: bool = True,
+                      penalty: float = 0.,
+                      shift: float = 0.0):
+    """
+    Calculate similarity between two spectra.
+
+    Parameters
+    ----------
+    qry_spec: np.ndarray
+        Query spectrum.
+    ref_spec: np.ndarray
+        Reference spectrum.
+    tolerance: float
+        Tolerance for m/z matching.
+    min_matched_peak: int
+        Minimum number of matched peaks.
+    sqrt_transform: bool
+        If True, use square root transformation.
+    penalty: float
+        Penalty for unmatched peaks. If set to 0, traditional cosine score; if set to 1, traditional reverse cosine score.
+    shift: float
+        Shift for m/z values. If not 0, hybrid search is performed. shift = prec_mz(qry) - prec_mz(ref)
+    """
+    tolerance = np.float32(tolerance)
+    penalty = np.float32(penalty)
+    shift = np.float32(shift)
+
+    if qry_spec.size == 0 or ref_spec.size == 0:
+        return (0.0, 0), np.array([]), np.array([])
+
+    # A spectrum without intensity matches nothing
+    if np.max(ref_spec[:, 1]) <= 0 or np.max(qry_spec[:, 1]) <= 0:
+        return (0.0, 0), np.array([]), np.array([])
+
+    # normalize the intensity
+    ref_spec[:, 1] /= np.max(ref_spec[:, 1])
+    qry_spec[:, 1] /= np.max(qry_spec[:, 1])
+
+    matches_idx1, matches_idx2, scores = collect_peak_pairs(
+        ref_spec, qry_spec, min_matched_peak, sqrt_transform,
+        tolerance, shift
+    )
+
+    if len(matches_idx1) == 0:
+        return (0.0, 0), np.array([]), np.array([])
+
+    return score_matches(
+        matches_idx1, matches_idx2, scores,
+        ref_spec, qry_spec, sqrt_transform, penalty
+    ), matches_idx2, matches_idx1   # Note this is reversed, this is correct based on return from collect_peak_pairs
+
+
+@nb.njit(cache=True, nogil=True)
+def _score_batch(ref_spec: np.ndarray, qry_peaks: np.ndarray, qry_offsets: np.ndarray, tolerance: float,
+                 min_matched_peak: int, sqrt_transform: bool, penalty: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Score one normalized spectrum against many normalized, concatenated query spectra."""
+    matches_idx1, matches_idx2, match_offsets = find_matches_batch(ref_spec[:, 0], qry_peaks[:, 0], qry_offsets, tolerance, 0.0)
+
+    num_queries = len(qry_offsets) - 1
+    scores = np.zeros(num_queries, dtype=np.float64)
+    num_matched_peaks = np.zeros(num_queries, dtype=np.int64)
+
+    for k in range(num_queries):
+        start = match_offsets[k]
+        end = match_offsets[k + 1]
+        if start == end:
+            continue
+
+        qry_spec = qry_peaks[qry_offsets[k]:qry_offsets[k + 1]]
+        ranked_idx1, ranked_idx2, pair_scores = rank_peak_pairs(
+            ref_spec, qry_spec, matches_idx1[start:end], matches_idx2[start:end],
+            min_matched_peak, sqrt_transform
+        )
+        if len(ranked_idx1) == 0:
+            continue
+
+        score, used_matches = score_matches(ranked_idx1, ranked_idx2, pair_scores,
+                                            ref_spec, qry_spec, sqrt_transform, penalty)
+        scores[k] = score
+        num_matched_peaks[k] = used_matches
+
+    return scores, num_matched_peaks
+
+def _pack_normalized(spectra: list) -> Tuple[np.ndarray, np.ndarray]:
+    """Concatenates spectra into one (n, 2) array, each normalized to a maximum intensity of 1.
+    Spectra without intensity are left at 0, score_matches scores them 0."""
+    spectra = [np.array(spectrum, dtype=np.float64).reshape(-1, 2) for spectrum in spectra]
+    for spectrum in spectra:
+        if len(spectrum) > 0 and np.max(spectrum[:, 1]) > 0:
+            spectrum[:, 1] /= np.max(spectrum[:, 1])
+
+    offsets = np.zeros(len(spectra) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(spectrum) for spectrum in spectra])
+    if offsets[-1] == 0:
+        return np.zeros((0, 2), dtype=np.float64), offsets
+    return np.concatenate(spectra), offsets
+
+def cosine_similarity_batch(ref_spec: np.ndarray, qry_specs: list,
+                            tolerance: float = 0.1,
+                            min_matched_peak: int = 1,
+                            sqrt_transform: bool = True,
+                            penalty: float = 0.) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Calculate the similarity between one spectrum and many query spectra in a single
+    kernel call. Only exact matching (no shift) is supported. The input spectra are
+    not modified.
+
+    Parameters
+    ----------
+    ref_spec: np.ndarray
+        Reference spectrum, sorted by m/z.
+    qry_specs: list
+        Query spectra as (n, 2) arrays, sorted by m/z.
+    tolerance, min_matched_peak, sqrt_transform, penalty:
+        See cosine_similarity.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        The score and the number of matched peaks for each query.
+    """
+    if ref_spec.size == 0 or len(qry_specs) == 0:
+        return np.zeros(len(qry_specs), dtype=np.float64), np.zeros(len(qry_specs), dtype=np.int64)
+
+    ref_peaks, _ = _pack_normalized([ref_spec])
+    qry_peaks, qry_offsets = _pack_normalized(qry_specs)
+
+    return _score_batch(ref_peaks, qry_peaks, qry_offsets, np.float32(tolerance),
+                        min_matched_peak, sqrt_transform, np.float32(penalty))
+
+def similarity_matrix(spectra: list,
+                      tolerance: float = 0.1,
+                      sqrt_transform: bool = False,
+                      max_workers: int = SIMILARITY_MATRIX_WORKERS) -> np.ndarray:
+    """
+    Calculate the pairwise cosine similarity of spectra. Each row is scored against
+    the following spectra in one kernel call, rows run in parallel threads.
+
+    Parameters
+    ----------
+    spectra: list
+        Spectra as (n, 2) arrays, sorted by m/z.
+    tolerance: float
+        Tolerance for m/z matching.
+    sqrt_transform: bool
+        If True, use square root transformation.
+    max_workers: int
+        Number of threads.
+
+    Returns
+    -------
+    np.ndarray
+        Symmetric (N, N) matrix of similarities, with 1 on the diagonal.
+    """
+    num_spectra = len(spectra)
+    matrix = np.eye(num_spectra, dtype=np.float64)
+
+    # Normalized once, rows use views of the packed peaks
+    peaks, offsets = _pack_normalized(spectra)
+    tolerance = np.float32(tolerance)
+    penalty = np.float32(0.0)
+
+    def _score_row(row):
+        ref_spec = peaks[offsets[row]:offsets[row + 1]]
+        if len(ref_spec) == 0:
+            return
+        qry_peaks = peaks[offsets[row + 1]:]
+        qry_offsets = offsets[row + 1:] - offsets[row + 1]
+        scores, _ = _score_batch(ref_spec, qry_peaks, qry_offsets, tolerance, 1, sqrt_transform, penalty)
+        matrix[row, row + 1:] = scores
+        matrix[row + 1:, row] = scores
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(_score_row, range(num_spectra - 1)))
+
+    return matrix
+
+def peaks_to_array(spectrum)->np.ndarray:
+    """ Packs a spectrum into an (n, 2) array of [mz, intensity].
+
+    Args:
+        spectrum (dict or np.ndarray): A spectrum with 'peaks' as a list of {'mz', 'i'} dicts,
+            or an (n, 2) array.
+
+    Returns:
+        np.ndarray: A new (n, 2) float64 array.
+    """
+    if isinstance(spectrum, np.ndarray):
+        return np.array(spectrum, dtype=np.float64).reshape(-1, 2)
+
+    peaks = spectrum.get('peaks', [])
+    peak_array = np.empty((len(peaks), 2), dtype=np.float64)
+    peak_array[:, 0] = [peak['mz'] for peak in peaks]
+    peak_array[:, 1] = [peak['i'] for peak in peaks]
+    return peak_array
+
+def prepare_spectrum(peaks:np.ndarray, mass_range=None, presence:bool=False)->np.ndarray:
+    """ Filters, sorts and normalizes a spectrum for plotting and scoring.
+
+    Args:
+        peaks (np.ndarray): (n, 2) array of [mz, intensity].
+        mass_range (tuple, optional): The mass range to keep (min, max).
+        presence (bool, optional): If True, nonzero intensities are set to 1 (presence/absence).
+
+    Returns:
+        np.ndarray: A new (n, 2) array sorted by mz, with intensities scaled to a maximum of 100.
+    """
+    if presence:
+        peaks = np.column_stack((peaks[:, 0], np.where(peaks[:, 1] > 0, 1.0, peaks[:, 1])))
+
+    if mass_range is not None:
+        peaks = peaks[(peaks[:, 0] >= mass_range[0]) & (peaks[:, 0] <= mass_range[1])]
+
+    peaks = peaks[np.argsort(peaks[:, 0], kind="stable")]
+
+    # Normalize intensities, a spectrum without intensity stays at 0
+    if len(peaks) > 0 and np.max(peaks[:, 1]) > 0:
+        peaks[:, 1] = peaks[:, 1] / np.max(peaks[:, 1]) * 100.0
+    return peaks
+
+def index_mask(length:int, indices:np.ndarray)->np.ndarray:
+    """ Returns a boolean mask that is True at the given indices. """
+    mask = np.zeros(length, dtype=bool)
+    if len(indices) > 0:
+        mask[np.asarray(indices, dtype=np.int64)] = True
+    return mask
+
+def warm_up_kernels()->float:
+    """ Compiles (or loads from the on-disk cache) the scoring kernels, so the first
+    mirror plot of a worker does not pay for JIT compilation.
+
+    Returns:
+        float: The time spent, in seconds.
+    """
+    start_time = time.perf_counter()
+
+    spectrum = np.array([[2000.0, 1.0], [2010.0, 0.5], [2020.0, 0.25]], dtype=np.float64)
+    for sqrt_transform in (False, True):
+        cosine_similarity(spectrum.copy(), spectrum.copy(), tolerance=0.1, sqrt_transform=sqrt_transform)
+        cosine_similarity_batch(spectrum, [spectrum], tolerance=0.1, sqrt_transform=sqrt_transform)
+    similarity_matrix([spectrum, spectrum], max_workers=1)
+
+    elapsed_time = time.perf_counter() - start_time
+    print(f"Spectrum similarity kernels ready in {elapsed_time:.2f}s", file=sys.stderr, flush=True)
+    return elapsed_time
+
+def test_zero_intensity_spectrum():
+    spectrum = np.array([[1000.0, 10.0], [2000.0, 5.0], [3000.0, 1.0]])
+    zero_spectrum = np.array([[1000.0, 0.0], [2000.0, 0.0], [3000.0, 0.0]])
+
+    prepared = prepare_spectrum(zero_spectrum.copy())
+    assert not np.isnan(prepared).any()
+
+    matrix = similarity_matrix([spectrum, prepared, spectrum], max_workers=1)
+    assert not np.isnan(matrix).any()
+    assert matrix[0, 1] == 0.0 and matrix[1, 2] == 0.0
+    assert np.isclose(matrix[0, 2], 1.0)
+
+    scores, _ = cosine_similarity_batch(spectrum, [zero_spectrum, spectrum])
+    assert scores[0] == 0.0 and np.isclose(scores[1], 1.0)
+    assert cosine_similarity(zero_spectrum.copy(), spectrum.copy())[0][0] == 0.0
@@ -0,0 +1,165 @@
+import logging
+import os
+import threading
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from release_store import release_path
+
+# Typed, columnar copy of the summary (Arrow IPC file, uncompressed so it can be
+# memory-mapped). Column-only readers load just the columns they need.
+SUMMARY_ARROW_FILENAME = "summary.arrow"
+SUMMARY_TSV_FILENAME = "summary.tsv"
+
+INTEGER_COLUMNS = ["NCBI taxid"]
+
+# Few distinct values, stored once per column
+DICTIONARY_COLUMNS = [
+    "superkingdom", "kingdom", "phylum", "class", "order", "family", "genus",
+    "species group", "species subgroup", "species", "License", "Data Source",
+]
+
+_table_cache = {"key": None, "table": None}
+_table_lock = threading.Lock()
+
+def _to_arrow_column(series:pd.Series, column:str)->pa.Array:
+    if column in INTEGER_COLUMNS:
+        return pa.array(pd.to_numeric(series, errors="coerce").astype("Int64"), type=pa.int64())
+
+    if series.dtype == object:
+        # Mixed values (e.g. numbers and text) are stored as text, missing and empty values are null
+        values = [None if value is None or value != value or value == "" else str(value) for value in series]
+        array = pa.array(values, type=pa.string())
+        if column in DICTIONARY_COLUMNS:
+            array = array.dictionary_encode()
+        return array
+
+    return pa.array(series)
+
+def read_summary_tsv(path:str, usecols=None)->pd.DataFrame:
+    """ Reads the TSV summary. Every reader of the summary (data_loader, the Arrow
+    summary and its fallback) starts from these types, so they all agree: empty values
+    are missing, and columns whose values are all numbers are numeric.
+
+    Args:
+        path (str): The TSV summary.
+        usecols (optional): The columns to read, as for pd.read_csv.
+
+    Returns:
+        pd.DataFrame: The summary.
+    """
+    return pd.read_csv(path, sep="\t", usecols=usecols)
+
+def write_summary_table(df:pd.DataFrame, path:str):
+    """ Writes the summary as a typed Arrow IPC file, atomically.
+
+    Args:
+        df (pd.DataFrame): The summary, as read by read_summary_tsv.
+        path (str): The output file, usually SUMMARY_ARROW_FILENAME in a new release.
+    """
+    table = pa.table({str(column): _to_arrow_column(df[column], str(column)) for column in df.columns})
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    feather.write_feather(table, temp_path, compression="uncompressed")
+    os.replace(temp_path, path)
+
+def _load_summary_table(path:str)->pa.Table:
+    """ Returns the memory-mapped summary table, reopened when the file is replaced. """
+    try:
+        file_mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+
+    with _table_lock:
+        if _table_cache["key"] == (path, file_mtime):
+            return _table_cache["table"]
+
+    try:
+        with pa.memory_map(path, "r") as source:
+            table = pa.ipc.open_file(source).read_all()
+    except Exception as e:
+        logging.error(f"Error Loading Summary Table: {e}")
+        return None
+
+    with _table_lock:
+        _table_cache["key"] = (path, file_mtime)
+        _table_cache["table"] = table
+    return table
+
+def get_summary_version()->str:
+    """ Returns a version string of the published summary, which changes whenever a new
+    release (or, before the first release, a rewritten summary) is published.
+
+    Returns:
+        str: The version, built from the paths and modification times of both files.
+    """
+    mtimes = []
+    for version_file in [release_path(SUMMARY_ARROW_FILENAME), release_path(SUMMARY_TSV_FILENAME)]:
+        try:
+            mtimes.append(f"{version_file}:{os.path.getmtime(version_file)}")
+        except OSError:
+            mtimes.append("missing")
+    return "-".join(mtimes)
+
+def read_summary_columns(columns:list=None, path:str=None)->pd.DataFrame:
+    """ Reads columns of the summary. The Arrow file is mapped once per version, and only
+    the requested columns are converted. Falls back to the TSV summary if there is no
+    Arrow file yet.
+
+    Args:
+        columns (list, optional): The columns to read, all of them if None. Missing columns are skipped.
+        path (str, optional): The Arrow summary, the one of the published release if None.
+
+    Returns:
+        pd.DataFrame: The columns, None if there is no summary.
+    """
+    if path is None:
+        path = release_path(SUMMARY_ARROW_FILENAME)
+    table = _load_summary_table(path)
+    if table is None:
+        tsv_path = os.path.join(os.path.dirname(path), SUMMARY_TSV_FILENAME)
+        if not os.path.exists(tsv_path):
+            return None
+        return read_summary_tsv(tsv_path, usecols=lambda column: columns is None or column in columns)
+
+    if columns is not None:
+        table = table.select([column for column in columns if column in table.column_names])
+    # Integer columns with missing values stay integers
+    return table.to_pandas(types_mapper={pa.int64(): pd.Int64Dtype()}.get)
+
+def test_summary_table(tmp_path):
+    path = os.path.join(tmp_path, "summary.arrow")
+    df = pd.DataFrame({
+        "database_id": ["01A", "01B", "01C"],
+        "NCBI taxid": [562, "1423", None],
+        "genus": ["Escherichia", "Bacillus", None],
+        "Strain name": ["K-12", 168, "X"],
+        "QC peak count": [10, 20, 30],
+    })
+    write_summary_table(df, path)
+
+    schema = pa.ipc.open_file(path).schema
+    assert schema.field("NCBI taxid").type == pa.int64()
+    assert pa.types.is_dictionary(schema.field("genus").type)
+
+    columns_df = read_summary_columns(["genus", "NCBI taxid", "unknown"], path)
+    assert list(columns_df.columns) == ["genus", "NCBI taxid"]
+    assert columns_df["NCBI taxid"].tolist()[:2] == [562, 1423]
+    assert columns_df["genus"].isna().tolist() == [False, False, True]
+    assert read_summary_columns(None, path)["Strain name"].tolist() == ["K-12", "168", "X"]
+
+def test_summary_table_matches_tsv(tmp_path):
+    # The API returned the TSV as read by pandas, the Arrow summary must give the same values
+    tsv_path = os.path.join(tmp_path, "summary.tsv")
+    arrow_path = os.path.join(tmp_path, "summary.arrow")
+    pd.DataFrame({
+        "database_id": ["01A", "01B"],
+        "Strain name": [168, 42],
+        "genus": ["Bacillus", ""],
+        "Comment": ["", "ok"],
+    }).to_csv(tsv_path, sep="\t", index=False)
+
+    write_summary_table(read_summary_tsv(tsv_path), arrow_path)
+    assert read_summary_columns(None, arrow_path).to_json(orient="records") == pd.read_csv(tsv_path, sep="\t").to_json(orient="records")
@@ -0,0 +1,183 @@
+import logging
+import os
+
+import pandas as pd
+
+from release_store import release_path
+
+# Exports of the spectra list, rebuilt in every release and served as static files
+EXPORT_FOLDER_NAME = "exports"
+EXPORT_BASENAME = "IDBac_KB_Spectra_List"
+SUMMARY_FILENAME = "summary.tsv"
+
+# format -> (filename suffix, mimetype)
+EXPORT_FORMATS = {
+    "csv": (".csv", "text/csv"),
+    "tsv": (".tsv", "text/tab-separated-values"),
+    "csv.gz": (".csv.gz", "application/gzip"),
+    "tsv.gz": (".tsv.gz", "application/gzip"),
+    "parquet": (".parquet", "application/octet-stream"),
+}
+
+# Formats that can be streamed in chunks when the export is filtered
+STREAMED_FORMATS = ["csv", "tsv"]
+
+# Rows per chunk of a filtered export
+EXPORT_CHUNK_SIZE = 5000
+
+# Comparison operators of the table filter, longest first so '>=' is not read as '>'
+_COMPARISON_OPERATORS = [' >= ', ' <= ', ' != ', ' > ', ' < ', ' = ']
+
+def export_filename(export_format:str)->str:
+    return EXPORT_BASENAME + EXPORT_FORMATS[export_format][0]
+
+def build_exports(df:pd.DataFrame, export_folder:str):
+    """ Writes the spectra list in every export format. Each file is written to a temporary
+    file first, so a download never sees a partial export.
+
+    Args:
+        df (pd.DataFrame): The summary.
+        export_folder (str): Where the exports are written, usually EXPORT_FOLDER_NAME in a new release.
+    """
+    os.makedirs(export_folder, exist_ok=True)
+
+    for export_format in EXPORT_FORMATS:
+        path = os.path.join(export_folder, export_filename(export_format))
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            if export_format == "parquet":
+                # Mixed type columns (e.g. taxids with text) are written as text, missing values stay null
+                parquet_df = df.copy()
+                for column in parquet_df.columns:
+                    if parquet_df[column].dtype == object:
+                        parquet_df[column] = parquet_df[column].map(lambda value: value if value is None or value != value else str(value))
+                parquet_df.to_parquet(temp_path, index=False)
+            else:
+                df.to_csv(
+                    temp_path,
+                    index=False,
+                    sep="\t" if export_format.startswith("tsv") else ",",
+                    compression="gzip" if export_format.endswith(".gz") else None,
+                )
+            os.replace(temp_path, path)
+        except Exception as e:
+            # e.g. no parquet engine installed, the other formats are still written
+            logging.error(f"Failed to write {export_format} export: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+def parse_filter_query(filter_query:str)->list:
+    """ Parses the filter query of the spectra table.
+
+    Args:
+        filter_query (str): The filter_query of the DataTable, e.g.
+            '{genus} icontains "Bacillus" && {QC peak count} > 50'.
+
+    Returns:
+        list: (column, operator, value) tuples. The operator is 'icontains', 'scontains' or a
+              comparison ('>=', '<=', '!=', '>', '<', '='), whose value is a float.
+              Expressions that cannot be parsed are left out.
+    """
+    filters = []
+    if not filter_query or not filter_query.strip():
+        return filters
+
+    for expression in filter_query.split(' && '):
+        if ' icontains ' in expression:
+            col, val = expression.split(' icontains ', 1)
+            filters.append((col.strip('{ }'), 'icontains', val.strip(' "')))
+        elif ' scontains ' in expression:
+            col, val = expression.split(' scontains ', 1)
+            filters.append((col.strip('{ }'), 'scontains', val.strip(' "')))
+        else:
+            # Comparisons on the numeric (QC) columns, e.g. {QC peak count} > 50
+            for operator in _COMPARISON_OPERATORS:
+                if operator in expression:
+                    col, val = expression.split(operator, 1)
+                    try:
+                        filters.append((col.strip('{ }'), operator.strip(), float(val.strip(' "'))))
+                    except ValueError:
+                        pass
+                    break
+    return filters
+
+def filter_table(df:pd.DataFrame, filters:list)->pd.DataFrame:
+    """ Applies parsed table filters. Filters on columns that are not in the table are ignored.
+
+    Args:
+        df (pd.DataFrame): The table, or a chunk of it.
+        filters (list): The filters, as returned by parse_filter_query.
+
+    Returns:
+        pd.DataFrame: The matching rows.
+    """
+    for col, operator, val in filters:
+        if col not in df.columns:
+            continue
+        if operator == 'icontains':
+            # contains (case-insensitive), instead of exact match
+            df = df[df[col].astype(str).str.contains(val, case=False, na=False)]
+        elif operator == 'scontains':
+            # contains (case-sensitive), instead of exact match
+            df = df[df[col].astype(str).str.contains(val, case=True, na=False)]
+        else:
+            values = pd.to_numeric(df[col], errors='coerce')
+            if operator == '>=':
+                df = df[values >= val]
+            elif operator == '<=':
+                df = df[values <= val]
+            elif operator == '!=':
+                df = df[values != val]
+            elif operator == '>':
+                df = df[values > val]
+            elif operator == '<':
+                df = df[values < val]
+            else:
+                df = df[values == val]
+    return df
+
+def iter_filtered_export(filter_query:str, export_format:str="csv", summary_path:str=None):
+    """ Streams the rows of the summary matching the table filter, chunk by chunk, so the
+    whole table is never held in memory.
+
+    Args:
+        filter_query (str): The filter_query of the DataTable.
+        export_format (str, optional): One of STREAMED_FORMATS.
+        summary_path (str, optional): The summary TSV, the one of the published release if None.
+
+    Yields:
+        str: The exported text, the header first.
+    """
+    if summary_path is None:
+        summary_path = release_path(SUMMARY_FILENAME)
+    filters = parse_filter_query(filter_query)
+    sep = "\t" if export_format == "tsv" else ","
+
+    # Read as text, so the values are exported as they are in the summary
+    header_written = False
+    for chunk in pd.read_csv(summary_path, sep="\t", chunksize=EXPORT_CHUNK_SIZE, dtype=str, keep_default_na=False):
+        chunk = filter_table(chunk, filters)
+        if len(chunk) == 0 and header_written:
+            continue
+        yield chunk.to_csv(index=False, sep=sep, header=not header_written)
+        header_written = True
+
+def test_filtered_export(tmp_path):
+    summary_path = os.path.join(tmp_path, "summary.tsv")
+    summary_df = pd.DataFrame({
+        "database_id": [f"ID{i}" for i in range(12001)],
+        "genus": ["Bacillus" if i % 3 == 0 else "Escherichia" for i in range(12001)],
+        "QC peak count": list(range(12001)),
+    })
+    summary_df.to_csv(summary_path, sep="\t", index=False)
+
+    exported = "".join(iter_filtered_export('{genus} icontains "bacil" && {QC peak count} >= 6000', "csv", summary_path))
+    lines = exported.strip().split("\n")
+    assert lines[0] == "database_id,genus,QC peak count"
+    expected = [i for i in range(6000, 12001) if i % 3 == 0]
+    assert len(lines) - 1 == len(expected)
+    assert lines[1] == f"ID{expected[0]},Bacillus,{expected[0]}"
+
+    # The header is written even if nothing matches
+    exported = "".join(iter_filtered_export('{genus} icontains "none"', "tsv", summary_path))
+    assert exported.strip() == "database_id\tgenus\tQC peak count"
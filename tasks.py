@@ -12,13 +12,38 @@ import requests_cache
 import xmltodict
 import math
 from utils import populate_taxonomies, generate_tree
-from utils import calculate_checksum
+from utils import calculate_checksum, load_json_metadata, compute_taxonomy_distribution
+from deposition_store import DEPOSITIONS_FOLDER, write_sidecars, write_metadata_sidecar, load_metadata_sidecar, append_deposition_log
+from deposition_store import pyramid_sidecar_path, write_pyramid_sidecar, load_pyramid_lengths
+from deposition_spool import load_depositions, complete_depositions, load_receipt, staged_database_ids, sweep_receipts
+from deposition_journal import JOURNAL_FOLDER, DepositionJournal, compact_journal, iter_metadata, read_deposition
+from processed_spectra_store import STORE_FOLDER_NAME, build_processed_spectra_store
+from qc_metrics import QC_METRICS_PATH, compute_qc_metrics, merge_qc_metrics
+from table_export import EXPORT_FOLDER_NAME, build_exports
+from summary_store import SUMMARY_ARROW_FILENAME, SUMMARY_TSV_FILENAME, write_summary_table, read_summary_tsv
+from release_store import create_release, discard_release, publish_release, release_path
+from celery.signals import worker_process_shutdown
+from dotenv import dotenv_values
 from time import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 dev_mode = False
 if not os.path.isdir('/app'):
     dev_mode =  True
 
+_env = dotenv_values()
+
+# "files" writes one JSON file per deposit, "journal" appends to the deposition journal
+DEPOSITION_STORAGE = _env.get("DEPOSITION_STORAGE", "files")
+
+# Parallel ingest of deposition metadata in task_summarize_depositions
+INGEST_WORKERS = int(os.environ.get("IDBAC_INGEST_WORKERS", min(8, os.cpu_count() or 1)))
+INGEST_CHUNK_SIZE = 500
+
+# Ranks offered in the taxonomy pie chart dropdown of pages/database.py
+TAXONOMY_DISTRIBUTION_RANKS = ["phylum", "class", "order", "family", "genus", "species"]
+
 celery_instance = Celery('tasks', backend='redis://idbac-kb-redis', broker='pyamqp://guest@idbac-kb-rabbitmq//', )
 
 @celery_instance.task(time_limit=60)
@@ -26,80 +51,292 @@ def task_computeheartbeat():
     print("UP", file=sys.stderr, flush=True)
     return "Up"
 
-@celery_instance.task(time_limit=60)
-def task_deposit_data(deposit_dict, collection_name):
-    print("Deposition", file=sys.stderr, flush=True)
+_deposition_journal = None
+
+def _get_deposition_journal()->DepositionJournal:
+    # One journal writer per worker process, so fsyncs can be batched across tasks
+    global _deposition_journal
+    if _deposition_journal is None:
+        _deposition_journal = DepositionJournal(JOURNAL_FOLDER)
+    return _deposition_journal
 
+def _sync_deposition_journal():
+    # Records are fsync'ed in batches while a task appends, and always before it returns
+    if _deposition_journal is not None:
+        _deposition_journal.sync()
+
+@worker_process_shutdown.connect
+def _close_deposition_journal(**kwargs):
+    if _deposition_journal is not None:
+        _deposition_journal.close()
+
+def _deposit(deposit_dict:dict, database_id:str=None)->str:
+    """ Stores a single deposition, either as a JSON file or in the deposition journal.
+
+    Args:
+        deposit_dict (dict): The full deposition, including 'task', 'user' and 'spectrum'.
+        database_id (str, optional): The database id to store it under, a new one if None.
+
+    Returns:
+        str: The database id (ULID) of the deposition.
+    """
     task = deposit_dict["task"]
+    if database_id is None:
+        database_id = str(ULID())
 
-    deposition_folder = os.path.join("database/depositions", "TASK-" + task)
+    if DEPOSITION_STORAGE == "journal":
+        journal = _get_deposition_journal()
+        journal.append(database_id, deposit_dict)
+        write_pyramid_sidecar(database_id, deposit_dict.get("spectrum", []))
+        append_deposition_log(database_id, deposit_dict, journal.segment_path)
+        return database_id
+
+    deposition_folder = os.path.join(DEPOSITIONS_FOLDER, "TASK-" + task)
     os.makedirs(deposition_folder, exist_ok=True)
 
-    output_filename = os.path.join(deposition_folder, str(ULID()) + ".json")
+    output_filename = os.path.join(deposition_folder, database_id + ".json")
 
     with open(output_filename, "w") as f:
         f.write(json.dumps(deposit_dict))
 
+    # Compact copies for metadata-only readers, written after the full deposition
+    write_sidecars(database_id, deposit_dict)
+    write_pyramid_sidecar(database_id, deposit_dict.get("spectrum", []))
+    append_deposition_log(database_id, deposit_dict, output_filename)
+
+    return database_id
+
+@celery_instance.task(time_limit=60, ignore_result=True)
+def task_deposit_data(deposit_dict, collection_name):
+    print("Deposition", file=sys.stderr, flush=True)
+
+    try:
+        _deposit(deposit_dict)
+    finally:
+        _sync_deposition_journal()
+
     return "Done"
 
+@celery_instance.task(time_limit=60*10)
+def task_deposit_batch(deposit_dicts, collection_name):
+    print(f"Batch Deposition of {len(deposit_dicts)} spectra", file=sys.stderr, flush=True)
+
+    try:
+        database_ids = [_deposit(deposit_dict) for deposit_dict in deposit_dicts]
+    finally:
+        _sync_deposition_journal()
+
+    return database_ids
+
+@celery_instance.task(time_limit=60*10)
+def task_deposit_spooled(deposit_id):
+    print(f"Spooled Deposition {deposit_id}", file=sys.stderr, flush=True)
+
+    # Already deposited, e.g. the same payload was submitted twice
+    receipt = load_receipt(deposit_id)
+    if receipt is not None:
+        return receipt["database_ids"]
+
+    deposit_dicts = load_depositions(deposit_id)
+    if deposit_dicts is None:
+        raise FileNotFoundError(f"No staged depositions found for {deposit_id}")
+
+    # Stable ids, so depositions stored before a failure are overwritten, not duplicated, on retry
+    database_ids = staged_database_ids(deposit_id, len(deposit_dicts))
+    try:
+        for deposit_dict, database_id in zip(deposit_dicts, database_ids):
+            _deposit(deposit_dict, database_id)
+    finally:
+        _sync_deposition_journal()
+
+    # The receipt is only written once the depositions are on disk
+    complete_depositions(deposit_id, database_ids)
+
+    return database_ids
+
+def _load_deposition_entry(json_filename:str)->dict:
+    """ Loads and cleans the metadata of a single deposition. The metadata sidecar
+    is used when it is up to date; otherwise the peaks are skipped while parsing, so memory
+    does not scale with spectrum size, and the missing sidecar is written.
+
+    Args:
+        json_filename (str): Path to the deposition JSON file.
+
+    Returns:
+        dict: The cleaned metadata entry.
+    """
+    database_id = os.path.basename(json_filename).replace(".json", "")
+
+    entry = load_metadata_sidecar(database_id, json_filename)
+    if entry is None:
+        entry = load_json_metadata(json_filename)
+        write_metadata_sidecar(database_id, entry)
+
+    entry["database_id"] = database_id
+
+    return _clean_deposition_entry(entry)
+
+def _clean_deposition_entry(entry:dict)->dict:
+    """ Cleans the metadata of a single deposition in place.
+
+    Args:
+        entry (dict): The deposition metadata, including 'database_id'.
+
+    Returns:
+        dict: The cleaned metadata entry.
+    """
+    # Clean 'NCBI taxid' to be int or None using regex
+    try:
+        txid = entry.get("NCBI taxid", None)
+        if (txid is not None):
+            # Extract digits using regex
+            match = re.search(r'\d+', str(txid))
+            if match:
+                entry["NCBI taxid"] = int(match.group(0))
+                if str(entry["NCBI taxid"]) != str(txid):
+                    print(f"Updated NCBI taxid from {txid} to {entry['NCBI taxid']}", file=sys.stderr, flush=True)
+
+    except Exception:
+        print(f"Error parsing NCBI taxid {txid}", file=sys.stderr, flush=True)
+        # Print full exception (without stacktrace)
+        print(traceback.format_exc(), file=sys.stderr, flush=True)
+
+    # Clean the 'Genabnk accession' to take whatever is after a space, colon, or pipe
+    try:
+        gb_acc = entry.get("Genbank accession", None)
+        if (isinstance(gb_acc, str)) or (gb_acc is not None):
+            gb_acc = str(gb_acc)
+            # Remove all training and preceding whitespace/delimiters
+            gb_acc = gb_acc.strip()
+            gb_acc = re.sub(r'^[\s:|]+', '', gb_acc)
+            gb_acc = re.sub(r'[\s:|]+$', '', gb_acc)
+            # Split by space, colon, or pipe and take the last part
+            parts = re.split(r'[ :|]', str(gb_acc))
+            if len(parts) > 1:
+                entry["Genbank accession"] = parts[-1].strip()
+                print(f"Updated Genbank accession from {gb_acc} to {entry['Genbank accession']}", file=sys.stderr, flush=True)
+    except Exception:
+        print(f"Error parsing Genbank accession {gb_acc}", file=sys.stderr, flush=True)
+        # Print full exception (without stacktrace)
+        print(traceback.format_exc(), file=sys.stderr, flush=True)
+
+    # Add default licensing information if missing
+    if "License" not in entry:
+        entry["License"] = "CC-BY-NC 4.0"
+    if "Data Source" not in entry:
+        entry["Data Source"] = "IDBac Library Spectrum"
+
+    # Drop all the peaks to save memory
+    entry.pop("spectrum", None)
+
+    return entry
+
+def _load_deposition_chunk(json_filenames:list)->list:
+    """ Loads a chunk of depositions, this is the unit of work for the ingest pool.
+
+    Args:
+        json_filenames (list): Paths to the deposition JSON files.
+
+    Returns:
+        list: The cleaned metadata entries, in the same order as json_filenames.
+    """
+    return [_load_deposition_entry(json_filename) for json_filename in json_filenames]
+
+def _ingest_depositions(all_json_entries:list)->list:
+    """ Loads the metadata of all depositions, in parallel over chunks of files.
+    Falls back to loading in-process if a process pool cannot be started
+    (e.g. inside a daemonic worker process).
+
+    Args:
+        all_json_entries (list): Paths to the deposition JSON files.
+
+    Returns:
+        list: The cleaned metadata entries.
+    """
+    chunks = [all_json_entries[i:i + INGEST_CHUNK_SIZE] for i in range(0, len(all_json_entries), INGEST_CHUNK_SIZE)]
+
+    spectra_list = []
+    if INGEST_WORKERS > 1 and len(chunks) > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=INGEST_WORKERS) as executor:
+                for i, entries in enumerate(executor.map(_load_deposition_chunk, chunks)):
+                    spectra_list.extend(entries)
+                    print(f"Ingested chunk {i + 1}/{len(chunks)}", file=sys.stderr, flush=True)
+            return spectra_list
+        except (AssertionError, OSError, BrokenProcessPool):
+            print("Unable to use process pool for ingest, falling back to serial", file=sys.stderr, flush=True)
+            print(traceback.format_exc(), file=sys.stderr, flush=True)
+            spectra_list = []
+
+    for i, chunk in enumerate(chunks):
+        spectra_list.extend(_load_deposition_chunk(chunk))
+        print(f"Ingested chunk {i + 1}/{len(chunks)}", file=sys.stderr, flush=True)
+
+    return spectra_list
+
+def _build_missing_pyramids(all_json_entries:list, journal_ids:list):
+    """ Writes the raw spectrum pyramids that are missing or older than their deposition,
+    e.g. for depositions made before pyramids existed, and rewrites those that still hold
+    a copy of the full resolution.
+
+    Args:
+        all_json_entries (list): Paths to the deposition JSON files.
+        journal_ids (list): Database ids of the depositions in the journal.
+    """
+    built_count = 0
+    for json_filename in all_json_entries:
+        database_id = os.path.basename(json_filename).replace(".json", "")
+        pyramid_path = pyramid_sidecar_path(database_id)
+        if os.path.exists(pyramid_path) and os.path.getmtime(pyramid_path) >= os.path.getmtime(json_filename) and load_pyramid_lengths(database_id) is not None:
+            continue
+        try:
+            with open(json_filename) as f:
+                write_pyramid_sidecar(database_id, json.load(f).get("spectrum", []))
+            built_count += 1
+        except Exception:
+            print(f"Error building pyramid for {json_filename}", file=sys.stderr, flush=True)
+            print(traceback.format_exc(), file=sys.stderr, flush=True)
+
+    for database_id in journal_ids:
+        # Pyramids without the full resolution lengths still hold a copy of the full level
+        if load_pyramid_lengths(database_id) is not None:
+            continue
+        deposition = read_deposition(database_id)
+        if deposition is None:
+            continue
+        try:
+            write_pyramid_sidecar(database_id, deposition.get("spectrum", []))
+            built_count += 1
+        except Exception:
+            print(f"Error building pyramid for {database_id}", file=sys.stderr, flush=True)
+            print(traceback.format_exc(), file=sys.stderr, flush=True)
+
+    print(f"Built {built_count} raw spectrum pyramids", file=sys.stderr, flush=True)
+
 @celery_instance.task(time_limit=60*60*23) # 23 Hours
 def task_summarize_depositions():
     print("Summarize", file=sys.stderr, flush=True)
 
-    all_json_entries = glob.glob("database/depositions/**/*.json", recursive=True)
-    
-    spectra_list = []
+    # Receipts of old spooled deposits are no longer polled
+    removed_receipts = sweep_receipts()
+    if removed_receipts > 0:
+        print(f"Removed {removed_receipts} expired deposit receipts", file=sys.stderr, flush=True)
 
-    for json_filename in all_json_entries:
-        print(json_filename, file=sys.stderr, flush=True)
-        with open(json_filename, "r") as f:
-            entry = json.loads(f.read())
-            entry["database_id"] = os.path.basename(json_filename).replace(".json", "")
-            # Clean 'NCBI taxid' to be int or None using regex
-            try:
-                txid = entry.get("NCBI taxid", None)
-                if (txid is not None):
-                    # Extract digits using regex
-                    match = re.search(r'\d+', str(txid))
-                    if match:
-                        entry["NCBI taxid"] = int(match.group(0))
-                        if str(entry["NCBI taxid"]) != str(txid):
-                            print(f"Updated NCBI taxid from {txid} to {entry['NCBI taxid']}", file=sys.stderr, flush=True)
-
-            except Exception:
-                print(f"Error parsing NCBI taxid {txid}", file=sys.stderr, flush=True)
-                # Print full exception (without stacktrace)
-                print(traceback.format_exc(), file=sys.stderr, flush=True)
-
-            # Clean the 'Genabnk accession' to take whatever is after a space, colon, or pipe
-            try:
-                gb_acc = entry.get("Genbank accession", None)
-                if (isinstance(gb_acc, str)) or (gb_acc is not None):
-                    gb_acc = str(gb_acc)
-                    # Remove all training and preceding whitespace/delimiters
-                    gb_acc = gb_acc.strip()
-                    gb_acc = re.sub(r'^[\s:|]+', '', gb_acc)
-                    gb_acc = re.sub(r'[\s:|]+$', '', gb_acc)
-                    # Split by space, colon, or pipe and take the last part
-                    parts = re.split(r'[ :|]', str(gb_acc))
-                    if len(parts) > 1:
-                        entry["Genbank accession"] = parts[-1].strip()
-                        print(f"Updated Genbank accession from {gb_acc} to {entry['Genbank accession']}", file=sys.stderr, flush=True)
-            except Exception:
-                print(f"Error parsing Genbank accession {gb_acc}", file=sys.stderr, flush=True)
-                # Print full exception (without stacktrace)
-                print(traceback.format_exc(), file=sys.stderr, flush=True)
-
-            # Add default licensing information if missing
-            if "License" not in entry:
-                entry["License"] = "CC-BY-NC 4.0"
-            if "Data Source" not in entry:
-                entry["Data Source"] = "IDBac Library Spectrum"
-
-            # Drop all the peaks to save memory
-            entry.pop("spectrum", None)
-
-            spectra_list.append(entry)
+    all_json_entries = glob.glob(os.path.join(DEPOSITIONS_FOLDER, "**/*.json"), recursive=True)
+    
+    start_time = time()
+    print(f"Ingesting {len(all_json_entries)} depositions", file=sys.stderr, flush=True)
+    spectra_list = _ingest_depositions(all_json_entries)
+
+    # Journaled depositions, their metadata comes straight from the journal index
+    journal_ids = []
+    if os.path.isdir(JOURNAL_FOLDER):
+        compact_journal(JOURNAL_FOLDER)
+        for database_id, entry in iter_metadata(JOURNAL_FOLDER):
+            entry["database_id"] = database_id
+            journal_ids.append(database_id)
+            spectra_list.append(_clean_deposition_entry(entry))
+    print(f"Ingesting depositions took {(time() - start_time):.2f} seconds", file=sys.stderr, flush=True)
     
     # clean up all entries by removing whitespace for each key
     new_spectra_list = []
@@ -136,36 +373,67 @@ def task_summarize_depositions():
         task_summarize_depositions.apply_async(countdown=2*60*60)   # Retry in 2 hours
         return "No species populated, requeuing task"
 
-    # Save the spectra list to a file
-    print("Writing to json", file=sys.stderr, flush=True)
-    with open("database/summary.json", "w") as f:
-        f.write(json.dumps(spectra_list))
-
-    # Summarizing the spectra
-    print("Writing to tsv", file=sys.stderr, flush=True)
-    df = pd.DataFrame(spectra_list)
-
-    # Saving the summary
-    df.to_csv("database/summary.tsv", index=False, sep="\t")
-
-    # Save summary statistics
-    summary_statistics = {
-        "num_entries": len(df),
-        "num_genera": len(df["genus"].unique())
-    }
-    with open("database/summary_statistics.json", "w") as f:
-        f.write(json.dumps(summary_statistics))
+    # The outputs are written to a new release, published once everything is written
+    release_folder = create_release()
+    try:
+        # Save the spectra list to a file
+        print("Writing to json", file=sys.stderr, flush=True)
+        with open(os.path.join(release_folder, "summary.json"), "w") as f:
+            f.write(json.dumps(spectra_list))
+
+        # Summarizing the spectra
+        print("Writing to tsv", file=sys.stderr, flush=True)
+        df = pd.DataFrame(spectra_list)
+
+        # Keeping the QC metrics of the last workflow run, they are refreshed once nextflow finishes
+        df = merge_qc_metrics(df)
+
+        # Saving the summary, with a typed columnar copy of the TSV as readers see it
+        df.to_csv(os.path.join(release_folder, SUMMARY_TSV_FILENAME), index=False, sep="\t")
+        write_summary_table(read_summary_tsv(os.path.join(release_folder, SUMMARY_TSV_FILENAME)), os.path.join(release_folder, SUMMARY_ARROW_FILENAME))
+
+        # Prebuilt downloads of the spectra list
+        build_exports(df, os.path.join(release_folder, EXPORT_FOLDER_NAME))
+
+        # Save summary statistics
+        summary_statistics = {
+            "num_entries": len(df),
+            "num_genera": len(df["genus"].unique()),
+            "taxonomy_distribution": {},
+        }
+
+        # Precompute the pie chart counts for every taxonomic rank on the knowledgebase page
+        for taxonomic_rank in TAXONOMY_DISTRIBUTION_RANKS:
+            counts_df, count_16S, total_count = compute_taxonomy_distribution(df, taxonomic_rank)
+            summary_statistics["taxonomy_distribution"][taxonomic_rank] = {
+                "counts": dict(zip(counts_df[taxonomic_rank].astype(str), counts_df["count"].astype(int).tolist())),
+                "count_16S": count_16S,
+                "total_count": total_count,
+            }
+        with open(os.path.join(release_folder, "summary_statistics.json"), "w") as f:
+            f.write(json.dumps(summary_statistics))
+
+        # Calculate checksum for the database
+        checksum = calculate_checksum(os.path.join(release_folder, "summary.json"))
+        with open(os.path.join(release_folder, "summary.json.sha256"), "w") as f:
+            f.write(checksum)
+    except Exception:
+        discard_release(release_folder)
+        raise
+
+    # Swapping in the release, the workers are notified to reload it
+    publish_release(release_folder)
+
+    # Multi-resolution copies of the raw spectra for the raw viewer
+    start_time = time()
+    _build_missing_pyramids(all_json_entries, journal_ids)
+    print(f"Building raw spectrum pyramids took {(time() - start_time):.2f} seconds", file=sys.stderr, flush=True)
 
     # Update taxonomic tree
     generate_tree(df[df['NCBI taxid'].notna()]['NCBI taxid'])
 
     # Calling the nextflow script
     task_summarize_nextflow.delay()
-
-    # Calculate checksum for the database
-    checksum = calculate_checksum("database/summary.json")
-    with open("database/summary.json.sha256", "w") as f:
-        f.write(checksum)
     return "Done"
 
 
@@ -183,7 +451,7 @@ def task_summarize_nextflow():
     if dev_mode:
         cmd = "cd /workflows/idbac_summarize_database/ && \
         nextflow run /workflows/idbac_summarize_database/nf_workflow.nf \
-        --input_database /database/summary.json \
+        --input_database /database/releases/current/summary.json \
         -profile docker \
         -c workflows/idbac_summarize_database/nextflow.config"
     else:
@@ -197,6 +465,51 @@ def task_summarize_nextflow():
 
     os.system(cmd)
 
+    # Packing the processed spectra, so pages read them without opening one file per entry
+    if dev_mode:
+        nextflow_output_folder = "workflows/idbac_summarize_database/nf_output"
+    else:
+        nextflow_output_folder = "/app/workflows/idbac_summarize_database/nf_output"
+
+    for bin_width in [1, 5, 10]:
+        bin_folder = os.path.join(nextflow_output_folder, f"{bin_width}_da_bin")
+        if not os.path.isdir(bin_folder):
+            continue
+        try:
+            start_time = time()
+            build_processed_spectra_store(bin_folder)
+            print(f"Built processed spectra store for {bin_width} Da bins in {time() - start_time:.1f} seconds", file=sys.stderr, flush=True)
+        except Exception as e:
+            print(f"Failed to build processed spectra store for {bin_width} Da bins: {e}", file=sys.stderr, flush=True)
+            traceback.print_exc()
+
+    # QC metrics on the spectra shown in the gallery, added as columns of the summary
+    try:
+        start_time = time()
+        qc_df = compute_qc_metrics(
+            os.path.join(nextflow_output_folder, "10_da_bin", STORE_FOLDER_NAME),
+            os.path.join(nextflow_output_folder, "idbac_database_scanmapping.tsv"),
+        )
+        qc_df.to_csv(QC_METRICS_PATH, index=False, sep="\t")
+
+        # A new release with the summary and exports rewritten, the other files are unchanged
+        release_folder = create_release(carry_over=["summary.json", "summary.json.sha256", "summary_statistics.json"])
+        try:
+            # Read as text, so the other columns are written back unchanged
+            summary_df = pd.read_csv(release_path(SUMMARY_TSV_FILENAME), sep="\t", dtype=str, keep_default_na=False)
+            summary_df = merge_qc_metrics(summary_df)
+            summary_df.to_csv(os.path.join(release_folder, SUMMARY_TSV_FILENAME), index=False, sep="\t")
+            write_summary_table(read_summary_tsv(os.path.join(release_folder, SUMMARY_TSV_FILENAME)), os.path.join(release_folder, SUMMARY_ARROW_FILENAME))
+            build_exports(summary_df, os.path.join(release_folder, EXPORT_FOLDER_NAME))
+        except Exception:
+            discard_release(release_folder)
+            raise
+        publish_release(release_folder)
+        print(f"Computed QC metrics for {len(qc_df)} entries in {time() - start_time:.1f} seconds", file=sys.stderr, flush=True)
+    except Exception as e:
+        print(f"Failed to compute QC metrics: {e}", file=sys.stderr, flush=True)
+        traceback.print_exc()
+
 
 # celery_instance.conf.beat_schedule = {
 #     "cleanup": {
@@ -209,6 +522,8 @@ def task_summarize_nextflow():
 celery_instance.conf.task_routes = {
     'tasks.task_computeheartbeat': {'queue': 'depositionworker'},
     'tasks.task_deposit_data': {'queue': 'depositionworker'},
+    'tasks.task_deposit_batch': {'queue': 'depositionworker'},
+    'tasks.task_deposit_spooled': {'queue': 'depositionworker'},
 
     'tasks.task_summarize_depositions': {'queue': 'summaryworker'},
     'tasks.task_summarize_nextflow': {'queue': 'summaryworker'},
@@ -0,0 +1,309 @@
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+from urllib.parse import quote
+
+import numpy as np
+
+from utils import fetch_with_retry
+from data_loader import redis_client
+
+USI_RESOLVER_URL = "https://metabolomics-usi.gnps2.org/json/"
+
+# Resolved spectra kept per worker
+USI_CACHE_SIZE = 256
+USI_CACHE_TTL = 60 * 60     # Seconds
+
+# Background fetches, so slow upstreams never hold a request thread
+USI_FETCH_WORKERS = 4
+USI_FAILURE_TTL = 60        # Seconds before a failed USI is fetched again
+USI_LOCK_TIMEOUT = 120      # Longer than fetch_with_retry takes to give up
+
+USI_PENDING = "pending"
+USI_READY = "ready"
+USI_FAILED = "failed"
+
+# Shared by all gunicorn workers, so a background fetch started by one worker
+# is picked up by the polling requests of the others
+CACHE_KEY_PREFIX = 'usi_cache'
+
+_usi_cache = OrderedDict()  # usi -> (expires_at, peaks)
+_usi_failures = {}          # usi -> expires_at
+_in_flight = {}             # usi -> _Flight
+_background = set()         # usis fetched in the background by this worker
+_lock = threading.Lock()
+_fetch_executor = ThreadPoolExecutor(max_workers=USI_FETCH_WORKERS, thread_name_prefix="usi-fetch")
+
+class _Flight:
+    """ A fetch shared by all requests for the same USI. """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.peaks = None
+        self.error = None
+
+def _fetch_usi_peaks(usi:str, resolver_url:str)->np.ndarray:
+    """ Fetches a spectrum from the USI resolver.
+
+    Args:
+        usi (str): The USI of the spectrum.
+        resolver_url (str): The JSON endpoint of the resolver.
+
+    Returns:
+        np.ndarray: (n, 2) array of [mz, intensity] sorted by mz, None if the resolver returned no peaks key.
+    """
+    response_text = fetch_with_retry(f"{resolver_url}?usi1={quote(usi, safe='')}")
+
+    j = json.loads(response_text) # j['peaks] is a list of lists [[mz, intensity], ...]
+    if 'peaks' not in j:
+        logging.error(f"Failed to fetch spectrum for USI {usi}. Response: {j}")
+        return None
+
+    peaks = np.asarray(j['peaks'], dtype=np.float64).reshape(-1, 2)
+    return peaks[np.argsort(peaks[:, 0], kind="stable")]
+
+def _redis_key(usi:str, suffix:str)->str:
+    return f"{CACHE_KEY_PREFIX}:{hashlib.sha1(usi.encode('utf-8')).hexdigest()}:{suffix}"
+
+def get_cached_usi_peaks(usi:str)->np.ndarray:
+    """ Returns the peaks of a USI if they are cached and fresh, locally or in Redis.
+
+    Args:
+        usi (str): The USI of the spectrum.
+
+    Returns:
+        np.ndarray: (n, 2) array of [mz, intensity], None if not cached.
+    """
+    with _lock:
+        entry = _usi_cache.get(usi)
+        if entry is not None:
+            if entry[0] >= time():
+                _usi_cache.move_to_end(usi)
+                return entry[1]
+            del _usi_cache[usi]
+
+    if redis_client is None:
+        return None
+
+    try:
+        peaks_bytes = redis_client.get(_redis_key(usi, "peaks"))
+    except Exception as e:
+        logging.error(f"Error reading USI cache: {e}")
+        return None
+    if peaks_bytes is None:
+        return None
+
+    peaks = np.frombuffer(peaks_bytes, dtype=np.float64).reshape(-1, 2)
+    _store_usi_peaks(usi, peaks, shared=False)
+    return peaks
+
+def _store_usi_peaks(usi:str, peaks:np.ndarray, shared:bool=True):
+    with _lock:
+        _usi_cache[usi] = (time() + USI_CACHE_TTL, peaks)
+        _usi_cache.move_to_end(usi)
+        while len(_usi_cache) > USI_CACHE_SIZE:
+            _usi_cache.popitem(last=False)
+
+    if shared and redis_client is not None:
+        try:
+            redis_client.set(_redis_key(usi, "peaks"), np.ascontiguousarray(peaks, dtype=np.float64).tobytes(), ex=USI_CACHE_TTL)
+        except Exception as e:
+            logging.error(f"Error writing USI cache: {e}")
+
+def _store_usi_failure(usi:str):
+    with _lock:
+        _usi_failures[usi] = time() + USI_FAILURE_TTL
+
+    if redis_client is not None:
+        try:
+            redis_client.set(_redis_key(usi, "failed"), b"1", ex=USI_FAILURE_TTL)
+        except Exception as e:
+            logging.error(f"Error writing USI cache: {e}")
+
+def _has_recent_failure(usi:str)->bool:
+    with _lock:
+        expires_at = _usi_failures.get(usi)
+        if expires_at is not None:
+            if expires_at >= time():
+                return True
+            del _usi_failures[usi]
+
+    if redis_client is None:
+        return False
+    try:
+        return redis_client.exists(_redis_key(usi, "failed")) > 0
+    except Exception as e:
+        logging.error(f"Error reading USI cache: {e}")
+        return False
+
+def resolve_usi(usi:str, resolver_url:str=USI_RESOLVER_URL)->np.ndarray:
+    """ Returns the peaks of a USI. Resolved spectra are cached, and concurrent
+    requests for the same USI wait for a single fetch.
+
+    Args:
+        usi (str): The USI of the spectrum.
+        resolver_url (str, optional): The JSON endpoint of the resolver.
+
+    Returns:
+        np.ndarray: (n, 2) array of [mz, intensity] sorted by mz, None if the USI could not be resolved.
+    """
+    peaks = get_cached_usi_peaks(usi)
+    if peaks is not None:
+        return peaks
+
+    with _lock:
+        flight = _in_flight.get(usi)
+        is_leader = flight is None
+        if is_leader:
+            flight = _Flight()
+            _in_flight[usi] = flight
+
+    if not is_leader:
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.peaks
+
+    try:
+        flight.peaks = _fetch_usi_peaks(usi, resolver_url)
+        if flight.peaks is not None:
+            _store_usi_peaks(usi, flight.peaks)
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with _lock:
+            del _in_flight[usi]
+        flight.done.set()
+
+    return flight.peaks
+
+def _resolve_in_background(usi:str, resolver_url:str):
+    try:
+        if resolve_usi(usi, resolver_url) is None:
+            _store_usi_failure(usi)
+    except Exception as e:
+        logging.error(f"Failed to resolve USI {usi}: {e}")
+        _store_usi_failure(usi)
+    finally:
+        with _lock:
+            _background.discard(usi)
+        if redis_client is not None:
+            try:
+                redis_client.delete(_redis_key(usi, "lock"))
+            except Exception as e:
+                logging.error(f"Error releasing USI fetch lock: {e}")
+
+def request_usi(usi:str, resolver_url:str=USI_RESOLVER_URL)->tuple:
+    """ Returns the peaks of a USI without blocking. If they are not cached yet,
+    a background fetch is started (once across all workers) and the caller is
+    expected to poll again.
+
+    Args:
+        usi (str): The USI of the spectrum.
+        resolver_url (str, optional): The JSON endpoint of the resolver.
+
+    Returns:
+        tuple: (status, peaks), status is USI_READY, USI_PENDING or USI_FAILED. peaks
+               is an (n, 2) array of [mz, intensity] when ready, None otherwise.
+    """
+    peaks = get_cached_usi_peaks(usi)
+    if peaks is not None:
+        return USI_READY, peaks
+
+    if _has_recent_failure(usi):
+        return USI_FAILED, None
+
+    with _lock:
+        if usi in _background:
+            return USI_PENDING, None
+        _background.add(usi)
+
+    # Another worker is already fetching it
+    if redis_client is not None:
+        try:
+            lock_acquired = redis_client.set(_redis_key(usi, "lock"), b"1", nx=True, ex=USI_LOCK_TIMEOUT)
+        except Exception as e:
+            logging.error(f"Error acquiring USI fetch lock: {e}")
+            lock_acquired = True
+        if not lock_acquired:
+            with _lock:
+                _background.discard(usi)
+            return USI_PENDING, None
+
+    _fetch_executor.submit(_resolve_in_background, usi, resolver_url)
+    return USI_PENDING, None
+
+def _start_stand_in_resolver(request_log:list):
+    """ Starts a local, slow stand-in for the USI resolver. Returns the server and its URL. """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from time import sleep
+
+    class ResolverHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            request_log.append(self.path)
+            sleep(0.2)  # Slow upstream, so the requests overlap
+            body = json.dumps({"peaks": [[3000.5, 10.0], [2000.25, 5.0]]}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ResolverHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/json/"
+
+def test_resolve_usi_single_flight():
+    request_log = []
+    server, resolver_url = _start_stand_in_resolver(request_log)
+    usi = "mzspec:TEST:single_flight:scan:1"
+
+    try:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda _: resolve_usi(usi, resolver_url), range(8)))
+
+        assert len(request_log) == 1, f"Expected one upstream request, got {len(request_log)}"
+        for peaks in results:
+            assert np.array_equal(peaks, np.array([[2000.25, 5.0], [3000.5, 10.0]]))
+
+        # Served from the cache
+        resolve_usi(usi, resolver_url)
+        assert len(request_log) == 1
+    finally:
+        server.shutdown()
+        with _lock:
+            _usi_cache.pop(usi, None)
+
+def test_request_usi_background():
+    from time import sleep
+
+    request_log = []
+    server, resolver_url = _start_stand_in_resolver(request_log)
+    usi = "mzspec:TEST:background:scan:1"
+
+    try:
+        status, peaks = request_usi(usi, resolver_url)
+        assert status == USI_PENDING and peaks is None
+
+        # Polling does not start another fetch
+        for _ in range(50):
+            status, peaks = request_usi(usi, resolver_url)
+            if status != USI_PENDING:
+                break
+            sleep(0.05)
+
+        assert status == USI_READY, f"Expected {USI_READY}, got {status}"
+        assert np.array_equal(peaks, np.array([[2000.25, 5.0], [3000.5, 10.0]]))
+        assert len(request_log) == 1
+    finally:
+        server.shutdown()
+        with _lock:
+            _usi_cache.pop(usi, None)
@@ -15,6 +15,7 @@ import traceback
 import sys
 import pytest
 import random
+import ijson
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 
 dev_mode = False
@@ -484,59 +485,62 @@ def generate_tree(taxid_list):
     else:
         tree.write(format=0, outfile="/app/assets/tree.nwk")
 
-def convert_to_mzml(json_run:Path):
+def convert_to_mzml(json_run):
     """Converts a json run to an mzML file using psims. Returns in a BytesIO object.
 
     Args:
-        json_run (Path): The path to the json run file.
+        json_run (Path or dict): The path to the json run file, or the already loaded run.
 
     Returns:
         BytesIO: The mzML file as a BytesIO object.
     """
 
-    json_run = Path(str(json_run))
-    if not json_run.exists():
-        raise FileNotFoundError(f"File {json_run} not found")
+    if isinstance(json_run, dict):
+        run_dict = json_run
+    else:
+        json_run = Path(str(json_run))
+        if not json_run.exists():
+            raise FileNotFoundError(f"File {json_run} not found")
 
-    output_bytes = BytesIO()
+        with open(json_run, 'r') as file_handle:
+            run_dict = json.load(file_handle)
 
-    with open(json_run, 'r') as file_handle:
-        run_dict = json.load(file_handle)
+    output_bytes = BytesIO()
 
-        other_keys = set(list(run_dict.keys()))
-        other_keys.remove("spectrum")
-        other_keys = sorted(list(other_keys))
+    other_keys = set(list(run_dict.keys()))
+    other_keys.remove("spectrum")
+    other_keys = sorted(list(other_keys))
 
-        with MzMLWriter(output_bytes, close=False) as out:
-            out.controlled_vocabularies()
+    with MzMLWriter(output_bytes, close=False) as out:
+        out.controlled_vocabularies()
 
-            # Write the metadata as user parameters
-            
-            params = {}
-            params['id'] = 'global_metadata'
-            for key in other_keys:
-                params[f'_{key}'] = run_dict[key] # Prevent resolutions for existing
-
-            out.reference_param_group_list([
-                params
-            ])
-               
-            with out.run(id="admin_qc_download"):
-                with out.spectrum_list(count=len(run_dict["spectrum"])):
-                    scan = 1
-                    for spectrum in run_dict["spectrum"]:
-                        mz_array = [x[0] for x in spectrum]
-                        intensity_array = [x[1] for x in spectrum]
-
-                        out.write_spectrum(
-                            mz_array, intensity_array,
-                            id="scan={}".format(scan),
-                            params=[
-                                "MS1 Spectrum",
-                                {"ms level": 1},
-                                {"total ion current": sum(intensity_array)}
-                            ])
-                        scan += 1
+        # Write the metadata as user parameters
+        
+        params = {}
+        params['id'] = 'global_metadata'
+        for key in other_keys:
+            params[f'_{key}'] = run_dict[key] # Prevent resolutions for existing
+
+        out.reference_param_group_list([
+            params
+        ])
+           
+        with out.run(id="admin_qc_download"):
+            with out.spectrum_list(count=len(run_dict["spectrum"])):
+                scan = 1
+                for spectrum in run_dict["spectrum"]:
+                    mz_array = [x[0] for x in spectrum]
+                    intensity_array = [x[1] for x in spectrum]
+
+                    out.write_spectrum(
+                        mz_array, intensity_array,
+                        id="scan={}".format(scan),
+                        params=[
+                            "MS1 Spectrum",
+                            {"ms level": 1},
+                            {"total ion current": sum(intensity_array)}
+                        ])
+                    scan += 1
 
     return output_bytes
 
@@ -560,6 +564,115 @@ def calculate_checksum(file_path, algorithm='sha256', chunk_size=65536):
     
     return hash_function.hexdigest()
 
+def compute_taxonomy_distribution(summary_df:pd.DataFrame, selected_taxonomy:str):
+    """
+    Counts the database entries per taxon at a taxonomic rank. Entries without a
+    taxonomy at that rank but with a user submitted 16S taxonomy are counted
+    separately (for genus, the 16S taxonomy is used instead).
+
+    Args:
+        summary_df (pd.DataFrame): The database summary.
+        selected_taxonomy (str): The taxonomic rank, e.g. 'genus'.
+
+    Returns:
+        tuple: (pd.DataFrame with columns [selected_taxonomy, 'count'], number of 16S entries, total number of entries)
+    """
+    # Empty values are missing, as they are once the summary is read back from the TSV
+    if selected_taxonomy in summary_df.columns:
+        taxonomy = summary_df[selected_taxonomy].replace("", np.nan).fillna("No Taxonomy")
+    else:
+        taxonomy = pd.Series("No Taxonomy", index=summary_df.index)
+
+    # Handle 16S
+    if '16S Taxonomy' in summary_df.columns:
+        taxonomy_16S = summary_df['16S Taxonomy'].replace("", np.nan)
+        is_16S = (taxonomy == "No Taxonomy") & (taxonomy_16S.notna())
+    else:
+        taxonomy_16S = pd.Series(None, index=summary_df.index, dtype=object)
+        is_16S = pd.Series(False, index=summary_df.index)
+
+    # Strip the column of whitespace
+    taxonomy = taxonomy.str.strip()
+
+    # If genus, only take the first word
+    if selected_taxonomy == "genus":
+        taxonomy.loc[is_16S] = taxonomy_16S.loc[is_16S]
+        taxonomy.loc[taxonomy != "No Taxonomy"] = taxonomy.loc[taxonomy != "No Taxonomy"].str.split().str[0]
+    else:
+        taxonomy.loc[is_16S] = "User Submitted 16S"
+
+    # Get counts per taxon
+    counts_df = taxonomy.rename(selected_taxonomy).to_frame().groupby([selected_taxonomy]).size().reset_index(name="count")
+
+    count_16S = int(counts_df[counts_df[selected_taxonomy] == "User Submitted 16S"]["count"].sum())
+    total_count = int(counts_df["count"].sum())
+
+    counts_df = counts_df[counts_df[selected_taxonomy] != "User Submitted 16S"]
+    counts_df = counts_df.loc[~ counts_df[selected_taxonomy].isna()]
+
+    return counts_df, count_16S, total_count
+
+def load_json_metadata(json_filename, skip_keys=("spectrum",)):
+    """
+    Load the top-level keys of a JSON object file, without materializing the
+    values of skip_keys. The file is streamed with ijson, so large peak arrays
+    are never held in memory.
+
+    Args:
+        json_filename (str): The path to the JSON file.
+        skip_keys (tuple): Top-level keys whose values should not be loaded. Defaults to ("spectrum",).
+
+    Returns:
+        dict: The top-level key/value pairs, excluding skip_keys.
+    """
+    metadata = {}
+    current_key = None
+    builder = None
+
+    with open(json_filename, "rb") as f:
+        for prefix, event, value in ijson.parse(f, use_float=True):
+            if prefix == "":
+                # Top-level events delimit the values we are collecting
+                if event == "map_key":
+                    if builder is not None:
+                        metadata[current_key] = builder.value
+                    current_key = value
+                    builder = None if value in skip_keys else ijson.ObjectBuilder()
+                    continue
+                if event == "end_map":
+                    if builder is not None:
+                        metadata[current_key] = builder.value
+                    builder = None
+                    continue
+                if event == "start_map":
+                    continue
+
+            if builder is not None:
+                builder.event(event, value)
+
+    return metadata
+
+def test_compute_taxonomy_distribution_matches_tsv(tmp_path):
+    # The summarize task counts the in-memory summary, the fallback counts the TSV
+    summary_df = pd.DataFrame([
+        {"genus": "Bacillus", "family": "Bacillaceae", "16S Taxonomy": ""},
+        {"genus": "", "family": "", "16S Taxonomy": ""},
+        {"genus": "", "family": "", "16S Taxonomy": "Escherichia coli"},
+    ])
+    summary_df.to_csv(os.path.join(tmp_path, "summary.tsv"), sep="\t", index=False)
+    tsv_df = pd.read_csv(os.path.join(tmp_path, "summary.tsv"), sep="\t")
+
+    for rank in ["family", "genus", "species"]:
+        counts_df, count_16S, total_count = compute_taxonomy_distribution(summary_df, rank)
+        tsv_counts_df, tsv_count_16S, tsv_total_count = compute_taxonomy_distribution(tsv_df, rank)
+        assert counts_df.reset_index(drop=True).equals(tsv_counts_df.reset_index(drop=True))
+        assert (count_16S, total_count) == (tsv_count_16S, tsv_total_count)
+        assert total_count == 3
+
+    counts_df, count_16S, _ = compute_taxonomy_distribution(summary_df, "family")
+    assert dict(zip(counts_df["family"], counts_df["count"])) == {"Bacillaceae": 1, "No Taxonomy": 1}
+    assert count_16S == 1
+
 def test_get_ncbi_taxid_from_genbank_1():
     genbank_accession = "JAHOEO000000000"
     taxid = 165179
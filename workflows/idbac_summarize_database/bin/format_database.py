@@ -6,8 +6,80 @@ import pandas as pd
 import json
 from psims.mzml.writer import MzMLWriter
 import logging
+import struct
+import zlib
+import mmap
 
-def process_spectrum(json_filename, out_mzml, scan_mapping_file, json_file, scan_counter, dry_run=False):
+# Deposition journal segments, this must stay in sync with deposition_journal.py
+RECORD_MAGIC = b"IDBJ"
+RECORD_HEADER = struct.Struct("<4sBI26sI")
+RECORD_PUT = 0
+RECORD_DELETE = 1
+
+def load_journal(input_folder):
+    """Loads the live depositions of all journal segments in the input folder.
+
+    Returns a dict of database_id -> (segment_path, offset, payload_length), in deposition order.
+    """
+    segment_paths = glob.glob(os.path.join(input_folder, "**/segment-*.seg"), recursive=True)
+    segment_paths = sorted(segment_paths, key=lambda x: int(os.path.basename(x).split("-")[1].split(".")[0]))
+
+    records = {}
+    for segment_path in segment_paths:
+        file_size = os.path.getsize(segment_path)
+        with open(segment_path, "rb") as f:
+            offset = 0
+            while offset + RECORD_HEADER.size <= file_size:
+                f.seek(offset)
+                magic, record_type, payload_length, database_id, _ = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+                if magic != RECORD_MAGIC or offset + RECORD_HEADER.size + payload_length > file_size:
+                    # Resume at the next record header, if any
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as segment_map:
+                        next_offset = segment_map.find(RECORD_MAGIC, offset + 1)
+                    if next_offset < 0:
+                        logging.warning("Truncated journal segment %s at offset %d", segment_path, offset)
+                        break
+                    logging.warning("Malformed record in %s at offset %d, skipping to offset %d", segment_path, offset, next_offset)
+                    offset = next_offset
+                    continue
+                database_id = database_id.decode("ascii")
+                if record_type == RECORD_DELETE:
+                    records.pop(database_id, None)
+                else:
+                    records.pop(database_id, None)
+                    records[database_id] = (segment_path, offset + RECORD_HEADER.size, payload_length)
+                offset += RECORD_HEADER.size + payload_length
+
+    return records
+
+def load_journal_record(segment_path, payload_offset, payload_length):
+    with open(segment_path, "rb") as f:
+        f.seek(payload_offset - RECORD_HEADER.size)
+        _, _, _, _, checksum = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+        payload = f.read(payload_length)
+    if zlib.crc32(payload) != checksum:
+        logging.warning("Checksum mismatch in %s at offset %d, skipping", segment_path, payload_offset)
+        return None
+    return json.loads(payload)
+
+def load_json_file(json_filename):
+    with open(json_filename, "r") as f:
+        return json.load(f)
+
+def iter_depositions(input_json_folder):
+    """Yields (database_id, loader) for every deposition, JSON files first and then journal records."""
+    all_json_entries = glob.glob(os.path.join(input_json_folder, "**/*.json"), recursive=True)
+    logging.info("Found %d JSON files in the input folder.", len(all_json_entries))
+    for json_filename in all_json_entries:
+        database_id = os.path.basename(json_filename).replace(".json", "")
+        yield database_id, lambda json_filename=json_filename: load_json_file(json_filename)
+
+    journal_records = load_journal(input_json_folder)
+    logging.info("Found %d journal records in the input folder.", len(journal_records))
+    for database_id, location in journal_records.items():
+        yield database_id, lambda location=location: load_journal_record(*location)
+
+def process_spectrum(database_id, spectrum_dict, out_mzml, scan_mapping_file, json_file, scan_counter, dry_run=False):
     if dry_run:
         # Set files to None for safety
         out_mzml = None
@@ -15,11 +87,6 @@ def process_spectrum(json_filename, out_mzml, scan_mapping_file, json_file, scan
         json_file = None
 
 
-    database_id = os.path.basename(json_filename).replace(".json", "")
-    
-    with open(json_filename, "r") as f:
-        spectrum_dict = json.load(f)
-    
     spectrum_dict["database_id"] = database_id
     
     # Write spectrum to JSON file immediately
@@ -28,7 +95,7 @@ def process_spectrum(json_filename, out_mzml, scan_mapping_file, json_file, scan
         json_file.write("\n")
     
     spectrum_list = spectrum_dict["spectrum"]
-    logging.info("Processing %s with %d spectra", json_filename, len(spectrum_list))
+    logging.info("Processing %s with %d spectra", database_id, len(spectrum_list))
     
     instrument_model = spectrum_dict.get("MALDI instrument", "unknown")
     instrument_model = str(instrument_model).strip().lower().replace(" ", "_").replace("-", "_")
@@ -65,17 +132,15 @@ def main():
     
     args = parser.parse_args()
 
-    all_json_entries = glob.glob(os.path.join(args.input_json_folder, "**/*.json"), recursive=True)
-    print(all_json_entries)
-    logging.info("Found %d JSON files in the input folder.", len(all_json_entries))
+    all_depositions = list(iter_depositions(args.input_json_folder))
         
     # Intial Dry Run to get the count of spectra
     dryrun_scan_counter = 1
-    for json_filename in all_json_entries:
-        with open(json_filename, "r") as f:
-            spectrum_dict = json.load(f)
-        spectrum_list = spectrum_dict["spectrum"]
-        dryrun_scan_counter = process_spectrum(json_filename, None, None, None, dryrun_scan_counter, dry_run=True)
+    for database_id, load_deposition in all_depositions:
+        spectrum_dict = load_deposition()
+        if spectrum_dict is None:
+            continue
+        dryrun_scan_counter = process_spectrum(database_id, spectrum_dict, None, None, None, dryrun_scan_counter, dry_run=True)
 
     dryrun_scan_counter = int(dryrun_scan_counter)
     print('dryrun_scan_counter', dryrun_scan_counter)
@@ -92,8 +157,11 @@ def main():
         scan_counter = 1
         with out_mzml.run(id="my_analysis"):
             with out_mzml.spectrum_list(count=dryrun_scan_counter-1):  # Minus 1 since we start from 1
-                for json_filename in all_json_entries:
-                    scan_counter = process_spectrum(json_filename, out_mzml, scan_mapping_file, json_file, scan_counter)
+                for database_id, load_deposition in all_depositions:
+                    spectrum_dict = load_deposition()
+                    if spectrum_dict is None:
+                        continue
+                    scan_counter = process_spectrum(database_id, spectrum_dict, out_mzml, scan_mapping_file, json_file, scan_counter)
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)